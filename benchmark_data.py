@@ -0,0 +1,502 @@
+# Copyright 2023 Dakewe Biotech Corporation. All Rights Reserved.
+# Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+import argparse
+import copy
+import itertools
+import json
+import os
+import platform
+import shutil
+import tempfile
+import time
+from typing import Any, Dict, List
+
+import cv2
+import numpy as np
+import torch
+import yaml
+from torch.utils.data import IterableDataset, default_collate
+from torchvision.transforms import functional as F_vision
+
+from dataset import ImageManifest, PinnedBatchCollator
+from imgproc import image_to_tensor, random_rotate_torch, random_rotate_batch_torch, AugmentationPlan
+from train import build_train_dataset, build_train_dataloader
+from utils import load_resume_data_state
+
+_STAGES = ["read", "decode", "to_float", "resize", "cvt_color", "to_tensor"]
+
+
+def make_synthetic_images(images_dir: str, num_images: int, image_size: int, seed: int) -> None:
+    """Write random JPEG images, smooth enough to compress like photos
+
+    Args:
+        images_dir (str): Output dir
+        num_images (int): Number of images
+        image_size (int): Width and height of the images
+        seed (int): Seed of the image content
+    """
+    os.makedirs(images_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    for index in range(num_images):
+        image = rng.integers(0, 256, (image_size // 8, image_size // 8, 3), dtype=np.uint8)
+        image = cv2.resize(image, (image_size, image_size), interpolation=cv2.INTER_LINEAR)
+        cv2.imwrite(os.path.join(images_dir, f"{index:06d}.jpg"), image)
+
+
+def benchmark_stages(images_dir: str, image_size: int, num_images: int) -> Dict[str, Any]:
+    """Time every step of the default (float) decoding path of ``ImageDataset`` on the first images of a dir
+
+    Args:
+        images_dir (str): Images dir
+        image_size (int): Size of the images after resizing
+        num_images (int): Number of images to time
+
+    Returns:
+        stages (dict): Milliseconds per image and share of the total of every stage
+    """
+    image_file_paths = ImageManifest(images_dir).file_paths[:num_images]
+    if not image_file_paths:
+        raise ValueError(f"No images found in `{images_dir}`.")
+
+    stage_times = {stage: 0.0 for stage in _STAGES}
+    for image_file_path in image_file_paths:
+        start_time = time.perf_counter()
+        with open(image_file_path, "rb") as f:
+            image_bytes = np.frombuffer(f.read(), np.uint8)
+        stage_times["read"] += time.perf_counter() - start_time
+
+        # Same steps, in the same order, as `_imread` and `_preprocess_image` in dataset.py
+        start_time = time.perf_counter()
+        image = cv2.imdecode(image_bytes, cv2.IMREAD_COLOR)
+        stage_times["decode"] += time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        image = image.astype(np.float32) / 255.
+        stage_times["to_float"] += time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        image = cv2.resize(image, (image_size, image_size), interpolation=cv2.INTER_CUBIC)
+        stage_times["resize"] += time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        stage_times["cvt_color"] += time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        image_to_tensor(image, True, False)
+        stage_times["to_tensor"] += time.perf_counter() - start_time
+
+    total_time = sum(stage_times.values())
+    return {stage: {"ms_per_image": stage_time * 1000 / len(image_file_paths),
+                    "share": stage_time / total_time}
+            for stage, stage_time in stage_times.items()}
+
+
+def benchmark_loader(config: Any, num_batches: int, num_warmup_batches: int) -> Dict[str, float]:
+    """Load ``num_batches`` batches through the dataset and data loader built by train.py from ``config``
+
+    Args:
+        config (Any): Training config, ``TRAIN.HYP`` holds the loader settings of this run
+        num_batches (int): Number of timed batches
+        num_warmup_batches (int): Number of batches loaded before timing, covers the worker start-up
+
+    Returns:
+        result (dict): Images per second, mean and max time per batch (ms)
+    """
+    train_datasets, train_sampler = build_train_dataset(config)
+    train_dataloader = build_train_dataloader(config, train_datasets, train_sampler)
+    batch_size = config["TRAIN"]["HYP"]["IMGS_PER_BATCH"]
+
+    batch_times = []
+    data_iter = _repeat(train_dataloader)
+    for _ in range(num_warmup_batches):
+        next(data_iter)
+    for _ in range(num_batches):
+        start_time = time.perf_counter()
+        next(data_iter)
+        batch_times.append(time.perf_counter() - start_time)
+
+    # Stop worker processes / producer threads before the next grid point
+    data_iter.close()
+    del data_iter, train_dataloader
+
+    total_time = sum(batch_times)
+    return {"images_per_second": num_batches * batch_size / total_time,
+            "mean_batch_ms": total_time * 1000 / num_batches,
+            "max_batch_ms": max(batch_times) * 1000}
+
+
+def benchmark_collate(config: Any, batch_size: int, num_batches: int) -> Dict[str, Any]:
+    """Host CPU time per batch of the default collate followed by pinning, against ``PinnedBatchCollator``
+
+    Args:
+        config (Any): Training config, the samples come from its dataset
+        batch_size (int): Samples per batch
+        num_batches (int): Number of timed batches per collate path
+
+    Returns:
+        result (dict): CPU and wall milliseconds per batch of both paths
+    """
+    train_datasets, train_sampler = build_train_dataset(config)
+    if isinstance(train_datasets, IterableDataset):
+        data_iter = iter(train_datasets)
+        samples = [next(data_iter) for _ in range(batch_size)]
+    else:
+        # The keys of the sampler, unpaired datasets are indexed by (domain A index, domain B index, sample seed)
+        samples = [train_datasets[sample_key] for sample_key in itertools.islice(itertools.cycle(train_sampler),
+                                                                                 batch_size)]
+    pin = torch.cuda.is_available()
+
+    def default_path():
+        batch_data = default_collate(samples)
+        if pin:
+            batch_data = {k: v.pin_memory() for k, v in batch_data.items()}
+        return batch_data
+
+    collator = PinnedBatchCollator(2)
+
+    def pinned_path():
+        # Released right away, as the device prefetcher does after queueing the copy
+        batch_data = collator(samples)
+        collator.release(batch_data)
+        return batch_data
+
+    result = {"batch_size": batch_size, "pinned": pin}
+    for name, collate_path in [("default_collate_pin_memory", default_path), ("pinned_batch_collator", pinned_path)]:
+        collate_path()
+        start_cpu_time, start_time = time.process_time(), time.perf_counter()
+        for _ in range(num_batches):
+            collate_path()
+        result[name] = {"cpu_ms_per_batch": (time.process_time() - start_cpu_time) * 1000 / num_batches,
+                        "wall_ms_per_batch": (time.perf_counter() - start_time) * 1000 / num_batches}
+
+    return result
+
+
+def benchmark_rotate(batch_size: int, image_size: int, num_iterations: int) -> Dict[str, Any]:
+    """CPU time of the rotation paths of imgproc.py against ``torchvision.transforms.functional.rotate``
+
+    Args:
+        batch_size (int): Images per batch
+        image_size (int): Width and height of the images
+        num_iterations (int): Number of timed calls per path
+
+    Returns:
+        result (dict): Milliseconds per batch of every path and the speedups
+    """
+    images = torch.rand(batch_size, 3, image_size, image_size)
+    arbitrary_angles = [float(angle) for angle in torch.randint(0, 360, (batch_size,))]
+
+    def torchvision_right_angle():
+        return F_vision.rotate(images, 90)
+
+    def rot90_fast_path():
+        return random_rotate_torch(images, None, [90])
+
+    def torchvision_per_sample():
+        return torch.stack([F_vision.rotate(image, angle) for image, angle in zip(images, arbitrary_angles)])
+
+    def affine_grid_batch():
+        return random_rotate_batch_torch(images, None, arbitrary_angles)
+
+    result = {"batch_size": batch_size, "image_size": image_size}
+    for name, rotate_path in [("torchvision_right_angle", torchvision_right_angle),
+                              ("rot90_fast_path", rot90_fast_path),
+                              ("torchvision_per_sample", torchvision_per_sample),
+                              ("affine_grid_batch", affine_grid_batch)]:
+        rotate_path()
+        start_time = time.perf_counter()
+        for _ in range(num_iterations):
+            rotate_path()
+        result[name] = {"ms_per_batch": (time.perf_counter() - start_time) * 1000 / num_iterations}
+
+    result["right_angle_speedup"] = result["torchvision_right_angle"]["ms_per_batch"] / result["rot90_fast_path"][
+        "ms_per_batch"]
+    result["arbitrary_angle_speedup"] = result["torchvision_per_sample"]["ms_per_batch"] / result["affine_grid_batch"][
+        "ms_per_batch"]
+
+    return result
+
+
+def benchmark_augment(batch_size: int, image_size: int, patch_size: int, num_iterations: int) -> Dict[str, Any]:
+    """CPU time of the fused augmentation (one gather) against crop, rotate and flips one after the other
+
+    Both paths use the parameters of the same ``AugmentationPlan``, their outputs are checked to be identical.
+
+    Args:
+        batch_size (int): Images per batch
+        image_size (int): Width and height of the images
+        patch_size (int): The size of the crop
+        num_iterations (int): Number of timed calls per path
+
+    Returns:
+        result (dict): Milliseconds per batch of both paths, the speedup and the bit-exactness check
+    """
+    images = torch.randint(0, 256, (batch_size, 3, image_size, image_size), dtype=torch.uint8).float()
+    plan = AugmentationPlan.sample(images, patch_size)
+
+    result = {"batch_size": batch_size, "image_size": image_size, "patch_size": patch_size,
+              "bit_identical": torch.equal(plan.apply(images, fused=False), plan.apply(images, fused=True))}
+    for name, fused in [("sequential", False), ("fused", True)]:
+        plan.apply(images, fused)
+        start_time = time.perf_counter()
+        for _ in range(num_iterations):
+            plan.apply(images, fused)
+        result[name] = {"ms_per_batch": (time.perf_counter() - start_time) * 1000 / num_iterations}
+    result["speedup"] = result["sequential"]["ms_per_batch"] / result["fused"]["ms_per_batch"]
+
+    return result
+
+
+def replay_batches(config: Any, data_state: Dict[str, Any], num_batches: int) -> List[Dict[str, Any]]:
+    """Load the batches following a training checkpoint again, in this process, with the same random draws
+
+    The sampler keys carry the seed of every sample, so the crops and worker-side augmentations of the replayed
+    batches are the ones of the training run, whatever the number of workers. Every batch is loaded twice to check it.
+
+    Args:
+        config (Any): Training config of the run
+        data_state (dict): ``data_state`` of the checkpoint, see ``load_resume_data_state``
+        num_batches (int): Number of batches to replay
+
+    Returns:
+        results (list): Sampler keys, milliseconds and bit-exactness of every batch
+    """
+    train_datasets, train_sampler = build_train_dataset(config)
+    if train_sampler is None:
+        raise ValueError("Shard streams can not be replayed, they are shuffled inside the workers.")
+    train_sampler.load_state_dict(data_state["sampler"])
+    batch_size = config["TRAIN"]["HYP"]["IMGS_PER_BATCH"]
+    sample_keys = list(itertools.islice(iter(train_sampler), num_batches * batch_size))
+
+    def load_batch(batch_keys):
+        if hasattr(train_datasets, "__getitems__"):
+            return default_collate(train_datasets.__getitems__(batch_keys))
+        return default_collate([train_datasets[batch_key] for batch_key in batch_keys])
+
+    results = []
+    for i in range(0, len(sample_keys), batch_size):
+        batch_keys = sample_keys[i:i + batch_size]
+        start_time = time.perf_counter()
+        batch_data = load_batch(batch_keys)
+        batch_ms = (time.perf_counter() - start_time) * 1000
+        replayed_batch_data = load_batch(batch_keys)
+
+        results.append({"batch_index": data_state["batch_index"] + i // batch_size,
+                        "keys": [list(batch_key) for batch_key in batch_keys],
+                        "ms": batch_ms,
+                        "bit_identical": all(torch.equal(batch_data[k], replayed_batch_data[k]) for k in batch_data)})
+
+    return results
+
+
+def _repeat(dataloader: Any):
+    # Small datasets are loaded again instead of keeping their batches around like `itertools.cycle`
+    while True:
+        yield from dataloader
+
+
+def recommend(results: List[Dict[str, Any]], stages: Dict[str, Any], collate: Any, config: Any) -> Dict[str, Any]:
+    best_result = max(results, key=lambda result: result["images_per_second"])
+    recommendation = {"TRAIN.HYP.LOADER": best_result["loader"],
+                      "TRAIN.HYP.NUM_WORKERS": best_result["num_workers"],
+                      "TRAIN.HYP.IMGS_PER_BATCH": best_result["batch_size"],
+                      "TRAIN.HYP.PIN_MEMORY": best_result["pin_memory"],
+                      "images_per_second": best_result["images_per_second"]}
+    if collate is not None and collate["pinned"]:
+        recommendation["TRAIN.HYP.PINNED_COLLATE"] = (collate["pinned_batch_collator"]["cpu_ms_per_batch"] <
+                                                      collate["default_collate_pin_memory"]["cpu_ms_per_batch"])
+
+    # Point at the data path option that removes the most expensive stage
+    bottleneck = max(stages, key=lambda stage: stages[stage]["share"])
+    recommendation["bottleneck_stage"] = bottleneck
+    if bottleneck in ["decode", "resize"] and not config["TRAIN"]["DATASET"]["CACHE_DIR"]:
+        recommendation["hint"] = "Build the resized image cache (`TRAIN.DATASET.CACHE_DIR`), it skips decode and resize."
+    elif bottleneck in ["to_float", "to_tensor", "cvt_color"] and not config["TRAIN"]["DATASET"]["UINT8"]:
+        recommendation["hint"] = "Set `TRAIN.DATASET.UINT8`, the float conversion then runs on the training device."
+    elif bottleneck == "read":
+        recommendation["hint"] = "Reads dominate, stream the images out of shards (`TRAIN.DATASET.SHARDS`)."
+
+    return recommendation
+
+
+def apply_overrides(config: Any, overrides: List[str]) -> None:
+    for override in overrides:
+        key, value = override.split("=", 1)
+        node = config
+        keys = key.split(".")
+        for k in keys[:-1]:
+            node = node[k]
+        if keys[-1] not in node:
+            raise KeyError(f"Unknown config key `{key}`.")
+        node[keys[-1]] = yaml.safe_load(value)
+
+
+def main(args):
+    with open(args.config_path, "r") as f:
+        config = yaml.full_load(f)
+    apply_overrides(config, args.override)
+
+    if args.replay_checkpoint:
+        data_state = load_resume_data_state(args.replay_checkpoint)
+        if data_state is None:
+            raise ValueError(f"`{args.replay_checkpoint}` holds no data loading state.")
+        replay = replay_batches(config, data_state, args.replay_batches)
+        for result in replay:
+            print(f"Batch {result['batch_index']}: {result['ms']:.2f} ms, bit-identical: {result['bit_identical']}, "
+                  f"keys: {result['keys']}")
+        os.makedirs(os.path.dirname(os.path.abspath(args.output_path)), exist_ok=True)
+        with open(args.output_path, "w") as f:
+            json.dump({"replay_checkpoint": args.replay_checkpoint, "replay": replay}, f, indent=2)
+        print(f"Results saved to `{args.output_path}`")
+        return
+    # Nothing is written next to the benchmarked images, every start scans them again
+    config["TRAIN"]["DATASET"]["META_DIR"] = None
+
+    synthetic_dir = None
+    if args.synthetic_images > 0:
+        synthetic_dir = tempfile.mkdtemp(prefix="cyclegan_benchmark_")
+        for domain in ["A", "B"]:
+            make_synthetic_images(os.path.join(synthetic_dir, domain), args.synthetic_images, args.synthetic_size,
+                                  config["SEED"])
+        config["TRAIN"]["DATASET"]["SRC_IMAGE_PATH"] = os.path.join(synthetic_dir, "A")
+        config["TRAIN"]["DATASET"]["DST_IMAGE_PATH"] = os.path.join(synthetic_dir, "B")
+    elif args.images_dir:
+        config["TRAIN"]["DATASET"]["SRC_IMAGE_PATH"] = args.images_dir
+        config["TRAIN"]["DATASET"]["DST_IMAGE_PATH"] = args.images_dir
+
+    try:
+        stages = benchmark_stages(config["TRAIN"]["DATASET"]["SRC_IMAGE_PATH"],
+                                  config["TRAIN"]["DATASET"]["LOAD_SIZE"],
+                                  args.stage_images)
+        print("Per-stage time (float decoding path):")
+        for stage, stage_result in stages.items():
+            print(f"  {stage:>10}: {stage_result['ms_per_image']:8.3f} ms/image ({stage_result['share']:.1%})")
+
+        results = []
+        for loader, num_workers, batch_size, pin_memory in itertools.product(args.loaders,
+                                                                             args.num_workers,
+                                                                             args.batch_sizes,
+                                                                             args.pin_memory):
+            run_config = copy.deepcopy(config)
+            run_config["TRAIN"]["HYP"]["LOADER"] = loader
+            run_config["TRAIN"]["HYP"]["NUM_WORKERS"] = num_workers
+            run_config["TRAIN"]["HYP"]["IMGS_PER_BATCH"] = batch_size
+            run_config["TRAIN"]["HYP"]["PIN_MEMORY"] = bool(pin_memory)
+
+            result = {"loader": loader, "num_workers": num_workers, "batch_size": batch_size,
+                      "pin_memory": bool(pin_memory)}
+            result.update(benchmark_loader(run_config, args.num_batches, args.num_warmup_batches))
+            results.append(result)
+            print(f"loader={loader:<7} num_workers={num_workers:<3} batch_size={batch_size:<3} "
+                  f"pin_memory={bool(pin_memory)!s:<5} {result['images_per_second']:9.1f} images/s "
+                  f"({result['mean_batch_ms']:.2f} ms/batch)")
+
+        collate = None
+        if args.collate_batches > 0:
+            collate = benchmark_collate(config, max(args.batch_sizes), args.collate_batches)
+            for name in ["default_collate_pin_memory", "pinned_batch_collator"]:
+                print(f"{name:>26}: {collate[name]['cpu_ms_per_batch']:.3f} CPU ms/batch, "
+                      f"{collate[name]['wall_ms_per_batch']:.3f} ms/batch (batch size {collate['batch_size']})")
+
+        rotate = None
+        if args.rotate_iterations > 0:
+            rotate = benchmark_rotate(max(args.batch_sizes),
+                                      config["TRAIN"]["DATASET"]["CROP_SIZE"] or config["TRAIN"]["DATASET"]["LOAD_SIZE"],
+                                      args.rotate_iterations)
+            print(f"Rotation (CPU, batch size {rotate['batch_size']}): right angles "
+                  f"{rotate['torchvision_right_angle']['ms_per_batch']:.2f} -> {rotate['rot90_fast_path']['ms_per_batch']:.2f}"
+                  f" ms/batch ({rotate['right_angle_speedup']:.1f}x), arbitrary angles "
+                  f"{rotate['torchvision_per_sample']['ms_per_batch']:.2f} -> "
+                  f"{rotate['affine_grid_batch']['ms_per_batch']:.2f} ms/batch ({rotate['arbitrary_angle_speedup']:.1f}x)")
+
+        augment = None
+        if args.augment_iterations > 0:
+            augment = benchmark_augment(max(args.batch_sizes),
+                                        config["TRAIN"]["DATASET"]["LOAD_SIZE"],
+                                        config["TRAIN"]["DATASET"]["CROP_SIZE"] or config["TRAIN"]["DATASET"]["LOAD_SIZE"],
+                                        args.augment_iterations)
+            print(f"Augmentation (CPU, batch size {augment['batch_size']}): sequential "
+                  f"{augment['sequential']['ms_per_batch']:.2f} -> fused {augment['fused']['ms_per_batch']:.2f} ms/batch "
+                  f"({augment['speedup']:.1f}x), bit-identical: {augment['bit_identical']}")
+    finally:
+        if synthetic_dir is not None:
+            shutil.rmtree(synthetic_dir, ignore_errors=True)
+
+    recommendation = recommend(results, stages, collate, config)
+    print(f"Recommended for this machine: {json.dumps(recommendation, indent=2)}")
+
+    report = {"machine": {"platform": platform.platform(),
+                          "cpu_count": os.cpu_count(),
+                          "torch": torch.__version__,
+                          "cuda": torch.cuda.is_available()},
+              "dataset": {key: config["TRAIN"]["DATASET"][key] for key in ["SRC_IMAGE_PATH", "DST_IMAGE_PATH",
+                                                                          "UNPAIRED", "LOAD_SIZE", "CROP_SIZE",
+                                                                          "CACHE_DIR", "UINT8", "REDUCED_DECODE"]},
+              "synthetic_images": args.synthetic_images,
+              "stages": stages,
+              "results": results,
+              "collate": collate,
+              "rotate": rotate,
+              "augment": augment,
+              "recommendation": recommendation}
+    os.makedirs(os.path.dirname(os.path.abspath(args.output_path)), exist_ok=True)
+    with open(args.output_path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results saved to `{args.output_path}`")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the training data pipeline.")
+    parser.add_argument("--config_path", type=str, default="./configs/CYCLEGAN.yaml",
+                        help="Path to train config file. Default: ``./configs/CYCLEGAN.yaml``")
+    parser.add_argument("--override", type=str, nargs="*", default=[],
+                        help="Config overrides, e.g. ``TRAIN.DATASET.UINT8=True TRAIN.DATASET.CACHE_DIR=./data/cache``")
+    parser.add_argument("--images_dir", type=str, default=None,
+                        help="Images dir used for both domains instead of the config paths. Default: ``None``")
+    parser.add_argument("--synthetic_images", type=int, default=0,
+                        help="Benchmark this many synthetic images per domain instead, 0 disables it. Default: ``0``")
+    parser.add_argument("--synthetic_size", type=int, default=512,
+                        help="Size of the synthetic images. Default: ``512``")
+    parser.add_argument("--stage_images", type=int, default=100,
+                        help="Images timed stage by stage. Default: ``100``")
+    parser.add_argument("--loaders", type=str, nargs="+", default=["process"], choices=["process", "thread"],
+                        help="Loader modes of the grid. Default: ``process``")
+    parser.add_argument("--num_workers", type=int, nargs="+", default=[0, 2, 4, 8],
+                        help="Worker processes (or threads) of the grid. Default: ``0 2 4 8``")
+    parser.add_argument("--batch_sizes", type=int, nargs="+", default=[1, 4],
+                        help="Batch sizes of the grid. Default: ``1 4``")
+    parser.add_argument("--pin_memory", type=int, nargs="+", default=[0, 1], choices=[0, 1],
+                        help="Pin memory settings of the grid. Default: ``0 1``")
+    parser.add_argument("--num_batches", type=int, default=50,
+                        help="Timed batches per grid point. Default: ``50``")
+    parser.add_argument("--num_warmup_batches", type=int, default=5,
+                        help="Batches loaded before timing. Default: ``5``")
+    parser.add_argument("--collate_batches", type=int, default=200,
+                        help="Batches timed per collate path (default vs. pinned buffers), 0 disables it. Default: ``200``")
+    parser.add_argument("--rotate_iterations", type=int, default=20,
+                        help="Batches timed per rotation path (rot90 / affine grid vs. torchvision), 0 disables it. "
+                             "Default: ``20``")
+    parser.add_argument("--augment_iterations", type=int, default=20,
+                        help="Batches timed per augmentation path (fused vs. sequential), 0 disables it. Default: ``20``")
+    parser.add_argument("--replay_checkpoint", type=str, default=None,
+                        help="Only replay the batches following this training checkpoint (e.g. a `*_step.pth.tar`). "
+                             "Default: ``None``")
+    parser.add_argument("--replay_batches", type=int, default=1,
+                        help="Batches replayed after the checkpoint. Default: ``1``")
+    parser.add_argument("--output_path", type=str, default="./results/benchmark_data.json",
+                        help="JSON report path. Default: ``./results/benchmark_data.json``")
+    args = parser.parse_args()
+
+    main(args)
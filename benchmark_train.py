@@ -0,0 +1,338 @@
+# Copyright 2023 Dakewe Biotech Corporation. All Rights Reserved.
+# Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+import argparse
+import collections
+import copy
+import json
+import os
+import platform
+import time
+from typing import Any, Dict, List
+
+import torch
+import torch._dynamo
+import yaml
+from torch import nn, Tensor
+from torch.profiler import profile, ProfilerActivity
+
+import model
+from benchmark_data import apply_overrides
+from train import build_model, build_train_step, define_loss, define_optimizer, get_memory_format
+
+# Model compilation settings of every benchmarked mode: (MODEL.G/D.COMPILED, TRAIN.COMPILE_STEP.ENABLE)
+_MODES = {
+    "eager": (False, False),
+    "compiled_modules": (True, False),
+    "compiled_step": (False, True),
+}
+
+# Operators that copy a tensor into another memory format, `Tensor.contiguous()` only dispatches when it has to copy
+_LAYOUT_CONVERSION_OPS = ["aten::contiguous", "aten::clone", "aten::copy_", "aten::_to_copy"]
+
+
+def count_layout_conversions(model: nn.Module, x: Tensor) -> Dict[str, Any]:
+    """Count the copies of one forward pass that change the memory format of a tensor, with the PyTorch profiler
+
+    Args:
+        model (nn.Module): Model, already in the memory format of ``x``
+        x (Tensor): Input batch
+
+    Returns:
+        result (dict): Calls of every copying operator, their total and whether the output kept the channels_last format
+    """
+    with torch.no_grad(), profile(activities=[ProfilerActivity.CPU]) as prof:
+        y = model(x)
+
+    conversions = collections.Counter(event.name for event in prof.events() if event.name in _LAYOUT_CONVERSION_OPS)
+    return {"conversions": dict(conversions),
+            "num_conversions": sum(conversions.values()),
+            "output_channels_last": y.is_contiguous(memory_format=torch.channels_last)}
+
+
+def check_layout(config: Any, device: torch.device) -> Dict[str, Dict[str, Any]]:
+    """Count the layout conversions of the generator and the discriminator with ``MODEL.CHANNELS_LAST`` enabled
+
+    Args:
+        config (Any): Training config
+        device (torch.device): Running device
+
+    Returns:
+        results (dict): :func:`count_layout_conversions` of both models
+    """
+    config = copy.deepcopy(config)
+    config["MODEL"]["CHANNELS_LAST"] = True
+    config["MODEL"]["G"]["COMPILED"] = False
+    config["MODEL"]["D"]["COMPILED"] = False
+    g_model, _, _, _, d_model, _ = build_model(config, device)
+
+    image_shape = (config["TRAIN"]["HYP"]["IMGS_PER_BATCH"],
+                   config["MODEL"]["G"]["IN_CHANNELS"],
+                   config["TRAIN"]["DATASET"]["CROP_SIZE"],
+                   config["TRAIN"]["DATASET"]["CROP_SIZE"])
+    x = torch.randn(image_shape, device=device).contiguous(memory_format=get_memory_format(config))
+
+    return {"g": count_layout_conversions(g_model, x), "d": count_layout_conversions(d_model, x)}
+
+
+def benchmark_train_step(config: Any,
+                         device: torch.device,
+                         num_steps: int,
+                         num_warmup_steps: int) -> Dict[str, float]:
+    """Time the generator and discriminator updates of ``train()`` on random batches of the training shape
+
+    Args:
+        config (Any): Training config
+        device (torch.device): Running device
+        num_steps (int): Number of timed steps
+        num_warmup_steps (int): Number of steps run before timing, they include the compilation
+
+    Returns:
+        result (dict): Warm-up time and milliseconds per step
+    """
+    torch._dynamo.reset()
+    torch.manual_seed(config["SEED"])
+    g_A_model, g_B_model, _, _, d_A_model, d_B_model = build_model(config, device)
+    identity_criterion, adversarial_criterion, cycle_criterion = define_loss(config, device)
+    g_optimizer, d_optimizer = define_optimizer(g_A_model, g_B_model, d_A_model, d_B_model, config)
+    generator_step_fn, discriminator_A_step_fn, discriminator_B_step_fn = build_train_step(config,
+                                                                                           g_A_model,
+                                                                                           g_B_model,
+                                                                                           d_A_model,
+                                                                                           d_B_model,
+                                                                                           identity_criterion,
+                                                                                           adversarial_criterion,
+                                                                                           cycle_criterion,
+                                                                                           device)
+
+    image_shape = (config["TRAIN"]["HYP"]["IMGS_PER_BATCH"],
+                   config["MODEL"]["G"]["IN_CHANNELS"],
+                   config["TRAIN"]["DATASET"]["CROP_SIZE"],
+                   config["TRAIN"]["DATASET"]["CROP_SIZE"])
+    real_image_A = torch.randn(image_shape, device=device).contiguous(memory_format=get_memory_format(config))
+    real_image_B = torch.randn(image_shape, device=device).contiguous(memory_format=get_memory_format(config))
+
+    def step() -> None:
+        # Same updates, in the same order, as the loop of `train()`, without the replay buffers and the EMA
+        g_optimizer.zero_grad(set_to_none=True)
+        for d_parameters in d_A_model.parameters():
+            d_parameters.requires_grad = False
+        for d_parameters in d_B_model.parameters():
+            d_parameters.requires_grad = False
+        fake_image_A, fake_image_B, g_step_losses = generator_step_fn(real_image_A, real_image_B)
+        g_step_losses["g"].backward()
+        g_optimizer.step()
+
+        d_optimizer.zero_grad(set_to_none=True)
+        for d_parameters in d_A_model.parameters():
+            d_parameters.requires_grad = True
+        for d_parameters in d_B_model.parameters():
+            d_parameters.requires_grad = True
+        discriminator_A_step_fn(real_image_B, fake_image_B.detach()).backward()
+        discriminator_B_step_fn(real_image_A, fake_image_A.detach()).backward()
+        d_optimizer.step()
+
+        if device.type == "cuda":
+            torch.cuda.synchronize(device)
+
+    start_time = time.perf_counter()
+    for _ in range(num_warmup_steps):
+        step()
+    warmup_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    for _ in range(num_steps):
+        step()
+    step_time = (time.perf_counter() - start_time) / num_steps
+
+    return {"warmup_s": warmup_time, "ms_per_step": step_time * 1000}
+
+
+def count_conv_flops(g_model: nn.Module, x: Tensor) -> int:
+    """FLOPs of the convolutions of one forward pass, two per multiply-accumulate, biases and norms not counted
+
+    Same count as `torch.utils.flop_counter` (torch 2.1+) for the generators of model.py, on the pinned torch 2.0.
+    Transposed convolutions are counted over their input size.
+
+    Args:
+        g_model (nn.Module): Model to run
+        x (Tensor): Input batch
+
+    Returns:
+        num_flops (int): FLOPs of all `Conv2d` and `ConvTranspose2d` layers
+    """
+    num_flops = 0
+
+    def _count(module: nn.Module, inputs: tuple, output: Tensor) -> None:
+        nonlocal num_flops
+        shape = inputs[0].shape if isinstance(module, nn.ConvTranspose2d) else output.shape
+        num_flops += 2 * shape[0] * shape[2:].numel() * module.weight.numel()
+
+    handles = [module.register_forward_hook(_count) for module in g_model.modules()
+               if isinstance(module, (nn.Conv2d, nn.ConvTranspose2d))]
+    try:
+        g_model(x)
+    finally:
+        for handle in handles:
+            handle.remove()
+
+    return num_flops
+
+
+def benchmark_generators(config: Any,
+                         variants: List[str],
+                         image_sizes: List[int],
+                         device: torch.device,
+                         num_iterations: int) -> List[Dict[str, Any]]:
+    """FLOPs, parameters and inference latency of generator variants registered in model.py
+
+    Args:
+        config (Any): Training config, the channels and the memory format of `MODEL.G` are used
+        variants (list): Generator factory names, e.g. ``cyclenet_6blocks``
+        image_sizes (list): Width and height of the input images
+        device (torch.device): Running device
+        num_iterations (int): Number of timed forward passes, after one untimed pass
+
+    Returns:
+        results (list): One row per variant and image size
+    """
+    results = []
+    for variant in variants:
+        g_model = model.__dict__[variant](in_channels=config["MODEL"]["G"]["IN_CHANNELS"],
+                                          out_channels=config["MODEL"]["G"]["OUT_CHANNELS"],
+                                          channels=config["MODEL"]["G"]["CHANNELS"])
+        g_model = g_model.to(device, memory_format=get_memory_format(config))
+        # Latency of the deployed model, the norms folded into the convolutions like in inference.py
+        g_model = model.fuse_instance_norm(g_model)
+        num_parameters = sum(p.numel() for p in g_model.parameters())
+
+        for image_size in image_sizes:
+            x = torch.randn(1, config["MODEL"]["G"]["IN_CHANNELS"], image_size, image_size, device=device)
+            x = x.contiguous(memory_format=get_memory_format(config))
+            with torch.no_grad():
+                num_flops = count_conv_flops(g_model, x)
+
+                start_time = time.perf_counter()
+                for _ in range(num_iterations):
+                    g_model(x)
+                if device.type == "cuda":
+                    torch.cuda.synchronize(device)
+                latency = (time.perf_counter() - start_time) / num_iterations
+
+            results.append({"variant": variant,
+                            "image_size": image_size,
+                            "parameters_m": num_parameters / 1e6,
+                            "gflops": num_flops / 1e9,
+                            "ms_per_image": latency * 1000})
+
+    return results
+
+
+def main(args):
+    with open(args.config_path, "r") as f:
+        config = yaml.full_load(f)
+    apply_overrides(config, args.override)
+    config["MODEL"]["EMA"]["ENABLE"] = False
+    config["MODEL"]["COMPILE_MODE"] = args.compile_mode
+    config["TRAIN"]["HYP"]["IMGS_PER_BATCH"] = args.batch_size
+    config["TRAIN"]["DATASET"]["CROP_SIZE"] = args.image_size
+    device = torch.device(args.device)
+
+    layout = None
+    if args.check_layout:
+        layout = check_layout(config, device)
+        for name, result in layout.items():
+            print(f"channels_last {name}: {result['num_conversions']} layout conversions {result['conversions']}, "
+                  f"channels_last output: {result['output_channels_last']}")
+
+    generators = None
+    if args.generator_variants:
+        generators = benchmark_generators(config,
+                                          args.generator_variants,
+                                          args.generator_image_sizes,
+                                          device,
+                                          args.generator_iterations)
+        print("| Variant | Image size | Params (M) | GFLOPs | Latency (ms) |")
+        print("|---|---|---|---|---|")
+        for row in generators:
+            print(f"| {row['variant']} | {row['image_size']} | {row['parameters_m']:.2f} | {row['gflops']:.1f} "
+                  f"| {row['ms_per_image']:.2f} |")
+
+    results = {}
+    for mode in args.modes:
+        modules_compiled, step_compiled = _MODES[mode]
+        run_config = copy.deepcopy(config)
+        run_config["MODEL"]["G"]["COMPILED"] = modules_compiled
+        run_config["MODEL"]["D"]["COMPILED"] = modules_compiled
+        run_config["TRAIN"]["COMPILE_STEP"]["ENABLE"] = step_compiled
+
+        results[mode] = benchmark_train_step(run_config, device, args.num_steps, args.num_warmup_steps)
+        print(f"{mode:>16}: {results[mode]['ms_per_step']:9.2f} ms/step "
+              f"(warm-up {results[mode]['warmup_s']:.2f}s over {args.num_warmup_steps} steps)")
+
+    if "eager" in results:
+        for mode in results:
+            results[mode]["speedup"] = results["eager"]["ms_per_step"] / results[mode]["ms_per_step"]
+
+    report = {"machine": {"platform": platform.platform(),
+                          "cpu_count": os.cpu_count(),
+                          "torch": torch.__version__,
+                          "device": str(device)},
+              "batch_size": args.batch_size,
+              "image_size": args.image_size,
+              "compile_mode": args.compile_mode,
+              "channels_last": config["MODEL"]["CHANNELS_LAST"],
+              "layout": layout,
+              "generators": generators,
+              "results": results}
+    os.makedirs(os.path.dirname(os.path.abspath(args.output_path)), exist_ok=True)
+    with open(args.output_path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results saved to `{args.output_path}`")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--config_path", type=str, default="./configs/CYCLEGAN.yaml",
+                        help="Training config path. Default: ``./configs/CYCLEGAN.yaml``")
+    parser.add_argument("--override", type=str, nargs="*", default=[],
+                        help="Config overrides such as ``MODEL.G.CHANNELS=32``. Default: none")
+    parser.add_argument("--modes", type=str, nargs="*", default=list(_MODES), choices=list(_MODES),
+                        help="Compilation modes to time. Default: ``eager compiled_modules compiled_step``")
+    parser.add_argument("--compile_mode", type=str, default="default",
+                        choices=["default", "reduce-overhead", "max-autotune"],
+                        help="`torch.compile` mode. Default: ``default``")
+    parser.add_argument("--batch_size", type=int, default=1,
+                        help="Images per batch. Default: ``1``")
+    parser.add_argument("--image_size", type=int, default=128,
+                        help="Width and height of the random training images. Default: ``128``")
+    parser.add_argument("--num_steps", type=int, default=20,
+                        help="Number of timed steps per mode. Default: ``20``")
+    parser.add_argument("--num_warmup_steps", type=int, default=3,
+                        help="Number of steps run before timing, they include the compilation. Default: ``3``")
+    parser.add_argument("--check_layout", action="store_true", default=False,
+                        help="Count the layout conversion copies of the channels_last models. Default: ``False``")
+    parser.add_argument("--generator_variants", type=str, nargs="*", default=[],
+                        help="Generators of model.py to list FLOPs and latency of, e.g. ``cyclenet cyclenet_half``. "
+                             "Default: none")
+    parser.add_argument("--generator_image_sizes", type=int, nargs="+", default=[128, 256],
+                        help="Image sizes of the generator table. Default: ``128 256``")
+    parser.add_argument("--generator_iterations", type=int, default=10,
+                        help="Number of timed forward passes per generator and image size. Default: ``10``")
+    parser.add_argument("--device", type=str, default="cpu",
+                        help="Device, the compiled modes run the inductor backend on the CPU too. Default: ``cpu``")
+    parser.add_argument("--output_path", type=str, default="./results/benchmark_train.json",
+                        help="JSON report path. Default: ``./results/benchmark_train.json``")
+    args = parser.parse_args()
+
+    main(args)
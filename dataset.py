@@ -11,180 +11,1705 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 # ==============================================================================
+import atexit
+import hashlib
+import json
+import multiprocessing
 import os
 import queue
 import random
+import tarfile
 import threading
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import shared_memory
 
 import cv2
 import numpy as np
 import torch
+from PIL import Image
+from numpy import ndarray
 from torch import Tensor
-from torch.utils.data import Dataset, DataLoader
-from typing import List, Union, Dict
-from imgproc import image_to_tensor
+from torch.utils.data import Dataset, DataLoader, IterableDataset, Sampler, default_collate, get_worker_info
+from typing import Any, List, Union, Dict, Tuple
+from imgproc import image_to_tensor, uint8_image_to_tensor, random_rotate_torch, random_vertically_flip_torch, \
+    random_horizontally_flip_torch
 
 __all__ = [
-    "ImageDataset",
-    "PrefetchGenerator", "PrefetchDataLoader", "CPUPrefetcher", "CUDAPrefetcher",
+    "ImageDataset", "UnpairedImageDataset", "PairedSampler", "UnpairedSampler", "ShardImageDataset",
+    "ImageManifest", "SharedImageCache", "match_image_pairs", "seed_worker",
+    "build_image_cache", "write_image_shards",
+    "PrefetchGenerator", "PrefetchDataLoader", "PinnedBatchCollator", "DevicePrefetcher",
 ]
 
 
 class ImageDataset(Dataset):
+    """Image-to-image translation dataset
+
+    Args:
+        src_images_dir (str): Domain A images dir
+        dst_images_dir (str): Domain B images dir
+        unpaired (bool): Randomly match domain B images to domain A images
+        resized_image_size (int): Size of the images after resizing (load size)
+        cache_dir (str, optional): Dir of the uint8 memory-mapped image cache, ``None`` means decode every sample from disk.
+            Default: ``None``
+        uint8 (bool, optional): Keep the images as uint8 HWC RGB tensors, the conversion to [-1, 1] is left to the
+            prefetcher on the training device. Default: ``False``
+        reduced_decode (bool, optional): Decode JPEG images that are much larger than ``resized_image_size`` at 1/2,
+            1/4 or 1/8 resolution. Default: ``False``
+        meta_dir (str, optional): Dir of the persisted dataset manifests, ``None`` means list the dirs on every start.
+            Default: ``None``
+        decode_threads (int, optional): Threads decoding the samples of a batch in parallel (OpenCV releases the GIL),
+            ``0`` decodes them one after another. Default: ``0``
+        shared_cache_bytes (int, optional): Byte budget of the decoded image cache in shared memory, shared by all
+            DataLoader workers, ``0`` disables it. Default: ``0``
+        validate (str, optional): Pre-flight check of the images, ``header``, ``full`` or ``none``. Unreadable images
+            are excluded from sampling. Default: ``none``
+        validate_workers (int, optional): Processes of the pre-flight check and of the manifest probing, ``0`` means one
+            per CPU. Default: ``0``
+        crop_image_size (int, optional): Size of the random crop taken from the resized images, in the worker, ``None``
+            means no crop. Default: ``None``
+        augment (bool, optional): Randomly rotate (right angles) and flip the samples in the worker. Default: ``False``
+    """
+
     def __init__(
             self,
             src_images_dir: str,
             dst_images_dir: str,
             unpaired: bool,
             resized_image_size: int,
+            cache_dir: str = None,
+            uint8: bool = False,
+            reduced_decode: bool = False,
+            meta_dir: str = None,
+            decode_threads: int = 0,
+            shared_cache_bytes: int = 0,
+            validate: str = "none",
+            validate_workers: int = 0,
+            crop_image_size: int = None,
+            augment: bool = False,
     ) -> None:
         super(ImageDataset, self).__init__()
-        self.src_image_file_names = [os.path.join(src_images_dir, image_file_name) for image_file_name in
-                                     os.listdir(src_images_dir)]
-        self.dst_image_file_names = [os.path.join(dst_images_dir, image_file_name) for image_file_name in
-                                     os.listdir(dst_images_dir)]
         self.unpaired = unpaired
         self.resized_image_size = resized_image_size
+        self.cache_dir = cache_dir
+        self.uint8 = uint8
+        self.decode_threads = decode_threads
+        self.crop_image_size = crop_image_size
+        self.augment = augment
+
+        # Sorted file lists, updated incrementally from the persisted manifests instead of listing the dirs
+        # The dimensions are only needed to pick the reduced decoders
+        probe_sizes = reduced_decode and not cache_dir
+        self.src_manifest = ImageManifest(src_images_dir, meta_dir, validate_workers, probe_sizes)
+        self.dst_manifest = ImageManifest(dst_images_dir, meta_dir, validate_workers, probe_sizes)
+        if validate != "none":
+            self.src_manifest.validate(validate, validate_workers)
+            self.dst_manifest.validate(validate, validate_workers)
+
+        if cache_dir:
+            # Build (or validate) the cache once in the main process, the workers only map it
+            self.src_cache_path, self.src_image_file_names = build_image_cache(src_images_dir,
+                                                                               cache_dir,
+                                                                               resized_image_size,
+                                                                               image_file_names=self.src_manifest.file_names)
+            self.dst_cache_path, self.dst_image_file_names = build_image_cache(dst_images_dir,
+                                                                               cache_dir,
+                                                                               resized_image_size,
+                                                                               image_file_names=self.dst_manifest.file_names)
+        else:
+            self.src_cache_path = self.dst_cache_path = None
+            self.src_image_file_names = self.src_manifest.file_paths
+            self.dst_image_file_names = self.dst_manifest.file_paths
+
+        # Pairs are matched by file stem, not by their position in the two lists
+        if not unpaired:
+            self.pair_indices = match_image_pairs(self.src_manifest.file_names, self.dst_manifest.file_names)
+        else:
+            self.pair_indices = None
+
+        # The cache is decoded once at build time, only the plain decode path benefits from reduced decoding
+        if reduced_decode and not cache_dir:
+            self.src_decode_flags = _reduced_decode_flags(self.src_image_file_names,
+                                                          self.src_manifest.image_sizes,
+                                                          resized_image_size)
+            self.dst_decode_flags = _reduced_decode_flags(self.dst_image_file_names,
+                                                          self.dst_manifest.image_sizes,
+                                                          resized_image_size)
+            _print_reduced_decode_summary({src_images_dir: self.src_decode_flags, dst_images_dir: self.dst_decode_flags})
+        else:
+            self.src_decode_flags = [cv2.IMREAD_COLOR] * len(self.src_image_file_names)
+            self.dst_decode_flags = [cv2.IMREAD_COLOR] * len(self.dst_image_file_names)
+
+        # Created before the workers start, so that all of them attach to the same memory
+        if shared_cache_bytes > 0 and not cache_dir:
+            self.shared_cache = SharedImageCache(len(self.src_image_file_names) + len(self.dst_image_file_names),
+                                                 (resized_image_size, resized_image_size, 3),
+                                                 shared_cache_bytes)
+        else:
+            self.shared_cache = None
+
+        # The memory maps are opened lazily, so that every DataLoader worker maps the cache by itself
+        self._src_images = None
+        self._dst_images = None
+        # Same for the decode thread pool, threads do not survive a fork
+        self._executor = None
+        self._executor_pid = None
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        state["_src_images"] = None
+        state["_dst_images"] = None
+        state["_executor"] = None
+        state["_executor_pid"] = None
+        return state
+
+    def __getitems__(self, batch_indices: list) -> List[Dict[str, Tensor]]:
+        # Called by the DataLoader with the indices of a whole batch, in the worker processes or the main process
+        if self.decode_threads <= 0:
+            return [self[batch_index] for batch_index in batch_indices]
+
+        if self._executor is None or self._executor_pid != os.getpid():
+            self._executor = ThreadPoolExecutor(self.decode_threads, thread_name_prefix="decode")
+            self._executor_pid = os.getpid()
+
+        return list(self._executor.map(self.__getitem__, batch_indices))
+
+    def __getitem__(self, batch_index: Union[int, Tuple[int, int]]) -> Union[Dict[str, Tensor], Dict[str, Tensor]]:
+        # Samplers of this module pass (index, sample seed)
+        batch_index, sample_seed = batch_index if isinstance(batch_index, tuple) else (batch_index, None)
+        rng = _sample_rng(sample_seed)
 
-    def __getitem__(self, batch_index: int) -> Union[Dict[str, Tensor], Dict[str, Tensor]]:
-        # Read a batch of image data
-        src_image = cv2.imread(self.src_image_file_names[batch_index])
         if self.unpaired:
-            dst_image = cv2.imread(self.dst_image_file_names[random.randint(0, len(self.src_image_file_names) - 1)])
+            return self._get_item(batch_index, int(rng.integers(len(self.dst_image_file_names))), rng)
+
+        return self._get_item(*self.pair_indices[batch_index], rng)
+
+    def _get_item(self, src_index: int, dst_index: int, rng: np.random.Generator) -> Dict[str, Tensor]:
+        if self.cache_dir:
+            src_image, dst_image = self._read_cached_images(src_index, dst_index)
         else:
-            dst_image = cv2.imread(self.dst_image_file_names[batch_index])
+            src_image, dst_image = self._read_images(src_index, dst_index)
 
-        # Normalize the image data
-        src_image = src_image.astype(np.float32) / 255.
-        dst_image = dst_image.astype(np.float32) / 255.
+        if self.crop_image_size is not None:
+            src_image, dst_image = _random_crop_images(src_image, dst_image, self.crop_image_size, not self.unpaired,
+                                                       rng)
+        if self.augment:
+            src_image, dst_image = _augment_images(src_image, dst_image, not self.unpaired, rng)
 
-        # Resized image
-        src_image = cv2.resize(src_image, (self.resized_image_size, self.resized_image_size), interpolation=cv2.INTER_CUBIC)
-        dst_image = cv2.resize(dst_image, (self.resized_image_size, self.resized_image_size), interpolation=cv2.INTER_CUBIC)
+        return _images_to_sample(src_image, dst_image, self.uint8)
 
-        # BGR convert RGB
-        src_image = cv2.cvtColor(src_image, cv2.COLOR_BGR2RGB)
-        dst_image = cv2.cvtColor(dst_image, cv2.COLOR_BGR2RGB)
+    def _read_images(self, src_index: int, dst_index: int) -> Tuple[ndarray, ndarray]:
+        # Read a batch of image data
+        src_image = self._read_image(self.src_image_file_names, self.src_decode_flags, src_index, 0)
+        dst_image = self._read_image(self.dst_image_file_names,
+                                     self.dst_decode_flags,
+                                     dst_index,
+                                     len(self.src_image_file_names))
 
-        # Convert image data into Tensor stream format (PyTorch).
-        # Note: The range of input and output is between [-1, 1]
-        src_tensor = image_to_tensor(src_image, True, False)
-        dst_tensor = image_to_tensor(dst_image, True, False)
+        return src_image, dst_image
 
-        return {"src": src_tensor, "dst": dst_tensor}
+    def _read_image(self, image_file_names: List[str], decode_flags: List[int], index: int, key_offset: int) -> ndarray:
+        if self.shared_cache is None:
+            image = _imread(image_file_names[index], decode_flags[index])
+            return _preprocess_image(image, self.resized_image_size, self.uint8)
+
+        # The shared cache holds the decoded and resized uint8 images of both domains
+        image = self.shared_cache.get(key_offset + index)
+        if image is None:
+            image = _imread(image_file_names[index], decode_flags[index])
+            image = _preprocess_image(image, self.resized_image_size, True)
+            self.shared_cache.put(key_offset + index, image)
+
+        if not self.uint8:
+            image = image.astype(np.float32) / 255.
+
+        return image
+
+    def _read_cached_images(self, src_index: int, dst_index: int) -> Tuple[ndarray, ndarray]:
+        if self._src_images is None:
+            # Copy-on-write mapping, slices are served straight from the page cache
+            self._src_images = np.load(self.src_cache_path, mmap_mode="c")
+            self._dst_images = np.load(self.dst_cache_path, mmap_mode="c")
+
+        # The cache is already resized and in RGB order, only the normalization is left
+        src_image = self._src_images[src_index]
+        dst_image = self._dst_images[dst_index]
+        if not self.uint8:
+            src_image = src_image.astype(np.float32) / 255.
+            dst_image = dst_image.astype(np.float32) / 255.
+
+        return src_image, dst_image
 
     def __len__(self) -> int:
+        if self.pair_indices is not None:
+            return len(self.pair_indices)
         return len(self.src_image_file_names)
 
 
-class PrefetchGenerator(threading.Thread):
+class SharedImageCache(object):
+    """Decoded uint8 images in POSIX shared memory, shared by all DataLoader workers of a run
+
+    The images live in fixed-size slots within a byte budget, evicted with the CLOCK (second chance) policy once the
+    budget is used up. The hit and miss counters are shared as well.
+
+    Args:
+        num_keys (int): Number of distinct images, the keys are ``0 .. num_keys - 1``
+        image_shape (tuple[int, int, int]): Shape of every image (H, W, C)
+        max_bytes (int): Byte budget of the image slots
+    """
+
+    def __init__(self, num_keys: int, image_shape: Tuple[int, int, int], max_bytes: int) -> None:
+        self.num_keys = num_keys
+        self.image_shape = tuple(image_shape)
+        self.image_bytes = int(np.prod(image_shape))
+        self.num_slots = max(1, min(num_keys, max_bytes // self.image_bytes))
+
+        # One block: slot data, slot -> key, key -> slot, reference bits, [clock hand, hits, misses]
+        size = self.num_slots * self.image_bytes + (self.num_slots + num_keys + 3) * 8 + self.num_slots
+        self._shm = shared_memory.SharedMemory(create=True, size=size)
+        self._owner_pid = os.getpid()
+        self._lock = multiprocessing.Lock()
+        self._map_arrays()
+        self._slot_keys[:] = -1
+        self._key_slots[:] = -1
+        self._reference_bits[:] = 0
+        self._counters[:] = 0
+
+        atexit.register(self.close)
+        print(f"Shared image cache: {self.num_slots}/{num_keys} images, "
+              f"{self.num_slots * self.image_bytes / 1024 ** 3:.2f} GB.")
+
+    def _map_arrays(self) -> None:
+        offset = 0
+        self._images = np.ndarray((self.num_slots,) + self.image_shape, np.uint8, self._shm.buf, offset)
+        offset += self.num_slots * self.image_bytes
+        self._slot_keys = np.ndarray((self.num_slots,), np.int64, self._shm.buf, offset)
+        offset += self.num_slots * 8
+        self._key_slots = np.ndarray((self.num_keys,), np.int64, self._shm.buf, offset)
+        offset += self.num_keys * 8
+        self._counters = np.ndarray((3,), np.int64, self._shm.buf, offset)
+        offset += 3 * 8
+        self._reference_bits = np.ndarray((self.num_slots,), np.uint8, self._shm.buf, offset)
+
+    def __getstate__(self) -> dict:
+        # Spawned workers attach to the shared memory by its name, the views are mapped again
+        state = self.__dict__.copy()
+        for k in ["_images", "_slot_keys", "_key_slots", "_counters", "_reference_bits"]:
+            del state[k]
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._map_arrays()
+
+    def get(self, key: int) -> Union[ndarray, None]:
+        with self._lock:
+            slot = self._key_slots[key]
+            if slot < 0:
+                self._counters[2] += 1
+                return None
+            self._counters[1] += 1
+            self._reference_bits[slot] = 1
+            # Copy out under the lock, the slot may be reused right after
+            return self._images[slot].copy()
+
+    def put(self, key: int, image: ndarray) -> None:
+        with self._lock:
+            if self._key_slots[key] >= 0:
+                return
+
+            # Advance the clock hand past the recently used slots, clearing their reference bits
+            hand = int(self._counters[0])
+            while self._reference_bits[hand]:
+                self._reference_bits[hand] = 0
+                hand = (hand + 1) % self.num_slots
+
+            evicted_key = self._slot_keys[hand]
+            if evicted_key >= 0:
+                self._key_slots[evicted_key] = -1
+            self._images[hand] = image
+            self._slot_keys[hand] = key
+            self._key_slots[key] = hand
+            self._reference_bits[hand] = 1
+            self._counters[0] = (hand + 1) % self.num_slots
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"hits": int(self._counters[1]),
+                    "misses": int(self._counters[2]),
+                    "cached": int((self._slot_keys >= 0).sum())}
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self._counters[1:] = 0
+
+    def close(self) -> None:
+        if self._shm is None:
+            return
+        # Drop the views before closing the mapping
+        self._images = self._slot_keys = self._key_slots = self._counters = self._reference_bits = None
+        self._shm.close()
+        if os.getpid() == self._owner_pid:
+            self._shm.unlink()
+        self._shm = None
+
+
+def match_image_pairs(src_image_file_names: List[str], dst_image_file_names: List[str]) -> List[Tuple[int, int]]:
+    """Match the images of two domains by their file stem
+
+    Args:
+        src_image_file_names (list[str]): Domain A image file names
+        dst_image_file_names (list[str]): Domain B image file names
+
+    Returns:
+        pair_indices (list[tuple[int, int]]): (domain A index, domain B index) of every matched pair
+    """
+    dst_indices = {os.path.splitext(image_file_name)[0]: i for i, image_file_name in enumerate(dst_image_file_names)}
+
+    pair_indices = []
+    for src_index, image_file_name in enumerate(src_image_file_names):
+        dst_index = dst_indices.get(os.path.splitext(image_file_name)[0])
+        if dst_index is not None:
+            pair_indices.append((src_index, dst_index))
+
+    num_unmatched = len(src_image_file_names) + len(dst_image_file_names) - 2 * len(pair_indices)
+    if num_unmatched > 0:
+        print(f"{num_unmatched} images without a counterpart of the same file stem in the other domain are skipped.")
+
+    return pair_indices
+
+
+def _imread(image_path: str, decode_flag: int) -> ndarray:
+    image = cv2.imread(image_path, decode_flag)
+    if image is None:
+        raise ValueError(f"Image `{image_path}` can not be decoded, check the dataset with `prepare_dataset.py validate`")
+
+    return image
+
+
+def _preprocess_image(image: ndarray, image_size: int, uint8: bool) -> ndarray:
+    # Normalize the image data
+    if not uint8:
+        image = image.astype(np.float32) / 255.
+
+    # Resized image
+    image = cv2.resize(image, (image_size, image_size), interpolation=cv2.INTER_CUBIC)
+
+    # BGR convert RGB
+    image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+    return image
+
+
+def _random_crop_images(
+        src_image: ndarray,
+        dst_image: ndarray,
+        crop_image_size: int,
+        paired: bool,
+        rng: np.random.Generator,
+) -> Tuple[ndarray, ndarray]:
+    # Slicing only, the crops are views of the (uint8) images
+    src_top = int(rng.integers(src_image.shape[0] - crop_image_size + 1))
+    src_left = int(rng.integers(src_image.shape[1] - crop_image_size + 1))
+    if paired:
+        # Paired images are aligned, they share the crop window
+        dst_top, dst_left = src_top, src_left
+    else:
+        dst_top = int(rng.integers(dst_image.shape[0] - crop_image_size + 1))
+        dst_left = int(rng.integers(dst_image.shape[1] - crop_image_size + 1))
+
+    src_image = src_image[src_top:src_top + crop_image_size, src_left:src_left + crop_image_size, ...]
+    dst_image = dst_image[dst_top:dst_top + crop_image_size, dst_left:dst_left + crop_image_size, ...]
+
+    return src_image, dst_image
+
+
+def _augment_images(
+        src_image: ndarray,
+        dst_image: ndarray,
+        paired: bool,
+        rng: np.random.Generator,
+) -> Tuple[ndarray, ndarray]:
+    if paired:
+        # Paired images are aligned, they share the rotation and the flips
+        return _rotate_flip_images(src_image, dst_image, rng)
+
+    # Unpaired images draw their own rotation and flips, like their own crop windows
+    src_image, _ = _rotate_flip_images(src_image, None, rng)
+    dst_image, _ = _rotate_flip_images(dst_image, None, rng)
+
+    return src_image, dst_image
+
+
+def _rotate_flip_images(
+        src_image: ndarray,
+        dst_image: Union[ndarray, None],
+        rng: np.random.Generator,
+) -> Tuple[ndarray, Union[ndarray, None]]:
+    # Views of the images, the only copy is the one into the sample tensor
+    src_image, dst_image = random_rotate_torch(src_image, dst_image, [0, 90, 180, 270], generator=rng)
+    src_image, dst_image = random_vertically_flip_torch(src_image, dst_image, generator=rng)
+    src_image, dst_image = random_horizontally_flip_torch(src_image, dst_image, generator=rng)
+
+    return src_image, dst_image
+
+
+def seed_worker(worker_id: int) -> None:
+    """``worker_init_fn`` of the DataLoader, seeds ``random``, ``numpy`` and the fallback sample generator of a worker
+
+    The DataLoader seeds torch in every worker with its base seed plus the worker id, the base seed is drawn from the
+    (seeded) main process RNG for every new iterator (epoch), so the worker streams differ and are reproducible.
+
+    Args:
+        worker_id (int): DataLoader worker id
+    """
+    global _WORKER_RNG
+    worker_seed = torch.initial_seed() % 2 ** 32
+    random.seed(worker_seed)
+    np.random.seed(worker_seed)
+    _WORKER_RNG = (os.getpid(), np.random.default_rng(_combine_seeds(worker_seed, worker_id)))
+
+
+# Generator of the samples requested without a sample seed, per process
+_WORKER_RNG = None
+
+
+def _sample_rng(sample_seed: Union[int, None]) -> np.random.Generator:
+    global _WORKER_RNG
+    if sample_seed is not None:
+        # Independent of the worker that loads the sample, a batch can be replayed from its sampler keys
+        return np.random.default_rng(sample_seed)
+
+    if _WORKER_RNG is None or _WORKER_RNG[0] != os.getpid():
+        _WORKER_RNG = (os.getpid(), np.random.default_rng(torch.initial_seed() % 2 ** 32))
+    return _WORKER_RNG[1]
+
+
+def _images_to_sample(src_image: ndarray, dst_image: ndarray, uint8: bool) -> Dict[str, Tensor]:
+    if uint8:
+        # Crops, rotations and flips are strided views
+        return {"src": torch.from_numpy(np.ascontiguousarray(src_image)),
+                "dst": torch.from_numpy(np.ascontiguousarray(dst_image))}
+
+    # Convert image data into Tensor stream format (PyTorch).
+    # Note: The range of input and output is between [-1, 1]
+    src_tensor = image_to_tensor(src_image, True, False)
+    dst_tensor = image_to_tensor(dst_image, True, False)
+
+    return {"src": src_tensor, "dst": dst_tensor}
+
+
+class UnpairedImageDataset(ImageDataset):
+    """Unpaired image-to-image translation dataset, indexed by the (domain A index, domain B index) pairs drawn by
+    :class:`UnpairedSampler`
+
+    Args:
+        src_images_dir (str): Domain A images dir
+        dst_images_dir (str): Domain B images dir
+        resized_image_size (int): Size of the images after resizing
+        kwargs (dict): Other extended parameters of :class:`ImageDataset`
+    """
+
+    def __init__(self, src_images_dir: str, dst_images_dir: str, resized_image_size: int, **kwargs) -> None:
+        super(UnpairedImageDataset, self).__init__(src_images_dir, dst_images_dir, True, resized_image_size, **kwargs)
+
+    def __getitem__(self, index: Tuple[int, ...]) -> Dict[str, Tensor]:
+        # (domain A index, domain B index) or (domain A index, domain B index, sample seed)
+        return self._get_item(index[0], index[1], _sample_rng(index[2] if len(index) > 2 else None))
+
+
+class _ResumableSampler(Sampler):
+    """Base class of the samplers whose position inside an epoch can be saved and restored
+
+    Args:
+        num_samples (int): Samples per epoch
+        seed (int): Seed of the permutations, together with the epoch
+    """
+
+    def __init__(self, num_samples: int, seed: int) -> None:
+        super(_ResumableSampler, self).__init__(None)
+        self.num_samples = num_samples
+        self.seed = seed
+        self.epoch = 0
+        self.position = 0
+
+    def set_epoch(self, epoch: int) -> None:
+        self.epoch = epoch
+
+    def state_dict(self) -> dict:
+        return {"seed": self.seed, "epoch": self.epoch, "position": self.position}
+
+    def load_state_dict(self, state_dict: dict) -> None:
+        self.seed = state_dict["seed"]
+        self.epoch = state_dict["epoch"]
+        self.position = state_dict["position"]
+
+    def _indices(self, generator: torch.Generator) -> list:
+        raise NotImplementedError
+
+    def __iter__(self):
+        generator = torch.Generator()
+        generator.manual_seed(self.seed + self.epoch)
+        # The skipped samples are dropped from the index list, nothing is decoded for them
+        indices = self._indices(generator)[self.position:]
+        start_position = self.position
+        # Only the first epoch after resuming starts in the middle
+        self.position = 0
+
+        # Every sample carries the seed of its random draws (crop, augmentation), derived from the seed, the epoch and
+        # its position in the epoch
+        epoch_seed = _combine_seeds(self.seed, self.epoch)
+        return iter([_sample_key(index, _sample_seed(epoch_seed, position))
+                     for position, index in enumerate(indices, start_position)])
+
+    def __len__(self) -> int:
+        return self.num_samples - self.position
+
+
+def _sample_seed(epoch_seed: int, position: int) -> int:
+    # Cheap in the sampler, `np.random.default_rng` hashes it through a SeedSequence
+    return (epoch_seed + position * 0x9E3779B97F4A7C15) % 2 ** 64
+
+
+def _sample_key(index: Union[int, Tuple[int, int]], sample_seed: int) -> Tuple[int, ...]:
+    if isinstance(index, tuple):
+        return index + (sample_seed,)
+    return index, sample_seed
+
+
+class PairedSampler(_ResumableSampler):
+    """Sample a paired dataset, optionally shuffled with a permutation redrawn every epoch
+
+    Yields ``(index, sample seed)`` keys.
+
+    Args:
+        num_images (int): Number of image pairs
+        shuffle (bool, optional): Shuffle the pairs every epoch. Default: ``True``
+        seed (int, optional): Seed of the permutations, together with the epoch. Default: ``0``
+    """
+
+    def __init__(self, num_images: int, shuffle: bool = True, seed: int = 0) -> None:
+        super(PairedSampler, self).__init__(num_images, seed)
+        self.shuffle = shuffle
+
+    def _indices(self, generator: torch.Generator) -> list:
+        if self.shuffle:
+            return torch.randperm(self.num_samples, generator=generator).tolist()
+        return list(range(self.num_samples))
+
+
+class UnpairedSampler(_ResumableSampler):
+    """Sample both domains of an unpaired dataset from their own permutation, redrawn every epoch
+
+    Yields ``(domain A index, domain B index, sample seed)`` keys.
+
+    Args:
+        num_src_images (int): Number of domain A images
+        num_dst_images (int): Number of domain B images
+        epoch_length (str, optional): Samples per epoch, ``min`` or ``max`` of the two domain sizes, or ``src`` for the
+            domain A size. The shorter domain wraps around with a new permutation. Default: ``max``
+        block_size (int, optional): Indices are shuffled in blocks of consecutive images, read in storage order.
+            Default: ``1``
+        seed (int, optional): Seed of the permutations, together with the epoch. Default: ``0``
+    """
+
+    def __init__(
+            self,
+            num_src_images: int,
+            num_dst_images: int,
+            epoch_length: str = "max",
+            block_size: int = 1,
+            seed: int = 0,
+    ) -> None:
+        if epoch_length == "min":
+            num_samples = min(num_src_images, num_dst_images)
+        elif epoch_length == "max":
+            num_samples = max(num_src_images, num_dst_images)
+        elif epoch_length == "src":
+            num_samples = num_src_images
+        else:
+            raise NotImplementedError(f"Epoch length {epoch_length} is not implemented.")
+        super(UnpairedSampler, self).__init__(num_samples, seed)
+
+        self.num_src_images = num_src_images
+        self.num_dst_images = num_dst_images
+        self.block_size = block_size
+
+    def _permutation(self, num_images: int, generator: torch.Generator) -> Tensor:
+        # Every full pass over a domain is a new permutation, so every image is seen before any is repeated
+        block_offsets = torch.arange(self.block_size)
+        num_blocks = -(-num_images // self.block_size)
+        indices = []
+        num_indices = 0
+        while num_indices < self.num_samples:
+            blocks = torch.randperm(num_blocks, generator=generator)
+            permutation = (blocks[:, None] * self.block_size + block_offsets).flatten()
+            permutation = permutation[permutation < num_images]
+            indices.append(permutation)
+            num_indices += len(permutation)
+
+        return torch.cat(indices)[:self.num_samples]
+
+    def _indices(self, generator: torch.Generator) -> list:
+        src_indices = self._permutation(self.num_src_images, generator)
+        dst_indices = self._permutation(self.num_dst_images, generator)
+
+        return list(zip(src_indices.tolist(), dst_indices.tolist()))
+
+
+class ShardImageDataset(IterableDataset):
+    """Stream the samples of both domains sequentially out of tar or zip shards written by :func:`write_image_shards`
+
+    The shards are split across distributed ranks and DataLoader workers, and shuffled through a bounded buffer. Every
+    shard of domain A is read by exactly one worker, workers left without a shard yield no samples.
+
+    Shard streams can not be resumed inside an epoch: :meth:`state_dict` always stores position ``0`` and a resumed
+    epoch starts from its first sample. The ``(seed, epoch, position)`` sample keys of the resumable samplers do not
+    apply either, crops and augmentations are drawn from generators seeded with the seed, the epoch and the worker.
+
+    Args:
+        shards_dir (str): Dir of the ``src-*`` and ``dst-*`` shards and their ``src.json`` / ``dst.json`` index files
+        unpaired (bool): Stream domain B independently of domain A, otherwise the shards are read in lockstep
+        resized_image_size (int): Size of the images after resizing (load size)
+        shuffle_buffer_size (int, optional): Number of samples held for shuffling, ``0`` disables shuffling.
+            Default: ``1000``
+        seed (int, optional): Seed of the shard order and the shuffle buffer, together with the epoch. Default: ``0``
+        uint8 (bool, optional): Keep the images as uint8 HWC RGB tensors. Default: ``False``
+        crop_image_size (int, optional): Size of the random crop taken from the resized images, ``None`` means no crop.
+            Default: ``None``
+        augment (bool, optional): Randomly rotate (right angles) and flip the samples. Default: ``False``
+    """
+
+    def __init__(
+            self,
+            shards_dir: str,
+            unpaired: bool,
+            resized_image_size: int,
+            shuffle_buffer_size: int = 1000,
+            seed: int = 0,
+            uint8: bool = False,
+            crop_image_size: int = None,
+            augment: bool = False,
+    ) -> None:
+        super(ShardImageDataset, self).__init__()
+        self.src_shards = _load_shards_index(shards_dir, "src")
+        self.dst_shards = _load_shards_index(shards_dir, "dst")
+        if not unpaired and [count for _, count in self.src_shards] != [count for _, count in self.dst_shards]:
+            raise ValueError("The paired shards of the source domain and the destination domain must be the same")
+
+        self.unpaired = unpaired
+        self.resized_image_size = resized_image_size
+        self.shuffle_buffer_size = shuffle_buffer_size
+        self.seed = seed
+        self.uint8 = uint8
+        self.crop_image_size = crop_image_size
+        self.augment = augment
+        self.epoch = 0
+        # Persistent workers keep their copy of the dataset, they count their own epochs
+        self._num_iterations = 0
+        # Shards are streamed from their beginning, a resumed epoch starts over
+        self.position = 0
+
+    def set_epoch(self, epoch: int) -> None:
+        self.epoch = epoch
+        self._num_iterations = 0
+
+    def state_dict(self) -> dict:
+        return {"seed": self.seed, "epoch": self.epoch, "position": 0}
+
+    def load_state_dict(self, state_dict: dict) -> None:
+        self.seed = state_dict["seed"]
+        self.epoch = state_dict["epoch"]
+        if state_dict["position"] > 0:
+            print("Shard streams can not be resumed inside an epoch, the epoch starts from its first sample.")
+
+    def _split(self, num_shards: int, epoch: int, share: bool = False) -> List[int]:
+        worker_info = get_worker_info()
+        worker_id, num_workers = (worker_info.id, worker_info.num_workers) if worker_info is not None else (0, 1)
+        if torch.distributed.is_available() and torch.distributed.is_initialized():
+            rank, world_size = torch.distributed.get_rank(), torch.distributed.get_world_size()
+        else:
+            rank, world_size = 0, 1
+
+        # Same shard order in all workers of all ranks, every worker then takes its own slice of it
+        order = random.Random(_combine_seeds(self.seed, epoch)).sample(range(num_shards), num_shards)
+        num_splits = num_workers * world_size
+        split_id = rank * num_workers + worker_id
+        split_shard_indices = order[split_id::num_splits]
+        if not split_shard_indices and share:
+            # Fewer shards than workers, the extra workers share a shard of a domain that is streamed repeatedly anyway
+            split_shard_indices = [order[split_id % num_shards]]
+
+        return split_shard_indices
+
+    def _decode(self, image_bytes: bytes) -> ndarray:
+        image = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+        return _preprocess_image(image, self.resized_image_size, self.uint8)
+
+    def __iter__(self):
+        epoch = self.epoch + self._num_iterations
+        self._num_iterations += 1
+        worker_info = get_worker_info()
+        worker_id = worker_info.id if worker_info is not None else 0
+        rng = random.Random(_combine_seeds(self.seed, epoch, worker_id))
+        augment_rng = np.random.default_rng(_combine_seeds(self.seed, epoch, worker_id, 1))
+
+        src_shard_indices = self._split(len(self.src_shards), epoch)
+        src_samples = _iter_shards([self.src_shards[i][0] for i in src_shard_indices])
+        if self.unpaired:
+            dst_shard_indices = self._split(len(self.dst_shards), epoch, True)
+            # Domain B is streamed again for as long as domain A has samples
+            dst_samples = _iter_shards([self.dst_shards[i][0] for i in dst_shard_indices], True)
+            src_samples = _shuffle_buffer(src_samples, self.shuffle_buffer_size, rng)
+            dst_samples = _shuffle_buffer(dst_samples, self.shuffle_buffer_size, rng)
+            samples = zip(src_samples, dst_samples)
+        else:
+            # Paired shards hold the same samples in the same order
+            dst_samples = _iter_shards([self.dst_shards[i][0] for i in src_shard_indices])
+            samples = _shuffle_buffer(zip(src_samples, dst_samples), self.shuffle_buffer_size, rng)
+
+        for src_image_bytes, dst_image_bytes in samples:
+            src_image = self._decode(src_image_bytes)
+            dst_image = self._decode(dst_image_bytes)
+            if self.crop_image_size is not None:
+                src_image, dst_image = _random_crop_images(src_image, dst_image, self.crop_image_size, not self.unpaired,
+                                                           augment_rng)
+            if self.augment:
+                src_image, dst_image = _augment_images(src_image, dst_image, not self.unpaired, augment_rng)
+            yield _images_to_sample(src_image, dst_image, self.uint8)
+
+    def __len__(self) -> int:
+        world_size = 1
+        if torch.distributed.is_available() and torch.distributed.is_initialized():
+            world_size = torch.distributed.get_world_size()
+
+        return sum([count for _, count in self.src_shards]) // world_size
+
+
+def _combine_seeds(*seeds: int) -> int:
+    return int(np.random.SeedSequence(list(seeds)).generate_state(1)[0])
+
+
+def _load_shards_index(shards_dir: str, domain: str) -> List[Tuple[str, int]]:
+    with open(os.path.join(shards_dir, f"{domain}.json"), "r") as f:
+        index = json.load(f)
+
+    return [(os.path.join(shards_dir, shard["name"]), shard["count"]) for shard in index["shards"]]
+
+
+def _iter_archive(archive_path: str):
+    # Members are read in archive order, one sequential pass per shard
+    if archive_path.endswith(".zip"):
+        with zipfile.ZipFile(archive_path, "r") as archive:
+            for info in archive.infolist():
+                if not info.is_dir():
+                    yield archive.read(info)
+    else:
+        with tarfile.open(archive_path, "r|*") as archive:
+            for member in archive:
+                if member.isfile():
+                    yield archive.extractfile(member).read()
+
+
+def _iter_shards(shard_paths: List[str], repeat: bool = False):
+    while True:
+        for shard_path in shard_paths:
+            yield from _iter_archive(shard_path)
+        if not repeat:
+            return
+
+
+def _shuffle_buffer(samples, buffer_size: int, rng: random.Random):
+    if buffer_size <= 0:
+        yield from samples
+        return
+
+    buffer = []
+    for sample in samples:
+        if len(buffer) < buffer_size:
+            buffer.append(sample)
+            continue
+        # Emit a random buffered sample and keep the new one in its place
+        i = rng.randrange(buffer_size)
+        yield buffer[i]
+        buffer[i] = sample
+
+    rng.shuffle(buffer)
+    yield from buffer
+
+
+def write_image_shards(
+        images_dir: str,
+        shards_dir: str,
+        domain: str,
+        shard_size: int = 1000,
+        archive_format: str = "tar",
+        image_file_names: List[str] = None,
+) -> List[str]:
+    """Pack the images of a dir into tar or zip shards for :class:`ShardImageDataset`
+
+    Args:
+        images_dir (str): Images dir
+        shards_dir (str): Dir where the shards and the ``<domain>.json`` index file are written
+        domain (str): ``src`` or ``dst``
+        shard_size (int, optional): Images per shard. Default: ``1000``
+        archive_format (str, optional): ``tar`` or ``zip``. Default: ``tar``
+        image_file_names (list[str], optional): Image file names in ``images_dir`` to pack, in this order. Default: all
+            images, sorted by name
+
+    Returns:
+        shard_paths (list[str]): Paths of the written shards
+
+    """
+    if archive_format not in ["tar", "zip"]:
+        raise NotImplementedError(f"Archive format {archive_format} is not implemented.")
+    if image_file_names is None:
+        image_file_names = sorted(os.listdir(images_dir))
+    os.makedirs(shards_dir, exist_ok=True)
+
+    shards = []
+    shard_paths = []
+    for shard_index, start in enumerate(range(0, len(image_file_names), shard_size)):
+        shard_image_file_names = image_file_names[start:start + shard_size]
+        shard_name = f"{domain}-{shard_index:06d}.{archive_format}"
+        shard_path = os.path.join(shards_dir, shard_name)
+        if archive_format == "zip":
+            # JPEG and PNG data is already compressed
+            with zipfile.ZipFile(shard_path, "w", zipfile.ZIP_STORED) as archive:
+                for i, image_file_name in enumerate(shard_image_file_names):
+                    archive.write(os.path.join(images_dir, image_file_name), f"{start + i:09d}_{image_file_name}")
+        else:
+            with tarfile.open(shard_path, "w") as archive:
+                for i, image_file_name in enumerate(shard_image_file_names):
+                    archive.add(os.path.join(images_dir, image_file_name), f"{start + i:09d}_{image_file_name}")
+        shards.append({"name": shard_name, "count": len(shard_image_file_names)})
+        shard_paths.append(shard_path)
+
+    with open(os.path.join(shards_dir, f"{domain}.json"), "w") as f:
+        json.dump({"images_dir": os.path.abspath(images_dir), "shards": shards}, f)
+
+    return shard_paths
+
+
+# Largest reduction first, so that the smallest decode that still covers the target size wins
+_REDUCED_DECODE_FLAGS = [
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+]
+# Only JPEG decoders scale in the DCT domain, every other format is fully decoded and resized by OpenCV
+_REDUCED_DECODE_EXTENSIONS = (".jpg", ".jpeg", ".jpe")
+
+
+class ImageManifest(object):
+    """Sorted list of the images of a dir with their size, modification time, dimensions and content hash
+
+    The manifest is persisted in ``meta_dir`` and updated incrementally: the dir is listed on every start, but only
+    images that are new or whose size or modification time changed are probed again, across a process pool. Without
+    ``meta_dir`` the dir is only listed, the dimensions are left empty unless ``probe_sizes`` asks for them.
+
+    Args:
+        images_dir (str): Images dir
+        meta_dir (str, optional): Dir of the persisted manifest, ``None`` means scan the dir every time.
+            Default: ``None``
+        num_workers (int, optional): Processes probing new or modified images, ``0`` means one per CPU. Default: ``0``
+        probe_sizes (bool, optional): Read the dimensions of the images from their headers without ``meta_dir`` as
+            well. Default: ``False``
+    """
+
+    def __init__(self, images_dir: str, meta_dir: str = None, num_workers: int = 0, probe_sizes: bool = False) -> None:
+        self.images_dir = images_dir
+        self.manifest_path = os.path.join(meta_dir, _domain_name(images_dir) + ".manifest.json") if meta_dir else None
+        self.num_workers = num_workers
+        self.probe_sizes = probe_sizes or self.manifest_path is not None
+        self.entries = {}
+
+        if self.manifest_path is not None and os.path.exists(self.manifest_path):
+            with open(self.manifest_path, "r") as f:
+                manifest = json.load(f)
+            self.entries = manifest["entries"]
+
+        if self.update() and self.manifest_path is not None:
+            self.save()
+
+    def update(self) -> bool:
+        """Rescan the dir and probe new or modified images, returns whether the manifest was modified"""
+        entries = {}
+        probe_stats = {}
+        with os.scandir(self.images_dir) as dir_entries:
+            for dir_entry in dir_entries:
+                if not dir_entry.is_file():
+                    continue
+                stat = dir_entry.stat()
+                entry = self.entries.get(dir_entry.name)
+                # Images rewritten in place keep their name, their size or modification time gives them away
+                if entry is None or entry["size"] != stat.st_size or entry["mtime"] != stat.st_mtime_ns:
+                    probe_stats[dir_entry.name] = stat
+                else:
+                    entries[dir_entry.name] = entry
+
+        entries.update(self._probe(probe_stats))
+        num_removed = len(set(self.entries) - set(entries))
+        if not probe_stats and not num_removed:
+            return False
+
+        self.entries = {image_file_name: entries[image_file_name] for image_file_name in sorted(entries)}
+        print(f"Manifest of `{self.images_dir}`: {len(self.entries)} images, "
+              f"{len(probe_stats)} new or modified, {num_removed} removed.")
+
+        return True
+
+    def _probe(self, probe_stats: Dict[str, os.stat_result]) -> Dict[str, dict]:
+        image_file_names = list(probe_stats)
+        image_paths = [os.path.join(self.images_dir, image_file_name) for image_file_name in image_file_names]
+        # Hashing reads the whole file, only worth it when the result is persisted
+        hash_contents = [self.manifest_path is not None] * len(image_paths)
+
+        # A plain listing, like `os.listdir`, no image is opened
+        if not self.probe_sizes:
+            results = [(None, None, None)] * len(image_paths)
+        # A handful of new images is probed faster than a pool starts
+        elif len(image_paths) < _MIN_POOL_PROBES:
+            results = list(map(_probe_image, image_paths, hash_contents))
+        else:
+            num_workers = self.num_workers or os.cpu_count()
+            chunksize = max(1, min(256, len(image_paths) // (4 * num_workers)))
+            with ProcessPoolExecutor(num_workers) as executor:
+                results = list(executor.map(_probe_image, image_paths, hash_contents, chunksize=chunksize))
+
+        entries = {}
+        for image_file_name, (width, height, file_hash) in zip(image_file_names, results):
+            stat = probe_stats[image_file_name]
+            entry = {"size": stat.st_size, "mtime": stat.st_mtime_ns, "width": width, "height": height}
+            if file_hash is not None:
+                entry["hash"] = file_hash
+            entries[image_file_name] = entry
+
+        return entries
+
+    def save(self) -> None:
+        os.makedirs(os.path.dirname(self.manifest_path), exist_ok=True)
+        with open(self.manifest_path + ".tmp", "w") as f:
+            json.dump({"images_dir": os.path.abspath(self.images_dir),
+                       "entries": self.entries},
+                      f)
+        os.replace(self.manifest_path + ".tmp", self.manifest_path)
+
+    def validate(self, mode: str = "header", num_workers: int = 0) -> List[str]:
+        """Check that the images can be read, in parallel across a process pool
+
+        Unreadable images are marked as bad in the manifest and left out of :attr:`file_names`. Images already checked
+        at the same or a stricter level are not checked again.
+
+        Args:
+            mode (str, optional): ``header`` parses the image headers, ``full`` decodes the whole images.
+                Default: ``header``
+            num_workers (int, optional): Processes of the pool, ``0`` means one per CPU. Default: ``0``
+
+        Returns:
+            bad_file_names (list[str]): File names of all images marked as bad
+        """
+        if mode not in _VALIDATE_LEVELS:
+            raise NotImplementedError(f"Validate mode {mode} is not implemented.")
+        level = _VALIDATE_LEVELS[mode]
+
+        image_file_names = [image_file_name for image_file_name, entry in self.entries.items() if
+                            entry.get("checked", 0) < level]
+        if image_file_names:
+            start = time.time()
+            image_paths = [os.path.join(self.images_dir, image_file_name) for image_file_name in image_file_names]
+            num_workers = num_workers or os.cpu_count()
+            # Large chunks keep the inter-process traffic low on millions of small files
+            chunksize = max(1, min(256, len(image_paths) // (4 * num_workers)))
+            with ProcessPoolExecutor(num_workers) as executor:
+                errors = list(executor.map(_validate_image, image_paths, [mode] * len(image_paths), chunksize=chunksize))
+            for image_file_name, error in zip(image_file_names, errors):
+                self.entries[image_file_name]["checked"] = level
+                if error is not None:
+                    self.entries[image_file_name]["bad"] = error
+            elapsed = time.time() - start
+            print(f"Validated {len(image_file_names)} images of `{self.images_dir}` ({mode}) in {elapsed:.1f}s, "
+                  f"{len(image_file_names) / max(elapsed, 1e-6):.0f} images/s.")
+            if self.manifest_path is not None:
+                self.save()
+
+        bad_file_names = [image_file_name for image_file_name, entry in self.entries.items() if "bad" in entry]
+        if bad_file_names:
+            print(f"{len(bad_file_names)} unreadable images of `{self.images_dir}` are excluded, "
+                  f"e.g. `{bad_file_names[0]}`: {self.entries[bad_file_names[0]]['bad']}")
+
+        return bad_file_names
+
+    @property
+    def file_names(self) -> List[str]:
+        # Images marked as bad by ``validate`` are never sampled
+        return [image_file_name for image_file_name, entry in self.entries.items() if "bad" not in entry]
+
+    @property
+    def file_paths(self) -> List[str]:
+        return [os.path.join(self.images_dir, image_file_name) for image_file_name in self.file_names]
+
+    @property
+    def image_sizes(self) -> List[Tuple[int, int]]:
+        return [(entry["width"], entry["height"]) for entry in self.entries.values() if "bad" not in entry]
+
+    def __len__(self) -> int:
+        return len(self.file_names)
+
+
+_VALIDATE_LEVELS = {"header": 1, "full": 2}
+# Fewer new or modified images than this are probed in the calling process
+_MIN_POOL_PROBES = 256
+
+
+def _probe_image(image_path: str, hash_contents: bool) -> Tuple[Union[int, None], Union[int, None], Union[str, None]]:
+    # Runs in the process pool, the dimensions come from the image header, the pixel data is not decoded
+    try:
+        with Image.open(image_path) as image:
+            width, height = image.size
+    except Exception:
+        width = height = None
+
+    return width, height, _file_hash(image_path) if hash_contents else None
+
+
+def _validate_image(image_path: str, mode: str) -> Union[str, None]:
+    # Runs in the process pool, returns the reason an image is unreadable
+    try:
+        if mode == "full":
+            image = cv2.imread(image_path, cv2.IMREAD_COLOR)
+            if image is None:
+                return "decoding failed"
+        else:
+            with Image.open(image_path) as image:
+                image.verify()
+    except Exception as e:
+        return f"{type(e).__name__}: {e}"
+
+    return None
+
+
+def _file_hash(file_path: str) -> str:
+    file_hash = hashlib.sha1()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            file_hash.update(chunk)
+
+    return file_hash.hexdigest()
+
+
+def _reduced_decode_flags(
+        image_file_names: List[str],
+        image_sizes: List[Tuple[int, int]],
+        image_size: int,
+) -> List[int]:
+    decode_flags = []
+    for image_file_name, (width, height) in zip(image_file_names, image_sizes):
+        decode_flag = cv2.IMREAD_COLOR
+        if width is not None and image_file_name.lower().endswith(_REDUCED_DECODE_EXTENSIONS):
+            for factor, reduced_decode_flag in _REDUCED_DECODE_FLAGS:
+                # The reduced decoders round the size up
+                if -(-width // factor) >= image_size and -(-height // factor) >= image_size:
+                    decode_flag = reduced_decode_flag
+                    break
+        decode_flags.append(decode_flag)
+
+    return decode_flags
+
+
+def _print_reduced_decode_summary(decode_flags: Dict[str, List[int]]) -> None:
+    factors = {cv2.IMREAD_COLOR: 1}
+    factors.update({reduced_decode_flag: factor for factor, reduced_decode_flag in _REDUCED_DECODE_FLAGS})
+
+    for images_dir, images_decode_flags in decode_flags.items():
+        counts = {factor: 0 for factor in sorted(factors.values())}
+        for decode_flag in images_decode_flags:
+            counts[factors[decode_flag]] += 1
+        summary = ", ".join([f"1/{factor}: {count}" for factor, count in counts.items()])
+        print(f"Reduced decoding of `{images_dir}`: {summary}")
+
+
+def _domain_name(images_dir: str) -> str:
+    images_dir = os.path.abspath(images_dir)
+    # Domains with the same dir name (``trainA`` of two datasets) must not share their metadata
+    dir_hash = hashlib.sha1(images_dir.encode("utf-8")).hexdigest()[:8]
+
+    return f"{os.path.basename(images_dir)}-{dir_hash}"
+
+
+def _image_cache_paths(images_dir: str, cache_dir: str, image_size: int) -> Tuple[str, str]:
+    cache_name = f"{_domain_name(images_dir)}-{image_size}"
+
+    return os.path.join(cache_dir, cache_name + ".npy"), os.path.join(cache_dir, cache_name + ".json")
+
+
+def _list_image_files(images_dir: str, image_file_names: List[str] = None) -> Tuple[List[str], List[int]]:
+    if image_file_names is None:
+        image_file_names = sorted(os.listdir(images_dir))
+    # Integer nanoseconds, like `ImageManifest`, float seconds do not survive the JSON round trip exactly
+    image_mtimes = [os.stat(os.path.join(images_dir, image_file_name)).st_mtime_ns for image_file_name in
+                    image_file_names]
+
+    return image_file_names, image_mtimes
+
+
+def build_image_cache(
+        images_dir: str,
+        cache_dir: str,
+        image_size: int,
+        rebuild: bool = False,
+        image_file_names: List[str] = None,
+) -> Tuple[str, List[str]]:
+    """Write all images of a dir to a contiguous uint8 array of shape [N, H, W, 3] (RGB), read back with ``np.memmap``
+
+    The cache is rebuilt automatically when the dir listing or the modification times of the images no longer match
+    the index file written next to it.
+
+    Args:
+        images_dir (str): Images dir
+        cache_dir (str): Dir where the cache array and its index file are written
+        image_size (int): Size of the cached images
+        rebuild (bool, optional): Rebuild the cache even if it is up to date. Default: ``False``
+        image_file_names (list[str], optional): Image file names in ``images_dir`` to cache, in this order. Default: all
+            images, sorted by name
+
+    Returns:
+        cache_path (str): Path of the cache array (``.npy``)
+        image_file_names (list[str]): Image paths, in the order of the cache array
+
+    Examples:
+        >>> cache_path, image_file_names = build_image_cache("./data/apple2orange/trainA", "./data/cache", 256)
+        >>> images = np.load(cache_path, mmap_mode="r")
+
+    """
+    cache_path, index_path = _image_cache_paths(images_dir, cache_dir, image_size)
+    image_file_names, image_mtimes = _list_image_files(images_dir, image_file_names)
+
+    if not rebuild and os.path.exists(cache_path) and os.path.exists(index_path):
+        with open(index_path, "r") as f:
+            index = json.load(f)
+        if index["image_size"] == image_size and \
+                index["file_names"] == image_file_names and \
+                index["mtimes"] == image_mtimes:
+            return cache_path, [os.path.join(images_dir, image_file_name) for image_file_name in image_file_names]
+        print(f"Image cache `{cache_path}` is out of date, rebuild it.")
+
+    os.makedirs(cache_dir, exist_ok=True)
+    print(f"Build image cache `{cache_path}` ({len(image_file_names)} images)...")
+
+    # Write to a temporary file first, an interrupted build must not leave a valid looking cache behind
+    temp_cache_path = cache_path + ".tmp"
+    images = np.lib.format.open_memmap(temp_cache_path,
+                                       mode="w+",
+                                       dtype=np.uint8,
+                                       shape=(len(image_file_names), image_size, image_size, 3))
+    for i, image_file_name in enumerate(image_file_names):
+        image = _imread(os.path.join(images_dir, image_file_name), cv2.IMREAD_COLOR)
+        image = cv2.resize(image, (image_size, image_size), interpolation=cv2.INTER_CUBIC)
+        images[i] = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    images.flush()
+    del images
+    os.replace(temp_cache_path, cache_path)
+
+    with open(index_path + ".tmp", "w") as f:
+        json.dump({"images_dir": os.path.abspath(images_dir),
+                   "image_size": image_size,
+                   "file_names": image_file_names,
+                   "mtimes": image_mtimes},
+                  f)
+    os.replace(index_path + ".tmp", index_path)
+
+    return cache_path, [os.path.join(images_dir, image_file_name) for image_file_name in image_file_names]
+
+
+class PrefetchGenerator:
     """A fast data prefetch generator.
 
+    Batches are loaded by ``num_threads`` producer threads and handed out in sampler order. Producers stop claiming
+    new batches while ``num_data_prefetch_queue`` batches or ``max_prefetch_bytes`` are waiting to be consumed, an
+    exception raised by a producer is re-raised by ``__next__``.
+
     Args:
-        generator: Data generator.
+        batches: Iterable of batch indices (e.g. a batch sampler), or of ready batches when ``fetch_fn`` is ``None``.
         num_data_prefetch_queue (int): How many early data load queues.
+        fetch_fn (callable, optional): Loads the batch of a list of indices, ``None`` passes the items of ``batches``
+            through, with a single producer. Default: ``None``
+        num_threads (int, optional): Number of producer threads. Default: ``1``
+        max_prefetch_bytes (int, optional): Bound of the tensor bytes waiting to be consumed, ``0`` means no bound.
+            Default: ``0``
     """
 
-    def __init__(self, generator, num_data_prefetch_queue: int) -> None:
-        threading.Thread.__init__(self)
-        self.queue = queue.Queue(num_data_prefetch_queue)
-        self.generator = generator
-        self.daemon = True
-        self.start()
+    def __init__(
+            self,
+            batches,
+            num_data_prefetch_queue: int,
+            fetch_fn=None,
+            num_threads: int = 1,
+            max_prefetch_bytes: int = 0,
+    ) -> None:
+        self.batches = iter(batches)
+        self.num_data_prefetch_queue = max(num_data_prefetch_queue, 1)
+        self.fetch_fn = fetch_fn
+        self.max_prefetch_bytes = max_prefetch_bytes
+
+        # Shared between the producers and the consumer, guarded by the condition
+        self._condition = threading.Condition()
+        self._ready = {}
+        self._next_claim_index = 0
+        self._next_index = 0
+        self._end_index = None
+        self._pending = 0
+        self._pending_bytes = 0
+        self._stopped = False
+
+        num_threads = 1 if fetch_fn is None else max(num_threads, 1)
+        self._threads = [threading.Thread(target=self._produce, name=f"prefetch-{i}", daemon=True)
+                         for i in range(num_threads)]
+        for thread in self._threads:
+            thread.start()
+
+    def _claim(self):
+        # Wait for room, then reserve the next batch index, ``None`` once exhausted or stopped
+        with self._condition:
+            while not self._stopped and self._is_full():
+                self._condition.wait()
+            if self._stopped or self._end_index is not None:
+                return None
+
+            index = self._next_claim_index
+            self._next_claim_index += 1
+            self._pending += 1
+            if self.fetch_fn is None:
+                # Single producer, the (slow) next batch is loaded outside of the lock
+                return index, None
 
-    def run(self) -> None:
-        for item in self.generator:
-            self.queue.put(item)
-        self.queue.put(None)
+            try:
+                return index, next(self.batches)
+            except StopIteration:
+                self._finish(index)
+                return None
+            except Exception as e:
+                self._ready[index] = (e, 0)
+                self._end_index = index + 1
+                self._condition.notify_all()
+                return None
+
+    def _finish(self, index: int) -> None:
+        # Called with the condition held, ``index`` was reserved but there is no batch left for it
+        self._end_index = index
+        self._pending -= 1
+        self._condition.notify_all()
+
+    def _is_full(self) -> bool:
+        if self._pending >= self.num_data_prefetch_queue:
+            return True
+        # At least one batch is always allowed, otherwise a single large batch could never be loaded
+        return 0 < self.max_prefetch_bytes <= self._pending_bytes and self._pending > 0
+
+    def _produce(self) -> None:
+        while True:
+            claim = self._claim()
+            if claim is None:
+                return
+            index, item = claim
+
+            try:
+                if self.fetch_fn is None:
+                    batch = next(self.batches)
+                else:
+                    batch = self.fetch_fn(item)
+                nbytes = _batch_nbytes(batch)
+            except StopIteration:
+                with self._condition:
+                    self._finish(index)
+                return
+            except Exception as e:
+                batch, nbytes = e, 0
+
+            with self._condition:
+                self._ready[index] = (batch, nbytes)
+                self._pending_bytes += nbytes
+                if isinstance(batch, Exception):
+                    self._end_index = index + 1
+                self._condition.notify_all()
 
     def __next__(self):
-        next_item = self.queue.get()
-        if next_item is None:
-            raise StopIteration
-        return next_item
+        with self._condition:
+            while self._next_index not in self._ready:
+                if self._stopped or self._next_index == self._end_index:
+                    raise StopIteration
+                self._condition.wait()
+
+            batch, nbytes = self._ready.pop(self._next_index)
+            self._next_index += 1
+            self._pending -= 1
+            self._pending_bytes -= nbytes
+            self._condition.notify_all()
+
+        if isinstance(batch, Exception):
+            self.close()
+            raise batch
+
+        return batch
 
     def __iter__(self):
         return self
 
+    def close(self) -> None:
+        """Stop the producers, e.g. when the iteration is abandoned before the end"""
+        if not hasattr(self, "_threads"):
+            return
+
+        with self._condition:
+            self._stopped = True
+            self._ready.clear()
+            self._condition.notify_all()
+
+        current_thread = threading.current_thread()
+        for thread in self._threads:
+            if thread is not current_thread:
+                thread.join()
+
+    def __del__(self):
+        self.close()
+
 
 class PrefetchDataLoader(DataLoader):
     """A fast data prefetch dataloader.
 
+    Loads the batches with producer threads in the main process instead of forking DataLoader workers, which suits hosts
+    with little memory. Map-style datasets are loaded by ``num_threads`` threads, iterable datasets by a single one.
+
     Args:
         num_data_prefetch_queue (int): How many early data load queues.
+        num_threads (int, optional): Number of producer threads. Default: ``2``
+        max_prefetch_bytes (int, optional): Bound of the tensor bytes of the loaded batches waiting to be consumed,
+            ``0`` means no bound. Default: ``0``
         kwargs (dict): Other extended parameters.
     """
 
-    def __init__(self, num_data_prefetch_queue: int, **kwargs) -> None:
+    def __init__(self, num_data_prefetch_queue: int, num_threads: int = 2, max_prefetch_bytes: int = 0, **kwargs) -> None:
         self.num_data_prefetch_queue = num_data_prefetch_queue
+        self.num_threads = num_threads
+        self.max_prefetch_bytes = max_prefetch_bytes
+        self._prefetch_generator = None
         super(PrefetchDataLoader, self).__init__(**kwargs)
 
+    def _fetch(self, batch_indices: list):
+        if hasattr(self.dataset, "__getitems__"):
+            samples = self.dataset.__getitems__(batch_indices)
+        else:
+            samples = [self.dataset[batch_index] for batch_index in batch_indices]
+        batch = self.collate_fn(samples)
+
+        if self.pin_memory and torch.cuda.is_available():
+            batch = _pin_batch(batch)
+
+        return batch
+
     def __iter__(self):
-        return PrefetchGenerator(super().__iter__(), self.num_data_prefetch_queue)
+        # A new pass (epoch) stops the producers of the previous one, should it have been left early
+        if self._prefetch_generator is not None:
+            self._prefetch_generator.close()
+
+        if isinstance(self.dataset, IterableDataset) or self.batch_sampler is None:
+            self._prefetch_generator = PrefetchGenerator(super().__iter__(),
+                                                         self.num_data_prefetch_queue,
+                                                         max_prefetch_bytes=self.max_prefetch_bytes)
+        else:
+            self._prefetch_generator = PrefetchGenerator(self.batch_sampler,
+                                                         self.num_data_prefetch_queue,
+                                                         self._fetch,
+                                                         self.num_threads,
+                                                         self.max_prefetch_bytes)
+
+        return self._prefetch_generator
 
 
-class CPUPrefetcher:
-    """Use the CPU side to accelerate data reading.
+class PinnedBatchCollator(object):
+    """Collate samples straight into reusable, preallocated batch buffers in pinned memory
+
+    Replaces the default collate plus ``pin_memory=True``, which allocate a batch and then copy it again into a new
+    pinned batch. The buffers are allocated for the first batch and handed out again once ``release`` was called for
+    them and their device copy finished, the pool grows should every buffer still be in use. Collation has to run in
+    the main process (``NUM_WORKERS: 0`` or ``PrefetchDataLoader``), pinned memory of worker processes is not shared.
 
     Args:
-        dataloader (DataLoader): Data loader. Combines a dataset and a sampler, and provides an iterable over the given dataset.
+        num_buffers (int, optional): Batch buffers allocated up front, at least the number of batches in flight between
+            the loader and the device. Default: ``8``
     """
 
-    def __init__(self, dataloader: DataLoader) -> None:
-        self.original_dataloader = dataloader
-        self.data = iter(dataloader)
+    def __init__(self, num_buffers: int = 8) -> None:
+        self.num_buffers = num_buffers
+        self._lock = threading.Lock()
+        # Free buffers with the event of their last device copy, buffers in use by the data pointer of their first tensor
+        self._free_buffers = []
+        self._used_buffers = {}
+        self._buffer_shapes = None
 
-    def next(self):
-        try:
-            return next(self.data)
-        except StopIteration:
-            return None
+    def __call__(self, samples: List[Dict[str, Any]]) -> Dict[str, Any]:
+        first_sample = samples[0]
+        buffer_shapes = {k: (tuple(v.shape), v.dtype) for k, v in first_sample.items() if torch.is_tensor(v)}
+        if not buffer_shapes:
+            return default_collate(samples)
 
-    def reset(self):
-        self.data = iter(self.original_dataloader)
+        batch_buffers = self._acquire(len(samples), buffer_shapes)
+        batch_data = {}
+        for k, v in first_sample.items():
+            if k in batch_buffers:
+                # Written in place, no intermediate batch is allocated
+                batch_data[k] = torch.stack([sample[k] for sample in samples], out=batch_buffers[k][:len(samples)])
+            else:
+                batch_data[k] = default_collate([sample[k] for sample in samples])
 
-    def __len__(self) -> int:
-        return len(self.original_dataloader)
+        return batch_data
+
+    def _acquire(self, batch_size: int, buffer_shapes: Dict[str, Any]) -> Dict[str, Tensor]:
+        with self._lock:
+            if self._buffer_shapes is None:
+                self._buffer_shapes = (batch_size, buffer_shapes)
+                self._free_buffers = [(self._allocate(), None) for _ in range(self.num_buffers)]
+
+            max_batch_size, max_buffer_shapes = self._buffer_shapes
+            if batch_size > max_batch_size or buffer_shapes != max_buffer_shapes:
+                raise ValueError(f"Batch of {batch_size} samples of {buffer_shapes} does not fit the pinned batch buffers "
+                                 f"of {max_batch_size} samples of {max_buffer_shapes}, all samples need the same size.")
+
+            if self._free_buffers:
+                batch_buffers, event = self._free_buffers.pop(0)
+            else:
+                batch_buffers, event = self._allocate(), None
+            self._used_buffers[_first_data_ptr(batch_buffers)] = batch_buffers
 
+        # The last device copy out of the buffer has to finish before it is overwritten
+        if event is not None:
+            event.synchronize()
 
-class CUDAPrefetcher:
-    """Use the CUDA side to accelerate data reading.
+        return batch_buffers
+
+    def _allocate(self) -> Dict[str, Tensor]:
+        batch_size, buffer_shapes = self._buffer_shapes
+        return {k: torch.empty((batch_size,) + shape, dtype=dtype, pin_memory=torch.cuda.is_available())
+                for k, (shape, dtype) in buffer_shapes.items()}
+
+    def release(self, batch_data: Dict[str, Any], event: Any = None) -> None:
+        """Give the buffers of a batch back, once ``event`` (``torch.cuda.Event`` of its device copy) completed
+
+        Args:
+            batch_data (dict): Batch returned by the collator
+            event (torch.cuda.Event, optional): Event recorded after the copy out of the buffers, ``None`` means the
+                buffers can be reused right away. Default: ``None``
+        """
+        with self._lock:
+            batch_buffers = self._used_buffers.pop(_first_data_ptr(batch_data), None)
+            if batch_buffers is not None:
+                self._free_buffers.append((batch_buffers, event))
+
+
+def _first_data_ptr(batch_data: Dict[str, Any]) -> int:
+    for v in batch_data.values():
+        if torch.is_tensor(v):
+            return v.data_ptr()
+
+    return 0
+
+
+def _batch_nbytes(batch: Any) -> int:
+    if torch.is_tensor(batch):
+        return batch.nelement() * batch.element_size()
+    if isinstance(batch, dict):
+        return sum(_batch_nbytes(v) for v in batch.values())
+    if isinstance(batch, (list, tuple)):
+        return sum(_batch_nbytes(v) for v in batch)
+
+    return 0
+
+
+def _pin_batch(batch: Any) -> Any:
+    if torch.is_tensor(batch):
+        return batch.pin_memory()
+    if isinstance(batch, dict):
+        return {k: _pin_batch(v) for k, v in batch.items()}
+    if isinstance(batch, (list, tuple)):
+        return type(batch)(_pin_batch(v) for v in batch)
+
+    return batch
+
+
+class DevicePrefetcher:
+    """Load, pin and copy batches to the running device in a background thread, ``num_prefetch_batches`` ahead.
+
+    On CUDA devices the copy and the uint8 normalization run on a side stream and every batch carries an event the
+    consumer stream waits on, on other devices (CPU, MPS) the thread copies the batches directly. Nothing is loaded
+    before the first :meth:`reset`, after the sampler state of a resumed run and the epoch are set.
 
     Args:
         dataloader (DataLoader): Data loader. Combines a dataset and a sampler, and provides an iterable over the given dataset.
         device (torch.device): Specify running device.
+        num_prefetch_batches (int, optional): Depth of the queue of batches ready on the device. Default: ``2``
+        memory_format (torch.memory_format, optional): Memory format of the image batches on the device, the
+            conversion runs in the background thread as well. Default: ``torch.contiguous_format``
     """
 
-    def __init__(self, dataloader: DataLoader, device: torch.device):
-        self.batch_data = None
+    def __init__(
+            self,
+            dataloader: DataLoader,
+            device: torch.device,
+            num_prefetch_batches: int = 2,
+            memory_format: torch.memory_format = torch.contiguous_format,
+    ) -> None:
         self.original_dataloader = dataloader
         self.device = device
+        self.num_prefetch_batches = max(num_prefetch_batches, 1)
+        self.memory_format = memory_format
+        self.use_stream = device.type == "cuda"
+        self.stream = torch.cuda.Stream(device) if self.use_stream else None
+
+        self._data = None
+        self._queue = None
+        self._stop_event = None
+        self._thread = None
+        self.reset_stats()
 
-        self.data = iter(dataloader)
-        self.stream = torch.cuda.Stream()
-        self.preload()
+    def _worker(self, data: Any, batch_queue: queue.Queue, stop_event: threading.Event) -> None:
+        if self.use_stream and self.device.index is not None:
+            torch.cuda.set_device(self.device)
 
-    def preload(self):
         try:
-            self.batch_data = next(self.data)
-        except StopIteration:
-            self.batch_data = None
-            return None
+            for batch_data in data:
+                batch_data, event = self._copy_to_device(batch_data)
+                if not _put_unless_stopped(batch_queue, (batch_data, event), stop_event):
+                    return
+        except Exception as e:
+            # Surfaced by `next()` in the training loop instead of hanging it
+            _put_unless_stopped(batch_queue, (e, None), stop_event)
+            return
+
+        _put_unless_stopped(batch_queue, (None, None), stop_event)
+
+    def _copy_to_device(self, batch_data: Dict[str, Any]) -> Tuple[Dict[str, Any], Any]:
+        # Batch buffers of `PinnedBatchCollator` go back to its pool once copied
+        release = getattr(self.original_dataloader.collate_fn, "release", None)
+        host_batch_data = dict(batch_data)
+
+        if not self.use_stream:
+            for k, v in batch_data.items():
+                if torch.is_tensor(v):
+                    batch_data[k] = v.to(self.device, copy=release is not None)
+            if release is not None:
+                release(host_batch_data, None)
+            return _uint8_batch_to_tensor(batch_data, self.memory_format), None
 
         with torch.cuda.stream(self.stream):
-            for k, v in self.batch_data.items():
+            for k, v in batch_data.items():
                 if torch.is_tensor(v):
-                    self.batch_data[k] = self.batch_data[k].to(self.device, non_blocking=True)
+                    # Without pinned memory the copy below is synchronous
+                    if not v.is_pinned():
+                        v = v.pin_memory()
+                    batch_data[k] = v.to(self.device, non_blocking=True)
+            # Normalize uint8 images on the device, right behind the copy
+            batch_data = _uint8_batch_to_tensor(batch_data, self.memory_format)
+            event = torch.cuda.Event()
+            event.record(self.stream)
+
+        if release is not None:
+            release(host_batch_data, event)
+
+        return batch_data, event
 
     def next(self):
-        torch.cuda.current_stream().wait_stream(self.stream)
-        batch_data = self.batch_data
-        self.preload()
+        if self._queue is None:
+            raise RuntimeError("The prefetcher is not started, call `reset()` at the beginning of every epoch.")
+
+        start_time = time.perf_counter()
+        self._queue_depth_sum += self._queue.qsize()
+        batch_data, event = self._queue.get()
+        self._wait_time += time.perf_counter() - start_time
+
+        if batch_data is None:
+            return None
+        if isinstance(batch_data, Exception):
+            raise batch_data
+
+        self._num_batches += 1
+        if event is not None:
+            current_stream = torch.cuda.current_stream(self.device)
+            current_stream.wait_event(event)
+            # Tensors allocated on the side stream must not be reused before the training stream is done with them
+            for v in batch_data.values():
+                if torch.is_tensor(v):
+                    v.record_stream(current_stream)
+
         return batch_data
 
     def reset(self):
-        self.data = iter(self.original_dataloader)
-        self.preload()
+        self.close()
+
+        self._data = iter(self.original_dataloader)
+        self._queue = queue.Queue(self.num_prefetch_batches)
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._worker,
+                                        args=(self._data, self._queue, self._stop_event),
+                                        daemon=True)
+        self._thread.start()
+
+    def close(self) -> None:
+        """Stop the background thread of the current pass, e.g. before leaving an epoch early"""
+        if self._thread is None:
+            return
+
+        self._stop_event.set()
+        # Thread loaders (`PrefetchDataLoader`) stop their producers as well
+        if hasattr(self._data, "close"):
+            self._data.close()
+        # Unblock a producer waiting on a full queue
+        while self._thread.is_alive():
+            try:
+                self._queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        self._thread = None
+
+    def stats(self) -> Dict[str, float]:
+        """Batches served, total and mean time spent waiting for a batch (seconds), mean ready batches in the queue"""
+        num_batches = max(self._num_batches, 1)
+        return {"batches": self._num_batches,
+                "wait_time": self._wait_time,
+                "mean_wait_time": self._wait_time / num_batches,
+                "mean_queue_depth": self._queue_depth_sum / num_batches}
+
+    def reset_stats(self) -> None:
+        self._num_batches = 0
+        self._wait_time = 0.0
+        self._queue_depth_sum = 0
 
     def __len__(self) -> int:
         return len(self.original_dataloader)
+
+
+def _put_unless_stopped(batch_queue: queue.Queue, item: Any, stop_event: threading.Event) -> bool:
+    while not stop_event.is_set():
+        try:
+            batch_queue.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+
+    return False
+
+
+def _uint8_batch_to_tensor(
+        batch_data: Dict[str, Tensor],
+        memory_format: torch.memory_format = torch.contiguous_format,
+) -> Dict[str, Tensor]:
+    # Batches of the uint8 data path are NHWC uint8, float image batches only change their memory format
+    for k, v in batch_data.items():
+        if torch.is_tensor(v) and v.dim() == 4:
+            if v.dtype == torch.uint8:
+                batch_data[k] = uint8_image_to_tensor(v, True, False, memory_format)
+            else:
+                batch_data[k] = v.contiguous(memory_format=memory_format)
+
+    return batch_data
@@ -20,13 +20,16 @@ import torch
 from numpy import ndarray
 from torch import Tensor
 from torchvision.transforms import functional as F_vision
-from typing import Union, List
+from typing import Union, List, Tuple
 
 __all__ = [
-    "image_to_tensor", "tensor_to_image",
+    "image_to_tensor", "uint8_image_to_tensor", "tensor_to_image",
     "preprocess_one_image",
     "center_crop_torch", "random_crop_torch", "random_rotate_torch", "random_vertically_flip_torch",
     "random_horizontally_flip_torch",
+    "random_crop_batch_torch", "random_rotate90_batch_torch", "random_rotate_batch_torch", "random_vertically_flip_batch_torch",
+    "random_horizontally_flip_batch_torch",
+    "AugmentationPlan", "fused_augment_batch_torch",
 ]
 
 
@@ -60,6 +63,41 @@ def image_to_tensor(image: ndarray, range_norm: bool, half: bool) -> Tensor:
     return tensor
 
 
+def uint8_image_to_tensor(
+        tensor: Tensor,
+        range_norm: bool,
+        half: bool,
+        memory_format: torch.memory_format = torch.contiguous_format,
+) -> Tensor:
+    """Convert a batch of uint8 images (NHWC) to the float Tensor (NCHW) data type on the device of the batch
+
+    Args:
+        tensor (Tensor): uint8 image batch of shape [N, H, W, C], the data range is [0, 255]
+        range_norm (bool): Scale [0, 1] data to between [-1, 1]
+        half (bool): Whether to convert to torch.half instead of torch.float32
+        memory_format (torch.memory_format, optional): Memory format of the returned Tensor.
+            Default: ``torch.contiguous_format``
+
+    Returns:
+        tensor (Tensor): Data types supported by PyTorch
+
+    Examples:
+        >>> example_batch = torch.randint(0, 256, (4, 256, 256, 3), dtype=torch.uint8)
+        >>> example_tensor = uint8_image_to_tensor(example_batch, range_norm=True, half=False)
+
+    """
+    # Layout and dtype conversion in a single copy
+    tensor = tensor.permute(0, 3, 1, 2).to(dtype=torch.half if half else torch.float, memory_format=memory_format)
+
+    # Scale the image data from [0, 255] to [-1, 1] or [0, 1] in place
+    if range_norm:
+        tensor = tensor.mul_(2.0 / 255.).sub_(1.0)
+    else:
+        tensor = tensor.div_(255.)
+
+    return tensor
+
+
 def tensor_to_image(tensor: Tensor, range_norm: bool, half: bool) -> Any:
     """Convert the Tensor(NCWH) data type supported by PyTorch to the np.ndarray(WHC) image data type
 
@@ -104,322 +142,668 @@ def preprocess_one_image(image_path: str, range_norm: bool, half: bool, device:
 
 def center_crop_torch(
         src_images: Union[np.ndarray, torch.Tensor, List[np.ndarray], List[torch.Tensor]],
-        dst_images: Union[np.ndarray, torch.Tensor, List[np.ndarray], List[torch.Tensor]],
+        dst_images: Union[np.ndarray, torch.Tensor, List[np.ndarray], List[torch.Tensor], None],
         # src_images: ndarray | Tensor | List[ndarray] | List[Tensor],
-        # dst_images: ndarray | Tensor | List[ndarray] | List[Tensor],
+        # dst_images: ndarray | Tensor | List[ndarray] | List[Tensor] | None,
         patch_size: int,
 ) -> Union[ndarray, torch.Tensor, List[ndarray], List[Tensor]]:
     #[ndarray, ndarray] or [Tensor, Tensor] or [List[ndarray], List[ndarray]] or [List[Tensor], List[Tensor]]:
     """Intercept two images to specify the center area
 
+    Numpy images (HWC) are cropped to views, Tensor images (..., H, W) to Tensor views.
+
     Args:
         src_images (ndarray | Tensor | list[ndarray] | list[Tensor]): Source image read by PyTorch
-        dst_images (ndarray | Tensor | list[ndarray] | list[Tensor]): Destination image read by PyTorch
+        dst_images (ndarray | Tensor | list[ndarray] | list[Tensor] | None): Destination image read by PyTorch,
+            ``None`` processes ``src_images`` only
         patch_size (int): The size of the intercepted image
 
     Returns:
         src_images (ndarray or Tensor or): the intercepted ground truth image
         dst_images (ndarray or Tensor or): low-resolution intercepted images
     """
-
-    if src_images.shape[2] != dst_images.shape[2]:
-        raise ValueError("The height of the source image and the destination image must be the same")
-    if src_images.shape[3] != dst_images.shape[3]:
-        raise ValueError("The width of the source image and the destination image must be the same")
-
-    if not isinstance(src_images, list):
-        src_images = [src_images]
-    if not isinstance(dst_images, list):
-        dst_images = [dst_images]
-
-    # detect input image type
-    input_type = "Tensor" if torch.is_tensor(src_images[0]) else "Numpy"
-
-    if input_type == "Tensor":
-        image_height, image_width = src_images[0].size()[-2:]
-    else:
-        image_height, image_width = src_images[0].shape[0:2]
+    src_images, dst_images, input_type = _check_images(src_images, dst_images)
+    image_height, image_width = _image_size(src_images[0])
 
     # Just need to find the top and left coordinates of the image
     top = (image_height - patch_size) // 2
     left = (image_width - patch_size) // 2
 
     # Capture low-resolution images
-    if input_type == "Tensor":
-        src_images = [src_image[
-                      :,
-                      :,
-                      top: top + patch_size,
-                      left: left + patch_size] for src_image in src_images]
-        dst_images = [dst_image[
-                     :,
-                     :,
-                     top: top + patch_size,
-                     left: left + patch_size] for dst_image in dst_images]
-    else:
-        src_images = [src_image[
-                      :,
-                      :,
-                      top: top + patch_size,
-                      left: left + patch_size] for src_image in src_images]
-        dst_images = [dst_image[
-                     top: top + patch_size,
-                     left: left + patch_size,
-                     ...] for dst_image in dst_images]
-
-    # When the input has only one image
-    if len(src_images) == 1:
-        src_images = src_images[0]
-    if len(dst_images) == 1:
-        dst_images = dst_images[0]
+    src_images = [_crop_image(src_image, input_type, top, left, patch_size) for src_image in src_images]
+    dst_images = [_crop_image(dst_image, input_type, top, left, patch_size) for dst_image in dst_images]
 
-    return src_images, dst_images
+    return _unpack_images(src_images, dst_images)
 
 
 def random_crop_torch(
         src_images: Union[ndarray, torch.Tensor, List[ndarray], List[Tensor]],
-        dst_images: Union[ndarray, torch.Tensor, List[ndarray], List[Tensor]],
+        dst_images: Union[ndarray, torch.Tensor, List[ndarray], List[Tensor], None],
         # src_images: ndarray | Tensor | List[ndarray] | List[Tensor],
-        # dst_images: ndarray | Tensor | List[ndarray] | List[Tensor],
+        # dst_images: ndarray | Tensor | List[ndarray] | List[Tensor] | None,
         patch_size: int,
+        generator: Any = None,
 ) -> Union[ndarray, torch.Tensor, List[ndarray], List[Tensor]]:
 # -> [ndarray, ndarray] or [Tensor, Tensor] or [list[ndarray], list[ndarray]] or [list[Tensor], list[Tensor]]:
     """Randomly intercept two images in the specified area
 
+    Numpy images (HWC) are cropped to views, Tensor images (..., H, W) to Tensor views.
+
     Args:
         src_images (ndarray | Tensor | list[ndarray] | list[Tensor]): Source image read by PyTorch
-        dst_images (ndarray | Tensor | list[ndarray] | list[Tensor]): Destination image read by PyTorch
+        dst_images (ndarray | Tensor | list[ndarray] | list[Tensor] | None): Destination image read by PyTorch,
+            ``None`` processes ``src_images`` only
         patch_size (int): The size of the intercepted image
+        generator (optional, np.random.Generator | torch.Generator): Random number generator, ``None`` means the
+            global ``random`` module. Default: None
 
     Returns:
         src_images (ndarray or Tensor or): the intercepted ground truth image
         dst_images (ndarray or Tensor or): low-resolution intercepted images
 
     """
-
-    if src_images.shape[2] != dst_images.shape[2]:
-        raise ValueError("The height of the source image and the destination image must be the same")
-    if src_images.shape[3] != dst_images.shape[3]:
-        raise ValueError("The width of the source image and the destination image must be the same")
-
-    if not isinstance(src_images, list):
-        src_images = [src_images]
-    if not isinstance(dst_images, list):
-        dst_images = [dst_images]
-
-    # detect input image type
-    input_type = "Tensor" if torch.is_tensor(src_images[0]) else "Numpy"
-
-    if input_type == "Tensor":
-        image_height, image_width = src_images[0].size()[-2:]
-    else:
-        image_height, image_width = src_images[0].shape[0:2]
+    src_images, dst_images, input_type = _check_images(src_images, dst_images)
+    image_height, image_width = _image_size(src_images[0])
 
     # Just need to find the top and left coordinates of the image
-    top = random.randint(0, image_height - patch_size)
-    left = random.randint(0, image_width - patch_size)
+    top = _randint(generator, 0, image_height - patch_size)
+    left = _randint(generator, 0, image_width - patch_size)
 
     # Capture low-resolution images
-    if input_type == "Tensor":
-        src_images = [src_image[
-                     :,
-                     :,
-                     top: top + patch_size,
-                     left: left + patch_size] for src_image in src_images]
-        dst_images = [dst_image[
-                     :,
-                     :,
-                     top: top + patch_size,
-                     left: left + patch_size] for dst_image in dst_images]
-    else:
-        src_images = [src_image[
-                     :,
-                     :,
-                     top: top + patch_size,
-                     left: left + patch_size] for src_image in src_images]
-        dst_images = [dst_image[
-                     :,
-                     :,
-                     top: top + patch_size,
-                     left: left + patch_size] for dst_image in dst_images]
-
-    # When the input has only one image
-    if len(src_images) == 1:
-        src_images = src_images[0]
-    if len(dst_images) == 1:
-        dst_images = dst_images[0]
+    src_images = [_crop_image(src_image, input_type, top, left, patch_size) for src_image in src_images]
+    dst_images = [_crop_image(dst_image, input_type, top, left, patch_size) for dst_image in dst_images]
 
-    return src_images, dst_images
+    return _unpack_images(src_images, dst_images)
 
 
 def random_rotate_torch(
         src_images: Union[ndarray, torch.Tensor, List[ndarray], List[Tensor]],
-        dst_images: Union[ndarray, torch.Tensor, List[ndarray], List[Tensor]],
+        dst_images: Union[ndarray, torch.Tensor, List[ndarray], List[Tensor], None],
         # src_images: ndarray | Tensor | List[ndarray] | List[Tensor],
-        # dst_images: ndarray | Tensor | List[ndarray] | List[Tensor],
+        # dst_images: ndarray | Tensor | List[ndarray] | List[Tensor] | None,
         angles: list,
         center: tuple = None,
-        rotate_scale_factor: float = 1.0
+        rotate_scale_factor: float = 1.0,
+        generator: Any = None,
 ) -> Union[ndarray, torch.Tensor, List[ndarray], List[Tensor]]:
 # [ndarray, ndarray] or [Tensor, Tensor] or [list[ndarray], list[ndarray]] or [list[Tensor], list[Tensor]]:
     """Randomly rotate the image
 
+    Rotations by a multiple of 90 degrees around the image center are exact: ``torch.rot90`` for Tensor images,
+    ``np.rot90`` views for numpy images (HWC). Other Tensor rotations run as one batched ``affine_grid``/``grid_sample``
+    over all images, other numpy rotations go through ``cv2.warpAffine``.
+
     Args:
         src_images (ndarray | Tensor | list[ndarray] | list[Tensor]): ground truth images read by the PyTorch library
-        dst_images (ndarray | Tensor | list[ndarray] | list[Tensor]): low-resolution images read by the PyTorch library
+        dst_images (ndarray | Tensor | list[ndarray] | list[Tensor] | None): low-resolution images read by the PyTorch
+            library, ``None`` processes ``src_images`` only
         angles (list): List of random rotation angles
-        center (optional, tuple[int, int]): Rotation center. Default: None
-        rotate_scale_factor (optional, float): Rotation scaling factor. Default: 1.0
+        center (optional, tuple[int, int]): Rotation center, ``None`` means the image center. Default: None
+        rotate_scale_factor (optional, float): Rotation scaling factor, numpy images only. Default: 1.0
+        generator (optional, np.random.Generator | torch.Generator): Random number generator, ``None`` means the
+            global ``random`` module. Default: None
 
     Returns:
         src_images (ndarray or Tensor or): ground truth image after rotation
         dst_images (ndarray or Tensor or): Rotated low-resolution images
     """
-
-    if src_images.shape[2] != dst_images.shape[2]:
-        raise ValueError("The height of the source image and the destination image must be the same")
-    if src_images.shape[3] != dst_images.shape[3]:
-        raise ValueError("The width of the source image and the destination image must be the same")
+    src_images, dst_images, input_type = _check_images(src_images, dst_images)
+    image_height, image_width = _image_size(src_images[0])
 
     # Randomly choose the rotation angle
-    angle = random.choice(angles)
-
-    if not isinstance(src_images, list):
-        src_images = [src_images]
-    if not isinstance(dst_images, list):
-        dst_images = [dst_images]
+    angle = angles[_randint(generator, 0, len(angles) - 1)]
 
-    # detect input image type
-    input_type = "Tensor" if torch.is_tensor(src_images[0]) else "Numpy"
+    # Exact and allocation-free for right angles, as long as the image shape is kept
+    if (center is None and rotate_scale_factor == 1.0 and angle % 90 == 0 and
+            (angle % 180 == 0 or image_height == image_width)):
+        if input_type == "Tensor":
+            src_images = [torch.rot90(src_image, angle // 90, dims=(-2, -1)) for src_image in src_images]
+            dst_images = [torch.rot90(dst_image, angle // 90, dims=(-2, -1)) for dst_image in dst_images]
+        else:
+            src_images = [np.rot90(src_image, angle // 90) for src_image in src_images]
+            dst_images = [np.rot90(dst_image, angle // 90) for dst_image in dst_images]
+        return _unpack_images(src_images, dst_images)
 
     if input_type == "Tensor":
-        image_height, image_width = src_images[0].size()[-2:]
-    else:
-        image_height, image_width = src_images[0].shape[0:2]
-
-    # Rotate all images
+        # All images of both lists in a single resampling pass
+        images = src_images + dst_images
+        image_batch = torch.cat([image.reshape((-1,) + tuple(image.shape[-3:])) for image in images])
+        angle_batch = torch.full((image_batch.size(0),), float(angle), device=image_batch.device)
+        image_batch = _rotate_batch(image_batch, angle_batch, center)
+
+        rotated_images = []
+        for image in images:
+            num_images = image.numel() // image.shape[-3:].numel()
+            rotated_images.append(image_batch[:num_images].reshape(image.shape))
+            image_batch = image_batch[num_images:]
+        return _unpack_images(rotated_images[:len(src_images)], rotated_images[len(src_images):])
+
+    # Same center as the Tensor branch, the middle of the image
     if center is None:
-        center = [image_width // 2, image_height // 2]
+        center = ((image_width - 1) / 2, (image_height - 1) / 2)
 
     matrix = cv2.getRotationMatrix2D(center, angle, rotate_scale_factor)
+    src_images = [cv2.warpAffine(src_image, matrix, (image_width, image_height)) for src_image in src_images]
+    dst_images = [cv2.warpAffine(dst_image, matrix, (image_width, image_height)) for dst_image in dst_images]
 
-    if input_type == "Tensor":
-        src_images = [F_vision.rotate(src_image, angle, center=center) for src_image in src_images]
-        dst_images = [F_vision.rotate(dst_image, angle, center=center) for dst_image in dst_images]
-    else:
-        src_images = [cv2.warpAffine(src_image, matrix, (image_width, image_height)) for src_image in src_images]
-        dst_images = [cv2.warpAffine(dst_image, matrix, (image_width, image_height)) for dst_image in dst_images]
-
-    # When the input has only one image
-    if len(src_images) == 1:
-        src_images = src_images[0]
-    if len(dst_images) == 1:
-        dst_images = dst_images[0]
-
-    return src_images, dst_images
+    return _unpack_images(src_images, dst_images)
 
 
 def random_horizontally_flip_torch(
         src_images: Union[ndarray, torch.Tensor, List[ndarray], List[Tensor]],
-        dst_images: Union[ndarray, torch.Tensor, List[ndarray], List[Tensor]],
+        dst_images: Union[ndarray, torch.Tensor, List[ndarray], List[Tensor], None],
         # src_images: ndarray | Tensor | List[ndarray] | List[Tensor],
-        # dst_images: ndarray | Tensor | List[ndarray] | List[Tensor],
-        p: float = 0.5
+        # dst_images: ndarray | Tensor | List[ndarray] | List[Tensor] | None,
+        p: float = 0.5,
+        generator: Any = None,
 ) -> Union[ndarray, torch.Tensor, List[ndarray], List[Tensor]]:
 # [ndarray, ndarray] or [Tensor, Tensor] or [list[ndarray], list[ndarray]] or [list[Tensor], list[Tensor]]:
-    """Randomly flip the image up and down
+    """Randomly flip the image left and right
+
+    Numpy images (HWC) are flipped to views.
 
     Args:
         src_images (ndarray): ground truth images read by the PyTorch library
-        dst_images (ndarray): low resolution images read by the PyTorch library
+        dst_images (ndarray): low resolution images read by the PyTorch library, ``None`` processes ``src_images`` only
         p (optional, float): flip probability. Default: 0.5
+        generator (optional, np.random.Generator | torch.Generator): Random number generator, ``None`` means the
+            global ``random`` module. Default: None
 
     Returns:
         src_images (ndarray or Tensor or): flipped ground truth images
         dst_images (ndarray or Tensor or): flipped low-resolution images
     """
-
-    if src_images.shape[2] != dst_images.shape[2]:
-        raise ValueError("The height of the source image and the destination image must be the same")
-    if src_images.shape[3] != dst_images.shape[3]:
-        raise ValueError("The width of the source image and the destination image must be the same")
+    src_images, dst_images, input_type = _check_images(src_images, dst_images)
 
     # Randomly generate flip probability
-    flip_prob = random.random()
-
-    if not isinstance(src_images, list):
-        src_images = [src_images]
-    if not isinstance(dst_images, list):
-        dst_images = [dst_images]
-
-    # detect input image type
-    input_type = "Tensor" if torch.is_tensor(src_images[0]) else "Numpy"
+    flip_prob = _random(generator)
 
     if flip_prob > p:
         if input_type == "Tensor":
             src_images = [F_vision.hflip(src_image) for src_image in src_images]
             dst_images = [F_vision.hflip(dst_image) for dst_image in dst_images]
         else:
-            src_images = [cv2.flip(src_image, 1) for src_image in src_images]
-            dst_images = [cv2.flip(dst_image, 1) for dst_image in dst_images]
+            src_images = [src_image[:, ::-1, ...] for src_image in src_images]
+            dst_images = [dst_image[:, ::-1, ...] for dst_image in dst_images]
 
-    # When the input has only one image
-    if len(src_images) == 1:
-        src_images = src_images[0]
-    if len(dst_images) == 1:
-        dst_images = dst_images[0]
-
-    return src_images, dst_images
+    return _unpack_images(src_images, dst_images)
 
 
 def random_vertically_flip_torch(
         src_images: Union[ndarray, torch.Tensor, List[ndarray], List[Tensor]],
-        dst_images: Union[ndarray, torch.Tensor, List[ndarray], List[Tensor]],
+        dst_images: Union[ndarray, torch.Tensor, List[ndarray], List[Tensor], None],
         # src_images: ndarray | Tensor | List[ndarray] | List[Tensor],
-        # dst_images: ndarray | Tensor | List[ndarray] | List[Tensor],
-        p: float = 0.5
+        # dst_images: ndarray | Tensor | List[ndarray] | List[Tensor] | None,
+        p: float = 0.5,
+        generator: Any = None,
 ) -> Union[ndarray, torch.Tensor, List[ndarray], List[Tensor]]:
 # [ndarray, ndarray] or [Tensor, Tensor] or [list[ndarray], list[ndarray]] or [list[Tensor], list[Tensor]]:
-    """Randomly flip the image left and right
+    """Randomly flip the image up and down
+
+    Numpy images (HWC) are flipped to views.
 
     Args:
         src_images (ndarray): ground truth images read by the PyTorch library
-        dst_images (ndarray): low resolution images read by the PyTorch library
+        dst_images (ndarray): low resolution images read by the PyTorch library, ``None`` processes ``src_images`` only
         p (optional, float): flip probability. Default: 0.5
+        generator (optional, np.random.Generator | torch.Generator): Random number generator, ``None`` means the
+            global ``random`` module. Default: None
 
     Returns:
         src_images (ndarray or Tensor or): flipped ground truth images
         dst_images (ndarray or Tensor or): flipped low-resolution images
     """
-
-    if src_images.shape[2] != dst_images.shape[2]:
-        raise ValueError("The height of the source image and the destination image must be the same")
-    if src_images.shape[3] != dst_images.shape[3]:
-        raise ValueError("The width of the source image and the destination image must be the same")
+    src_images, dst_images, input_type = _check_images(src_images, dst_images)
 
     # Randomly generate flip probability
-    flip_prob = random.random()
+    flip_prob = _random(generator)
+
+    if flip_prob > p:
+        if input_type == "Tensor":
+            src_images = [F_vision.vflip(src_image) for src_image in src_images]
+            dst_images = [F_vision.vflip(dst_image) for dst_image in dst_images]
+        else:
+            src_images = [src_image[::-1, ...] for src_image in src_images]
+            dst_images = [dst_image[::-1, ...] for dst_image in dst_images]
+
+    return _unpack_images(src_images, dst_images)
 
+
+def _randint(generator: Any, low: int, high: int) -> int:
+    # Inclusive bounds, like `random.randint`
+    if generator is None:
+        return random.randint(low, high)
+    if isinstance(generator, torch.Generator):
+        return int(torch.randint(low, high + 1, (1,), generator=generator, device=generator.device))
+    return int(generator.integers(low, high + 1))
+
+
+def _random(generator: Any) -> float:
+    if generator is None:
+        return random.random()
+    if isinstance(generator, torch.Generator):
+        return float(torch.rand(1, generator=generator, device=generator.device))
+    return float(generator.random())
+
+
+def _check_images(src_images: Any, dst_images: Any) -> Tuple[List[Any], List[Any], str]:
     if not isinstance(src_images, list):
         src_images = [src_images]
-    if not isinstance(dst_images, list):
+    if dst_images is not None and not isinstance(dst_images, list):
         dst_images = [dst_images]
 
     # detect input image type
     input_type = "Tensor" if torch.is_tensor(src_images[0]) else "Numpy"
 
-    if flip_prob > p:
-        if input_type == "Tensor":
-            src_images = [F_vision.vflip(src_image) for src_image in src_images]
-            dst_images = [F_vision.vflip(dst_image) for dst_image in dst_images]
-        else:
-            src_images = [cv2.flip(src_image, 0) for src_image in src_images]
-            dst_images = [cv2.flip(dst_image, 0) for dst_image in dst_images]
+    if dst_images is not None:
+        src_image_height, src_image_width = _image_size(src_images[0])
+        dst_image_height, dst_image_width = _image_size(dst_images[0])
+        if src_image_height != dst_image_height:
+            raise ValueError("The height of the source image and the destination image must be the same")
+        if src_image_width != dst_image_width:
+            raise ValueError("The width of the source image and the destination image must be the same")
+    else:
+        dst_images = []
+
+    return src_images, dst_images, input_type
+
+
+def _image_size(image: Union[ndarray, Tensor]) -> Tuple[int, int]:
+    # Tensors are (..., H, W), numpy images HWC
+    if torch.is_tensor(image):
+        return image.size()[-2:]
+    return image.shape[0:2]
 
+
+def _crop_image(image: Union[ndarray, Tensor], input_type: str, top: int, left: int, patch_size: int) -> Any:
+    if input_type == "Tensor":
+        return image[..., top: top + patch_size, left: left + patch_size]
+    return image[top: top + patch_size, left: left + patch_size, ...]
+
+
+def _unpack_images(src_images: List[Any], dst_images: List[Any]) -> Tuple[Any, Any]:
     # When the input has only one image
     if len(src_images) == 1:
         src_images = src_images[0]
     if len(dst_images) == 1:
         dst_images = dst_images[0]
+    elif len(dst_images) == 0:
+        dst_images = None
 
     return src_images, dst_images
+
+
+def random_crop_batch_torch(
+        src_images: Tensor,
+        dst_images: Union[Tensor, None],
+        patch_size: int,
+        paired: bool = True,
+        generator: torch.Generator = None,
+) -> Tuple[Tensor, Union[Tensor, None]]:
+    """Randomly crop every image of two batches at its own position, with a single gather per batch
+
+    Args:
+        src_images (Tensor): Source image batch (NCHW)
+        dst_images (Tensor | None): Destination image batch (NCHW), ``None`` processes ``src_images`` only
+        patch_size (int): The size of the intercepted image
+        paired (optional, bool): Crop ``src_images[i]`` and ``dst_images[i]`` at the same position, otherwise both
+            batches draw their own positions. Default: True
+        generator (optional, torch.Generator): Random number generator on the device of the images. Default: None
+
+    Returns:
+        src_images (Tensor): Cropped source image batch
+        dst_images (Tensor | None): Cropped destination image batch
+    """
+    _check_batches(src_images, dst_images)
+
+    src_offsets = _random_crop_offsets(src_images, patch_size, generator)
+    src_images = _crop_batch(src_images, src_offsets, patch_size)
+    if dst_images is not None:
+        dst_offsets = src_offsets if paired else _random_crop_offsets(dst_images, patch_size, generator)
+        dst_images = _crop_batch(dst_images, dst_offsets, patch_size)
+
+    return src_images, dst_images
+
+
+def random_rotate90_batch_torch(
+        src_images: Tensor,
+        dst_images: Union[Tensor, None],
+        paired: bool = True,
+        generator: torch.Generator = None,
+) -> Tuple[Tensor, Union[Tensor, None]]:
+    """Rotate every image of two batches by its own random multiple of 90 degrees, with one ``rot90`` per angle
+
+    Args:
+        src_images (Tensor): Source image batch (NCHW), the images must be square
+        dst_images (Tensor | None): Destination image batch (NCHW), ``None`` processes ``src_images`` only
+        paired (optional, bool): Rotate ``src_images[i]`` and ``dst_images[i]`` by the same angle, otherwise both
+            batches draw their own angles. Default: True
+        generator (optional, torch.Generator): Random number generator on the device of the images. Default: None
+
+    Returns:
+        src_images (Tensor): Rotated source image batch
+        dst_images (Tensor | None): Rotated destination image batch
+    """
+    _check_batches(src_images, dst_images)
+    if src_images.size(2) != src_images.size(3):
+        raise ValueError("The images must be square to be rotated by 90 or 270 degrees")
+
+    src_turns = torch.randint(0, 4, (src_images.size(0),), generator=generator, device=src_images.device)
+    src_images = _rotate90_batch(src_images, src_turns)
+    if dst_images is not None:
+        dst_turns = src_turns if paired else torch.randint(0, 4, (dst_images.size(0),), generator=generator,
+                                                           device=dst_images.device)
+        dst_images = _rotate90_batch(dst_images, dst_turns)
+
+    return src_images, dst_images
+
+
+def random_rotate_batch_torch(
+        src_images: Tensor,
+        dst_images: Union[Tensor, None],
+        angles: list,
+        paired: bool = True,
+        generator: torch.Generator = None,
+) -> Tuple[Tensor, Union[Tensor, None]]:
+    """Rotate every image of two batches by its own angle drawn from ``angles``, around the image center
+
+    Right angles on square images use ``rot90``, any other angle set runs as one ``affine_grid``/``grid_sample`` per
+    batch (nearest neighbour, zero fill, like ``torchvision.transforms.functional.rotate``).
+
+    Args:
+        src_images (Tensor): Source image batch (NCHW)
+        dst_images (Tensor | None): Destination image batch (NCHW), ``None`` processes ``src_images`` only
+        angles (list): List of random rotation angles (degrees, counter-clockwise)
+        paired (optional, bool): Rotate ``src_images[i]`` and ``dst_images[i]`` by the same angle, otherwise both
+            batches draw their own angles. Default: True
+        generator (optional, torch.Generator): Random number generator on the device of the images. Default: None
+
+    Returns:
+        src_images (Tensor): Rotated source image batch
+        dst_images (Tensor | None): Rotated destination image batch
+    """
+    _check_batches(src_images, dst_images)
+
+    angles = torch.tensor(angles, dtype=torch.float, device=src_images.device)
+    right_angles = bool((angles % 90 == 0).all()) and src_images.size(2) == src_images.size(3)
+
+    src_angles = angles[torch.randint(0, len(angles), (src_images.size(0),), generator=generator,
+                                      device=src_images.device)]
+    src_images = _rotate90_batch(src_images, _angle_turns(src_angles)) if right_angles else _rotate_batch(src_images,
+                                                                                                         src_angles)
+    if dst_images is not None:
+        if paired:
+            dst_angles = src_angles
+        else:
+            dst_angles = angles[torch.randint(0, len(angles), (dst_images.size(0),), generator=generator,
+                                              device=dst_images.device)]
+        dst_images = _rotate90_batch(dst_images, _angle_turns(dst_angles)) if right_angles else _rotate_batch(
+            dst_images, dst_angles)
+
+    return src_images, dst_images
+
+
+def random_vertically_flip_batch_torch(
+        src_images: Tensor,
+        dst_images: Union[Tensor, None],
+        p: float = 0.5,
+        paired: bool = True,
+        generator: torch.Generator = None,
+) -> Tuple[Tensor, Union[Tensor, None]]:
+    """Randomly flip every image of two batches up and down, each with probability ``p``
+
+    Args:
+        src_images (Tensor): Source image batch (NCHW)
+        dst_images (Tensor | None): Destination image batch (NCHW), ``None`` processes ``src_images`` only
+        p (optional, float): flip probability. Default: 0.5
+        paired (optional, bool): Flip ``src_images[i]`` and ``dst_images[i]`` together, otherwise both batches draw
+            their own flips. Default: True
+        generator (optional, torch.Generator): Random number generator on the device of the images. Default: None
+
+    Returns:
+        src_images (Tensor): flipped source image batch
+        dst_images (Tensor | None): flipped destination image batch
+    """
+    return _random_flip_batch(src_images, dst_images, 2, p, paired, generator)
+
+
+def random_horizontally_flip_batch_torch(
+        src_images: Tensor,
+        dst_images: Union[Tensor, None],
+        p: float = 0.5,
+        paired: bool = True,
+        generator: torch.Generator = None,
+) -> Tuple[Tensor, Union[Tensor, None]]:
+    """Randomly flip every image of two batches left and right, each with probability ``p``
+
+    Args:
+        src_images (Tensor): Source image batch (NCHW)
+        dst_images (Tensor | None): Destination image batch (NCHW), ``None`` processes ``src_images`` only
+        p (optional, float): flip probability. Default: 0.5
+        paired (optional, bool): Flip ``src_images[i]`` and ``dst_images[i]`` together, otherwise both batches draw
+            their own flips. Default: True
+        generator (optional, torch.Generator): Random number generator on the device of the images. Default: None
+
+    Returns:
+        src_images (Tensor): flipped source image batch
+        dst_images (Tensor | None): flipped destination image batch
+    """
+    return _random_flip_batch(src_images, dst_images, 3, p, paired, generator)
+
+
+class AugmentationPlan(object):
+    """Per-sample random crop, right-angle rotation and flips of a batch, drawn up front and applied in one gather
+
+    The fused result is bit-identical to cropping, rotating (``rot90``), flipping up and down and then left and right
+    one step after the other with the same parameters, see ``apply(images, fused=False)``.
+
+    Args:
+        top (Tensor): Crop top offset of every sample
+        left (Tensor): Crop left offset of every sample
+        turns (Tensor): Counter-clockwise quarter turns of every sample, ``0`` to ``3``
+        vflip (Tensor): Flip up and down, bool of every sample
+        hflip (Tensor): Flip left and right, bool of every sample
+        patch_size (int): The size of the crop
+    """
+
+    def __init__(self, top: Tensor, left: Tensor, turns: Tensor, vflip: Tensor, hflip: Tensor, patch_size: int) -> None:
+        self.top = top
+        self.left = left
+        self.turns = turns
+        self.vflip = vflip
+        self.hflip = hflip
+        self.patch_size = patch_size
+
+    @classmethod
+    def sample(
+            cls,
+            images: Tensor,
+            patch_size: int = None,
+            rotate: bool = True,
+            p: float = 0.5,
+            generator: torch.Generator = None,
+    ) -> "AugmentationPlan":
+        """Draw the parameters of every sample of a NCHW batch
+
+        Args:
+            images (Tensor): Image batch (NCHW), only its shape and device are used
+            patch_size (optional, int): The size of the crop, ``None`` keeps the (square) images whole. Default: None
+            rotate (optional, bool): Draw a random multiple of 90 degrees. Default: True
+            p (optional, float): flip probability of both flips. Default: 0.5
+            generator (optional, torch.Generator): Random number generator on the device of the images. Default: None
+
+        Returns:
+            plan (AugmentationPlan): Parameters of the batch
+        """
+        _check_batches(images, None)
+        batch_size, device = images.size(0), images.device
+        if patch_size is None:
+            patch_size = images.size(2)
+        if rotate and images.size(2) != images.size(3) and patch_size == images.size(2):
+            raise ValueError("The images must be square (or cropped square) to be rotated by 90 or 270 degrees")
+
+        top, left = _random_crop_offsets(images, patch_size, generator)
+        if rotate:
+            turns = torch.randint(0, 4, (batch_size,), generator=generator, device=device)
+        else:
+            turns = torch.zeros(batch_size, dtype=torch.long, device=device)
+        vflip = torch.rand(batch_size, generator=generator, device=device) < p
+        hflip = torch.rand(batch_size, generator=generator, device=device) < p
+
+        return cls(top, left, turns, vflip, hflip, patch_size)
+
+    def apply(self, images: Tensor, fused: bool = True) -> Tensor:
+        """Augment a NCHW batch with the parameters of the plan
+
+        Args:
+            images (Tensor): Image batch (NCHW) the plan was sampled for
+            fused (optional, bool): Single gather, otherwise crop, ``rot90``, vflip and hflip one after the other (the
+                reference of the fused path). Default: True
+
+        Returns:
+            images (Tensor): Augmented image batch
+        """
+        if not fused:
+            images = _crop_batch(images, (self.top, self.left), self.patch_size)
+            images = _rotate90_batch(images, self.turns)
+            images = _flip_batch(images, self.vflip, 2)
+            return _flip_batch(images, self.hflip, 3)
+
+        # Walk back from every output pixel to its source pixel: hflip, vflip, rotation, then the crop offset
+        last = self.patch_size - 1
+        patch_range = torch.arange(self.patch_size, device=images.device)
+        i = patch_range[None, :, None].expand(images.size(0), -1, self.patch_size)
+        j = patch_range[None, None, :].expand(images.size(0), self.patch_size, -1)
+        j = torch.where(self.hflip[:, None, None], last - j, j)
+        i = torch.where(self.vflip[:, None, None], last - i, i)
+
+        # `torch.rot90(x, k)[i, j]` is x[i, j], x[j, last - i], x[last - i, last - j] or x[last - j, i]
+        turns = self.turns[:, None, None]
+        rows = torch.where(turns == 0, i, torch.where(turns == 1, j, torch.where(turns == 2, last - i, last - j)))
+        cols = torch.where(turns == 0, j, torch.where(turns == 1, last - i, torch.where(turns == 2, last - j, i)))
+        rows = rows + self.top[:, None, None]
+        cols = cols + self.left[:, None, None]
+
+        batch_index = torch.arange(images.size(0), device=images.device)[:, None, None]
+        return images[batch_index, :, rows, cols].permute(0, 3, 1, 2)
+
+
+def fused_augment_batch_torch(
+        src_images: Tensor,
+        dst_images: Union[Tensor, None],
+        patch_size: int = None,
+        paired: bool = True,
+        generator: torch.Generator = None,
+) -> Tuple[Tensor, Union[Tensor, None]]:
+    """Randomly crop, rotate by right angles and flip every image of two batches, one gather per batch
+
+    Args:
+        src_images (Tensor): Source image batch (NCHW)
+        dst_images (Tensor | None): Destination image batch (NCHW), ``None`` processes ``src_images`` only
+        patch_size (optional, int): The size of the crop, ``None`` keeps the (square) images whole. Default: None
+        paired (optional, bool): Augment ``src_images[i]`` and ``dst_images[i]`` the same way, otherwise both batches
+            draw their own parameters. Default: True
+        generator (optional, torch.Generator): Random number generator on the device of the images. Default: None
+
+    Returns:
+        src_images (Tensor): Augmented source image batch
+        dst_images (Tensor | None): Augmented destination image batch
+    """
+    _check_batches(src_images, dst_images)
+
+    src_plan = AugmentationPlan.sample(src_images, patch_size, generator=generator)
+    src_images = src_plan.apply(src_images)
+    if dst_images is not None:
+        dst_plan = src_plan if paired else AugmentationPlan.sample(dst_images, patch_size, generator=generator)
+        dst_images = dst_plan.apply(dst_images)
+
+    return src_images, dst_images
+
+
+def _check_batches(src_images: Tensor, dst_images: Union[Tensor, None]) -> None:
+    if src_images.dim() != 4:
+        raise ValueError("The images must be a NCHW batch")
+    if dst_images is not None and src_images.size(0) != dst_images.size(0):
+        raise ValueError("The source batch and the destination batch must have the same number of images")
+
+
+def _random_crop_offsets(images: Tensor, patch_size: int, generator: torch.Generator = None) -> Tuple[Tensor, Tensor]:
+    image_height, image_width = images.size()[-2:]
+    top = torch.randint(0, image_height - patch_size + 1, (images.size(0),), generator=generator, device=images.device)
+    left = torch.randint(0, image_width - patch_size + 1, (images.size(0),), generator=generator, device=images.device)
+
+    return top, left
+
+
+def _crop_batch(images: Tensor, offsets: Tuple[Tensor, Tensor], patch_size: int) -> Tensor:
+    top, left = offsets
+    patch_range = torch.arange(patch_size, device=images.device)
+    rows = (top[:, None] + patch_range)[:, :, None]
+    cols = (left[:, None] + patch_range)[:, None, :]
+    batch_index = torch.arange(images.size(0), device=images.device)[:, None, None]
+
+    # Advanced indexing around the channel slice gathers a N x H x W x C patch batch
+    return images[batch_index, :, rows, cols].permute(0, 3, 1, 2)
+
+
+def _angle_turns(angles: Tensor) -> Tensor:
+    return torch.remainder(angles // 90, 4).long()
+
+
+def _rotate_batch(images: Tensor, angles: Tensor, center: Any = None) -> Tensor:
+    # Per-image counter-clockwise rotation (degrees) in one resampling pass, same conventions as `F_vision.rotate`
+    image_height, image_width = images.size()[-2:]
+    radians = torch.deg2rad(angles.float())
+    cos, sin = torch.cos(radians), torch.sin(radians)
+
+    # Output to input sampling matrix, in the normalized coordinates of `affine_grid` (x: width, y: height)
+    theta = torch.zeros(images.size(0), 2, 3, device=images.device)
+    theta[:, 0, 0] = cos
+    theta[:, 0, 1] = -sin * image_height / image_width
+    theta[:, 1, 0] = sin * image_width / image_height
+    theta[:, 1, 1] = cos
+    if center is not None:
+        # Pixel coordinates from the upper left corner, as in `F_vision.rotate`
+        center_x = 2 * center[0] / image_width - 1
+        center_y = 2 * center[1] / image_height - 1
+        theta[:, 0, 2] = center_x - theta[:, 0, 0] * center_x - theta[:, 0, 1] * center_y
+        theta[:, 1, 2] = center_y - theta[:, 1, 0] * center_x - theta[:, 1, 1] * center_y
+
+    grid = torch.nn.functional.affine_grid(theta, list(images.size()), align_corners=False)
+    rotated_images = torch.nn.functional.grid_sample(images.float(), grid, mode="nearest", padding_mode="zeros",
+                                                     align_corners=False)
+
+    return rotated_images.to(images.dtype)
+
+
+def _rotate90_batch(images: Tensor, turns: Tensor) -> Tensor:
+    rotated_images = images.clone()
+    for k in range(1, 4):
+        mask = turns == k
+        rotated_images[mask] = torch.rot90(images[mask], k, dims=(2, 3))
+
+    return rotated_images
+
+
+def _random_flip_batch(
+        src_images: Tensor,
+        dst_images: Union[Tensor, None],
+        dim: int,
+        p: float,
+        paired: bool,
+        generator: torch.Generator = None,
+) -> Tuple[Tensor, Union[Tensor, None]]:
+    _check_batches(src_images, dst_images)
+
+    src_mask = torch.rand(src_images.size(0), generator=generator, device=src_images.device) < p
+    src_images = _flip_batch(src_images, src_mask, dim)
+    if dst_images is not None:
+        dst_mask = src_mask if paired else torch.rand(dst_images.size(0), generator=generator,
+                                                      device=dst_images.device) < p
+        dst_images = _flip_batch(dst_images, dst_mask, dim)
+
+    return src_images, dst_images
+
+
+def _flip_batch(images: Tensor, mask: Tensor, dim: int) -> Tensor:
+    return torch.where(mask[:, None, None, None], images.flip(dim), images)
@@ -18,7 +18,7 @@ from torchvision.utils import save_image
 
 import model
 from imgproc import preprocess_one_image
-from utils import load_pretrained_state_dict
+from utils import load_pretrained_state_dict, compile_model
 
 
 def main(args):
@@ -32,6 +32,11 @@ def main(args):
     # Load model weights
     g_model = load_pretrained_state_dict(g_model, False, args.model_weights_path)
     g_model.eval()
+    # Fold the running-stat norms into the convolutions, before compiling
+    if not args.no_fuse:
+        g_model = model.fuse_instance_norm(g_model)
+    if args.compile:
+        g_model = compile_model(g_model, args.compile_mode)
 
     with torch.no_grad():
         gen_image = g_model(image)
@@ -50,6 +55,13 @@ if __name__ == "__main__":
     parser.add_argument("--model_weights_path", type=str,
                         default="./results/pretrained_models/CycleGAN-apple2orange.pth.tar",
                         help="Generator model weights path.  Default: ``./results/pretrained_models/CycleGAN-apple2orange.pth.tar``")
+    parser.add_argument("--no_fuse", action="store_true", default=False,
+                        help="Keep the InstanceNorm layers instead of folding them into the convolutions. Default: ``False``")
+    parser.add_argument("--compile", action="store_true", default=False,
+                        help="Compile the generator with `torch.compile`. Default: ``False``")
+    parser.add_argument("--compile_mode", type=str, default="default",
+                        choices=["default", "reduce-overhead", "max-autotune"],
+                        help="`torch.compile` mode. Default: ``default``")
     parser.add_argument("--half", action="store_true", default=False,
                         help="Use half precision. Default: ``False``")
     parser.add_argument("--device", type=str, default="cpu", choices=["cpu", 'cuda:0'],
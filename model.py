@@ -11,6 +11,8 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 # ==============================================================================
+import copy
+
 import torch
 from torch import nn, Tensor
 from torch.nn import functional as F_torch
@@ -18,7 +20,8 @@ from torchvision.transforms import functional as F_vision
 
 __all__ = [
     "PathDiscriminator", "CycleNet",
-    "path_discriminator", "cyclenet",
+    "path_discriminator", "cyclenet", "cyclenet_6blocks", "cyclenet_half", "cyclenet_quarter", "cyclenet_6blocks_half",
+    "fuse_instance_norm",
 ]
 
 
@@ -35,15 +38,15 @@ class PathDiscriminator(nn.Module):
             nn.LeakyReLU(0.2, True),
 
             nn.Conv2d(channels, int(channels * 2), (4, 4), (2, 2), (1, 1)),
-            nn.InstanceNorm2d(int(channels * 2)),
+            _InstanceNorm2d(int(channels * 2)),
             nn.LeakyReLU(0.2, True),
 
             nn.Conv2d(int(channels * 2), int(channels * 4), (4, 4), (2, 2), (1, 1)),
-            nn.InstanceNorm2d(int(channels * 4)),
+            _InstanceNorm2d(int(channels * 4)),
             nn.LeakyReLU(0.2, True),
 
             nn.Conv2d(int(channels * 4), int(channels * 8), (4, 4), (1, 1), (1, 1)),
-            nn.InstanceNorm2d(int(channels * 8)),
+            _InstanceNorm2d(int(channels * 8)),
             nn.LeakyReLU(0.2, True),
 
             nn.Conv2d(int(channels * 8), out_channels, (4, 4), (1, 1), (1, 1)),
@@ -61,47 +64,49 @@ class CycleNet(nn.Module):
             in_channels: int,
             out_channels: int,
             channels: int,
+            num_residual_blocks: int = 9,
+            num_downsampling: int = 2,
+            channel_multiplier: float = 1.0,
     ) -> None:
         super(CycleNet, self).__init__()
-        self.main = nn.Sequential(
-            # Initial convolution block
-            nn.ReflectionPad2d(3),
-            nn.Conv2d(in_channels, channels, (7, 7), (1, 1), (0, 0)),
-            nn.InstanceNorm2d(channels, track_running_stats=True),
-            nn.ReLU(True),
+        channels = max(1, int(channels * channel_multiplier))
 
-            # Downsampling
-            nn.Conv2d(channels, int(channels * 2), (3, 3), (2, 2), (1, 1)),
-            nn.InstanceNorm2d(int(channels * 2), track_running_stats=True),
-            nn.ReLU(True),
-            nn.Conv2d(int(channels * 2), int(channels * 4), (3, 3), (2, 2), (1, 1)),
-            nn.InstanceNorm2d(int(channels * 4), track_running_stats=True),
-            nn.ReLU(True),
-
-            # Residual blocks
-            _ResidualBlock(int(channels * 4)),
-            _ResidualBlock(int(channels * 4)),
-            _ResidualBlock(int(channels * 4)),
-            _ResidualBlock(int(channels * 4)),
-            _ResidualBlock(int(channels * 4)),
-            _ResidualBlock(int(channels * 4)),
-            _ResidualBlock(int(channels * 4)),
-            _ResidualBlock(int(channels * 4)),
-            _ResidualBlock(int(channels * 4)),
-
-            # Upsampling
-            nn.ConvTranspose2d(int(channels * 4), int(channels * 2), (3, 3), (2, 2), (1, 1), (1, 1)),
-            nn.InstanceNorm2d(int(channels * 2), track_running_stats=True),
-            nn.ReLU(True),
-            nn.ConvTranspose2d(int(channels * 2), channels, (3, 3), (2, 2), (1, 1), (1, 1)),
-            nn.InstanceNorm2d(channels, track_running_stats=True),
+        # Initial convolution block
+        layers = [
+            _ReflectionPad2d(3),
+            nn.Conv2d(in_channels, channels, (7, 7), (1, 1), (0, 0)),
+            _InstanceNorm2d(channels, track_running_stats=True),
             nn.ReLU(True),
-
-            # Output layer
-            nn.ReflectionPad2d(3),
+        ]
+
+        # Downsampling
+        for i in range(num_downsampling):
+            layers += [
+                nn.Conv2d(int(channels * 2 ** i), int(channels * 2 ** (i + 1)), (3, 3), (2, 2), (1, 1)),
+                _InstanceNorm2d(int(channels * 2 ** (i + 1)), track_running_stats=True),
+                nn.ReLU(True),
+            ]
+
+        # Residual blocks
+        layers += [_ResidualBlock(int(channels * 2 ** num_downsampling)) for _ in range(num_residual_blocks)]
+
+        # Upsampling
+        for i in reversed(range(num_downsampling)):
+            layers += [
+                nn.ConvTranspose2d(int(channels * 2 ** (i + 1)), int(channels * 2 ** i),
+                                   (3, 3), (2, 2), (1, 1), (1, 1)),
+                _InstanceNorm2d(int(channels * 2 ** i), track_running_stats=True),
+                nn.ReLU(True),
+            ]
+
+        # Output layer
+        layers += [
+            _ReflectionPad2d(3),
             nn.Conv2d(channels, out_channels, (7, 7), (1, 1), (0, 0)),
             nn.Tanh(),
-        )
+        ]
+
+        self.main = nn.Sequential(*layers)
 
     def forward(self, x: Tensor) -> Tensor:
         x = self.main(x)
@@ -114,13 +119,13 @@ class _ResidualBlock(nn.Module):
         super(_ResidualBlock, self).__init__()
 
         self.res = nn.Sequential(
-            nn.ReflectionPad2d(1),
+            _ReflectionPad2d(1),
             nn.Conv2d(channels, channels, (3, 3), (1, 1), (0, 0)),
-            nn.InstanceNorm2d(channels, track_running_stats=True),
+            _InstanceNorm2d(channels, track_running_stats=True),
             nn.ReLU(True),
-            nn.ReflectionPad2d(1),
+            _ReflectionPad2d(1),
             nn.Conv2d(channels, channels, (3, 3), (1, 1), (0, 0)),
-            nn.InstanceNorm2d(channels, track_running_stats=True),
+            _InstanceNorm2d(channels, track_running_stats=True),
         )
 
     def forward(self, x: Tensor) -> Tensor:
@@ -133,6 +138,131 @@ class _ResidualBlock(nn.Module):
         return x
 
 
+class _InstanceNorm2d(nn.InstanceNorm2d):
+    """`nn.InstanceNorm2d` that keeps the channels_last memory format of its input
+
+    `F.instance_norm` normalizes a contiguous [1, N * C, H, W] view of the input, which copies channels_last inputs
+    into the contiguous format. The statistics are taken over the spatial dims here instead, and the elementwise
+    normalization keeps the memory format of the input.
+    """
+
+    def forward(self, x: Tensor) -> Tensor:
+        if x.is_contiguous() or not x.is_contiguous(memory_format=torch.channels_last):
+            return super(_InstanceNorm2d, self).forward(x)
+
+        # Statistics and normalization in float32, like `F.instance_norm` under autocast
+        dtype = x.dtype
+        x = x.float()
+        if self.training or not self.track_running_stats:
+            var, mean = torch.var_mean(x, dim=(2, 3), unbiased=False, keepdim=True)
+            if self.training and self.track_running_stats:
+                self._update_running_stats(mean, var, x.size(2) * x.size(3))
+        else:
+            mean = self.running_mean.view(1, -1, 1, 1)
+            var = self.running_var.view(1, -1, 1, 1)
+
+        x = (x - mean) * torch.rsqrt(var + self.eps)
+        if self.affine:
+            x = x * self.weight.view(1, -1, 1, 1) + self.bias.view(1, -1, 1, 1)
+
+        # Back to the input dtype, autocast keeps the float32 result like it does for `F.instance_norm`
+        autocast = torch.is_autocast_cpu_enabled() if x.device.type == "cpu" else torch.is_autocast_enabled()
+        if not autocast:
+            x = x.to(dtype)
+
+        return x
+
+    @torch.no_grad()
+    def _update_running_stats(self, mean: Tensor, var: Tensor, num_elements: int) -> None:
+        # Same update as `F.instance_norm`: per-instance statistics averaged over the batch, unbiased running variance
+        momentum = self.momentum if self.momentum is not None else 0.0
+        unbiased_var = var * (num_elements / max(num_elements - 1, 1))
+        self.running_mean.mul_(1 - momentum).add_(mean.mean(0).flatten(), alpha=momentum)
+        self.running_var.mul_(1 - momentum).add_(unbiased_var.mean(0).flatten(), alpha=momentum)
+
+
+class _ReflectionPad2d(nn.ReflectionPad2d):
+    """`nn.ReflectionPad2d` that keeps the channels_last memory format of its input, forward and backward
+
+    The input is split into its first and last row, the rows reflected into the borders and the rest, and concatenated
+    again together with the flipped borders. `torch.cat` and `torch.flip` return channels_last tensors for
+    channels_last inputs, and the backward of the split is a concatenation of the gradients of all parts. Plain slices
+    of the input would scatter their gradients into new contiguous tensors of zeros instead.
+    """
+
+    def forward(self, x: Tensor) -> Tensor:
+        left, right, top, bottom = self.padding
+        if (x.is_contiguous() or not x.is_contiguous(memory_format=torch.channels_last) or min(self.padding) < 1
+                or x.size(3) <= left + right + 2 or x.size(2) <= top + bottom + 2):
+            return super(_ReflectionPad2d, self).forward(x)
+
+        x = _reflect(x, left, right, 3)
+        x = _reflect(x, top, bottom, 2)
+
+        return x
+
+
+def _reflect(x: Tensor, before: int, after: int, dim: int) -> Tensor:
+    # Every part of the split is used, unused parts would get contiguous zero gradients in the backward
+    first, head, middle, tail, last = x.split([1, before, x.size(dim) - before - after - 2, after, 1], dim)
+
+    return torch.cat([head.flip(dim), first, head, middle, tail, last, tail.flip(dim)], dim)
+
+
+def fuse_instance_norm(model: nn.Module) -> nn.Module:
+    """Fold the running-stat InstanceNorm2d layers of a model into the convolutions in front of them, for inference
+
+    In eval mode an `InstanceNorm2d` with ``track_running_stats=True`` is a fixed per-channel affine transform, it is
+    merged into the weight and bias of the preceding `Conv2d` or `ConvTranspose2d` and replaced by `nn.Identity`.
+    Reflection pads and activations are kept, `torch.compile` fuses the ReLU into the convolution epilogue. Norms
+    without running statistics (`PathDiscriminator`) depend on the input and are kept as well.
+
+    Args:
+        model (nn.Module): model with loaded weights, e.g. `CycleNet`, compiled or not
+
+    Returns:
+        fused_model (nn.Module): eval copy of the model, it can not be trained
+    """
+    fused_model = copy.deepcopy(getattr(model, "_orig_mod", model)).eval()
+    for module in fused_model.modules():
+        if not isinstance(module, nn.Sequential):
+            continue
+        for index in range(1, len(module)):
+            if _is_foldable(module[index - 1], module[index]):
+                _fold_instance_norm(module[index - 1], module[index])
+                module[index] = nn.Identity()
+
+    return fused_model
+
+
+def _is_foldable(conv: nn.Module, norm: nn.Module) -> bool:
+    if not isinstance(norm, nn.InstanceNorm2d) or not norm.track_running_stats:
+        return False
+    # Transposed convolutions store the output channels of every group in the second weight dim
+    if isinstance(conv, nn.ConvTranspose2d):
+        return conv.groups == 1
+
+    return isinstance(conv, nn.Conv2d)
+
+
+@torch.no_grad()
+def _fold_instance_norm(conv: nn.Module, norm: nn.InstanceNorm2d) -> None:
+    # norm(conv(x)) = conv(x) * scale + shift for every output channel
+    scale = torch.rsqrt(norm.running_var + norm.eps)
+    shift = -norm.running_mean * scale
+    if norm.affine:
+        scale = scale * norm.weight
+        shift = shift * norm.weight + norm.bias
+
+    if conv.bias is None:
+        conv.bias = nn.Parameter(torch.zeros_like(shift))
+    if isinstance(conv, nn.ConvTranspose2d):
+        conv.weight.mul_(scale.view(1, -1, 1, 1))
+    else:
+        conv.weight.mul_(scale.view(-1, 1, 1, 1))
+    conv.bias.mul_(scale).add_(shift)
+
+
 def _weights_init(m):
     classname = m.__class__.__name__
     if classname.find("Conv") != -1:
@@ -154,3 +284,28 @@ def cyclenet(**kwargs) -> CycleNet:
     model.apply(_weights_init)
 
     return model
+
+
+def cyclenet_6blocks(**kwargs) -> CycleNet:
+    # Six residual blocks, the generator of the original CycleGAN for 128x128 images
+    model = cyclenet(num_residual_blocks=6, **kwargs)
+
+    return model
+
+
+def cyclenet_half(**kwargs) -> CycleNet:
+    model = cyclenet(channel_multiplier=0.5, **kwargs)
+
+    return model
+
+
+def cyclenet_quarter(**kwargs) -> CycleNet:
+    model = cyclenet(channel_multiplier=0.25, **kwargs)
+
+    return model
+
+
+def cyclenet_6blocks_half(**kwargs) -> CycleNet:
+    model = cyclenet(num_residual_blocks=6, channel_multiplier=0.5, **kwargs)
+
+    return model
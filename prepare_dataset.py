@@ -0,0 +1,128 @@
+# Copyright 2023 Dakewe Biotech Corporation. All Rights Reserved.
+# Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+import argparse
+
+import yaml
+
+from dataset import ImageManifest, build_image_cache, match_image_pairs, write_image_shards
+
+
+def build_manifest(args):
+    with open(args.config_path, "r") as f:
+        config = yaml.full_load(f)
+
+    meta_dir = args.meta_dir or config["TRAIN"]["DATASET"]["META_DIR"]
+    if not meta_dir:
+        raise ValueError("`TRAIN.DATASET.META_DIR` is empty, please set it or pass `--meta_dir`.")
+
+    for images_dir in [config["TRAIN"]["DATASET"]["SRC_IMAGE_PATH"], config["TRAIN"]["DATASET"]["DST_IMAGE_PATH"]]:
+        manifest = ImageManifest(images_dir, meta_dir)
+        print(f"`{images_dir}`: {len(manifest)} images in `{manifest.manifest_path}`")
+
+
+def validate_dataset(args):
+    with open(args.config_path, "r") as f:
+        config = yaml.full_load(f)
+
+    for images_dir in [config["TRAIN"]["DATASET"]["SRC_IMAGE_PATH"], config["TRAIN"]["DATASET"]["DST_IMAGE_PATH"]]:
+        manifest = ImageManifest(images_dir, config["TRAIN"]["DATASET"]["META_DIR"])
+        bad_file_names = manifest.validate(args.mode, args.num_workers)
+        for bad_file_name in bad_file_names:
+            print(f"  {bad_file_name}: {manifest.entries[bad_file_name]['bad']}")
+
+
+def build_cache(args):
+    with open(args.config_path, "r") as f:
+        config = yaml.full_load(f)
+
+    cache_dir = args.cache_dir or config["TRAIN"]["DATASET"]["CACHE_DIR"]
+    if not cache_dir:
+        raise ValueError("`TRAIN.DATASET.CACHE_DIR` is empty, please set it or pass `--cache_dir`.")
+
+    for images_dir in [config["TRAIN"]["DATASET"]["SRC_IMAGE_PATH"], config["TRAIN"]["DATASET"]["DST_IMAGE_PATH"]]:
+        cache_path, image_file_names = build_image_cache(images_dir,
+                                                         cache_dir,
+                                                         config["TRAIN"]["DATASET"]["LOAD_SIZE"],
+                                                         args.rebuild)
+        print(f"`{images_dir}`: {len(image_file_names)} images cached in `{cache_path}`")
+
+
+def build_shards(args):
+    with open(args.config_path, "r") as f:
+        config = yaml.full_load(f)
+
+    shards_dir = args.shards_dir or config["TRAIN"]["DATASET"]["SHARDS"]["DIR"]
+    src_images_dir = config["TRAIN"]["DATASET"]["SRC_IMAGE_PATH"]
+    dst_images_dir = config["TRAIN"]["DATASET"]["DST_IMAGE_PATH"]
+    src_image_file_names = ImageManifest(src_images_dir, config["TRAIN"]["DATASET"]["META_DIR"]).file_names
+    dst_image_file_names = ImageManifest(dst_images_dir, config["TRAIN"]["DATASET"]["META_DIR"]).file_names
+    if not config["TRAIN"]["DATASET"]["UNPAIRED"]:
+        # Paired shards hold the pairs at the same positions
+        pair_indices = match_image_pairs(src_image_file_names, dst_image_file_names)
+        src_image_file_names = [src_image_file_names[src_index] for src_index, _ in pair_indices]
+        dst_image_file_names = [dst_image_file_names[dst_index] for _, dst_index in pair_indices]
+
+    for images_dir, domain, image_file_names in [(src_images_dir, "src", src_image_file_names),
+                                                 (dst_images_dir, "dst", dst_image_file_names)]:
+        shard_paths = write_image_shards(images_dir,
+                                         shards_dir,
+                                         domain,
+                                         args.shard_size,
+                                         args.archive_format,
+                                         image_file_names)
+        print(f"`{images_dir}`: {len(image_file_names)} images packed into {len(shard_paths)} shards in `{shards_dir}`")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    manifest_parser = subparsers.add_parser("manifest", help="Build or update the manifests of the train dataset.")
+    manifest_parser.add_argument("--config_path", type=str, default="./configs/CYCLEGAN.yaml",
+                                 help="Path to train config file. Default: ``./configs/CYCLEGAN.yaml``")
+    manifest_parser.add_argument("--meta_dir", type=str, default=None,
+                                 help="Manifest dir, overrides `TRAIN.DATASET.META_DIR`. Default: ``None``")
+    manifest_parser.set_defaults(func=build_manifest)
+
+    validate_parser = subparsers.add_parser("validate", help="Check that all images of the train dataset are readable.")
+    validate_parser.add_argument("--config_path", type=str, default="./configs/CYCLEGAN.yaml",
+                                 help="Path to train config file. Default: ``./configs/CYCLEGAN.yaml``")
+    validate_parser.add_argument("--mode", type=str, default="full", choices=["header", "full"],
+                                 help="Parse the image headers or decode the whole images. Default: ``full``")
+    validate_parser.add_argument("--num_workers", type=int, default=0,
+                                 help="Processes of the check, 0 means one per CPU. Default: ``0``")
+    validate_parser.set_defaults(func=validate_dataset)
+
+    cache_parser = subparsers.add_parser("cache", help="Build the uint8 memory-mapped image cache of the train dataset.")
+    cache_parser.add_argument("--config_path", type=str, default="./configs/CYCLEGAN.yaml",
+                              help="Path to train config file. Default: ``./configs/CYCLEGAN.yaml``")
+    cache_parser.add_argument("--cache_dir", type=str, default=None,
+                              help="Cache dir, overrides `TRAIN.DATASET.CACHE_DIR`. Default: ``None``")
+    cache_parser.add_argument("--rebuild", action="store_true", default=False,
+                              help="Rebuild the cache even if it is up to date. Default: ``False``")
+    cache_parser.set_defaults(func=build_cache)
+
+    shards_parser = subparsers.add_parser("shards", help="Pack the train dataset into tar or zip shards.")
+    shards_parser.add_argument("--config_path", type=str, default="./configs/CYCLEGAN.yaml",
+                               help="Path to train config file. Default: ``./configs/CYCLEGAN.yaml``")
+    shards_parser.add_argument("--shards_dir", type=str, default=None,
+                               help="Shards dir, overrides `TRAIN.DATASET.SHARDS.DIR`. Default: ``None``")
+    shards_parser.add_argument("--shard_size", type=int, default=1000,
+                               help="Images per shard. Default: ``1000``")
+    shards_parser.add_argument("--archive_format", type=str, default="tar", choices=["tar", "zip"],
+                               help="Archive format of the shards. Default: ``tar``")
+    shards_parser.set_defaults(func=build_shards)
+
+    args = parser.parse_args()
+    args.func(args)
@@ -21,7 +21,7 @@ from torchvision.utils import save_image
 
 import model
 from imgproc import preprocess_one_image
-from utils import make_directory, load_pretrained_state_dict
+from utils import make_directory, load_state_dict, load_pretrained_state_dict, compile_model
 
 
 def main(args):
@@ -30,8 +30,10 @@ def main(args):
     make_directory(benchmark_dir)
 
     device = torch.device(args.device)
-    g_model = model.__dict__[args.model_arch_name]()
+    g_model = model.__dict__[args.model_arch_name](in_channels=3, out_channels=3, channels=64)
     g_model = g_model.to(device)
+    # Model running the benchmark: fused and compiled, built at the first checkpoint
+    run_model = None
 
     # Load image
     image = preprocess_one_image(args.image_path, True, False, device)
@@ -40,11 +42,25 @@ def main(args):
     model_weights_list = natsorted(glob(f"{args.model_weights_dir}/{args.model_type}*"))
     for model_weights in model_weights_list:
         print(f"Process `{model_weights}`...")
-        g_model = load_pretrained_state_dict(g_model, model_weights)
+        g_model = load_pretrained_state_dict(g_model, False, model_weights)
         g_model.eval()
 
+        # Every checkpoint is folded into the same model, a compiled model is only compiled once
+        deploy_model = g_model if args.no_fuse else model.fuse_instance_norm(g_model)
+        if run_model is None:
+            run_model = compile_model(deploy_model, args.compile_mode) if args.compile else deploy_model
+        elif deploy_model is not g_model:
+            run_model = load_state_dict(run_model, args.compile, deploy_model.state_dict())
+
         with torch.no_grad():
-            gen_image = g_model(image)
+            gen_image = run_model(image)
+            # Numerical parity of the fused model with the unfused eval model
+            if not args.no_fuse:
+                max_error = torch.max(torch.abs(gen_image - g_model(image))).item()
+                print(f"Fused model max abs difference to the eval model: {max_error:.2e}")
+                if max_error > args.parity_atol:
+                    raise RuntimeError(f"Fused model differs from the eval model by {max_error:.2e} "
+                                       f"(`--parity_atol {args.parity_atol}`).")
             save_image(gen_image.detach(),
                        f"{benchmark_dir}/{os.path.basename(model_weights)[:-8]}_{os.path.basename(args.image_path)}",
                        normalize=True)
@@ -60,6 +76,15 @@ if __name__ == "__main__":
                         help="Generator model weights dir path.  Default: ``./samples/CycleGAN-apple2orange``")
     parser.add_argument("--model_type", type=str, default="g_A2B", choices=["g_A2B", "g_B2A"],
                         help="Generator model dir path.  Default: ``g_A2B``")
+    parser.add_argument("--no_fuse", action="store_true", default=False,
+                        help="Keep the InstanceNorm layers instead of folding them into the convolutions. Default: ``False``")
+    parser.add_argument("--parity_atol", type=float, default=1e-3,
+                        help="Largest difference of the fused model to the eval model. Default: ``1e-3``")
+    parser.add_argument("--compile", action="store_true", default=False,
+                        help="Compile the generator with `torch.compile`. Default: ``False``")
+    parser.add_argument("--compile_mode", type=str, default="default",
+                        choices=["default", "reduce-overhead", "max-autotune"],
+                        help="`torch.compile` mode. Default: ``default``")
     parser.add_argument("--device", type=str, default="cuda:0", choices=["cpu", "cuda:0"],
                         help="Device. Default: ``cuda:0``.")
     args = parser.parse_args()
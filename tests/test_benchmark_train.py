@@ -0,0 +1,37 @@
+# Copyright 2023 Lorna. All Rights Reserved.
+# Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""FLOPs count of the generator variants table"""
+import pytest
+
+pytest.importorskip("numpy")
+torch = pytest.importorskip("torch")
+pytest.importorskip("cv2")
+pytest.importorskip("torchvision")
+pytest.importorskip("yaml")
+pytest.importorskip("tensorboard")
+
+import benchmark_train
+import model
+
+
+@pytest.mark.parametrize("variant, num_flops", [("cyclenet", 24775753728), ("cyclenet_6blocks_half", 4536139776)])
+def test_count_conv_flops(variant, num_flops):
+    # The 128px column of the README table, the count does not change when the norms are folded
+    g_model = model.__dict__[variant](in_channels=3, out_channels=3, channels=64).eval()
+    x = torch.randn(1, 3, 128, 128)
+
+    with torch.no_grad():
+        assert benchmark_train.count_conv_flops(g_model, x) == num_flops
+        assert benchmark_train.count_conv_flops(model.fuse_instance_norm(g_model), x) == num_flops
+    assert not any(module._forward_hooks for module in g_model.modules())
@@ -0,0 +1,86 @@
+# Copyright 2023 Lorna. All Rights Reserved.
+# Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Forward and backward passes of the models in channels_last, without copies back to the contiguous format"""
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from torch.profiler import profile, ProfilerActivity
+
+import model
+
+_LAYOUT_CONVERSION_OPS = ["aten::contiguous", "aten::copy_"]
+
+
+def _layout_conversions(train_model, x):
+    with profile(activities=[ProfilerActivity.CPU]) as prof:
+        y = train_model(x)
+        # A channels_last gradient, the backward of `mean()` would start from an expanded contiguous one
+        y.backward(torch.ones_like(y))
+
+    return y, [event.name for event in prof.events() if event.name in _LAYOUT_CONVERSION_OPS]
+
+
+@pytest.mark.parametrize("build_model", [
+    lambda: model.cyclenet(in_channels=3, out_channels=3, channels=8, num_residual_blocks=2),
+    lambda: model.path_discriminator(in_channels=3, out_channels=1, channels=8),
+], ids=["cyclenet", "path_discriminator"])
+def test_channels_last_forward_backward(build_model):
+    torch.manual_seed(0)
+    train_model = build_model().train().to(memory_format=torch.channels_last)
+    x = torch.randn(2, 3, 32, 32).contiguous(memory_format=torch.channels_last)
+
+    y, conversions = _layout_conversions(train_model, x)
+    assert conversions == []
+    assert y.is_contiguous(memory_format=torch.channels_last)
+    for parameter in train_model.parameters():
+        assert parameter.grad is not None
+
+
+def test_reflection_pad_matches_stock_module():
+    pad = model._ReflectionPad2d(3)
+    x = torch.randn(2, 4, 9, 10)
+    x_channels_last = x.contiguous(memory_format=torch.channels_last).requires_grad_()
+    x = x.requires_grad_()
+
+    y = pad(x)
+    y_channels_last = pad(x_channels_last)
+    grad = torch.randn_like(y)
+    y.backward(grad)
+    y_channels_last.backward(grad.contiguous(memory_format=torch.channels_last))
+
+    assert y_channels_last.is_contiguous(memory_format=torch.channels_last)
+    assert torch.equal(y_channels_last, y)
+    assert x_channels_last.grad.is_contiguous(memory_format=torch.channels_last)
+    assert torch.allclose(x_channels_last.grad, x.grad)
+
+
+@pytest.mark.parametrize("dtype", [torch.half, torch.bfloat16])
+@pytest.mark.parametrize("training", [True, False])
+def test_instance_norm_keeps_dtype(dtype, training):
+    norm = model._InstanceNorm2d(4, track_running_stats=True).train(training)
+    with torch.no_grad():
+        norm.running_mean.normal_()
+        norm.running_var.uniform_(0.5, 2.0)
+    reference_norm = torch.nn.InstanceNorm2d(4, track_running_stats=True).train(training)
+    reference_norm.load_state_dict(norm.state_dict())
+
+    x = torch.randn(2, 4, 6, 6)
+    y = norm(x.to(dtype).contiguous(memory_format=torch.channels_last))
+    # The stock module in float32 on the same rounded input
+    reference_y = reference_norm(x.to(dtype).float())
+
+    assert y.dtype == dtype
+    assert y.is_contiguous(memory_format=torch.channels_last)
+    assert torch.allclose(y.float(), reference_y, atol=1e-2, rtol=1e-2)
@@ -0,0 +1,101 @@
+# Copyright 2023 Lorna. All Rights Reserved.
+# Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Samplers and datasets of dataset.py"""
+import json
+import os
+import random
+from types import SimpleNamespace
+
+import pytest
+
+np = pytest.importorskip("numpy")
+torch = pytest.importorskip("torch")
+cv2 = pytest.importorskip("cv2")
+pytest.importorskip("PIL")
+pytest.importorskip("torchvision")
+
+from torch.utils.data import DataLoader
+
+import dataset
+import utils
+
+
+def _write_shards_index(shards_dir, num_shards):
+    for domain in ["src", "dst"]:
+        shards = [{"name": f"{domain}-{i:06d}.tar", "count": 10} for i in range(num_shards)]
+        with open(os.path.join(shards_dir, f"{domain}.json"), "w") as f:
+            json.dump({"images_dir": str(shards_dir), "shards": shards}, f)
+
+
+@pytest.mark.parametrize("num_shards, num_workers", [(2, 4), (3, 3), (5, 2)])
+def test_shard_split_reads_every_shard_once(tmp_path, monkeypatch, num_shards, num_workers):
+    _write_shards_index(tmp_path, num_shards)
+    shard_dataset = dataset.ShardImageDataset(str(tmp_path), False, 8)
+
+    splits = []
+    for worker_id in range(num_workers):
+        monkeypatch.setattr(dataset, "get_worker_info", lambda: SimpleNamespace(id=worker_id, num_workers=num_workers))
+        splits.append(shard_dataset._split(num_shards, 0))
+
+    shard_indices = [shard_index for split in splits for shard_index in split]
+    assert sorted(shard_indices) == list(range(num_shards))
+    # Only the unpaired domain B, streamed repeatedly, may hand a shard to a worker that has none
+    monkeypatch.setattr(dataset, "get_worker_info", lambda: SimpleNamespace(id=num_workers - 1, num_workers=num_workers))
+    assert len(shard_dataset._split(num_shards, 0, True)) >= 1
+
+
+def test_augment_images_draws_per_domain_when_unpaired():
+    image = np.random.default_rng(0).integers(0, 256, (8, 8, 3), dtype=np.uint8)
+
+    # Paired images share the rotation and the flips, unpaired images draw their own
+    for seed in range(16):
+        src_image, dst_image = dataset._augment_images(image, image, True, np.random.default_rng(seed))
+        np.testing.assert_array_equal(src_image, dst_image)
+    unpaired_images = [dataset._augment_images(image, image, False, np.random.default_rng(seed)) for seed in range(16)]
+    assert any(not np.array_equal(src_image, dst_image) for src_image, dst_image in unpaired_images)
+
+
+def _write_images(images_dir, num_images, seed):
+    os.makedirs(images_dir)
+    rng = np.random.default_rng(seed)
+    for i in range(num_images):
+        cv2.imwrite(os.path.join(images_dir, f"{i:04d}.png"), rng.integers(0, 256, (12, 12, 3), dtype=np.uint8))
+
+
+def test_same_sample_key_gives_same_sample_in_every_worker(tmp_path):
+    _write_images(str(tmp_path / "a"), 4, 0)
+    _write_images(str(tmp_path / "b"), 5, 1)
+    image_dataset = dataset.UnpairedImageDataset(str(tmp_path / "a"), str(tmp_path / "b"), 10, uint8=True,
+                                                 crop_image_size=8, augment=True)
+
+    sampler = dataset.UnpairedSampler(4, 5, seed=3)
+    sampler.set_epoch(2)
+    key = next(iter(sampler))
+    expected_sample = image_dataset[key]
+
+    # Every worker loads the key once, each with its own worker seed
+    dataloader = DataLoader(image_dataset, batch_size=None, sampler=[key] * 4, num_workers=2,
+                            worker_init_fn=dataset.seed_worker)
+    for sample in dataloader:
+        assert torch.equal(sample["src"], expected_sample["src"])
+        assert torch.equal(sample["dst"], expected_sample["dst"])
+
+
+def test_rng_state_round_trip():
+    rng_state = utils.get_rng_state()
+    draws = (random.random(), np.random.rand(), torch.rand(1))
+    utils.set_rng_state(rng_state)
+
+    assert (random.random(), np.random.rand()) == draws[:2]
+    assert torch.equal(torch.rand(1), draws[2])
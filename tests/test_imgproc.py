@@ -0,0 +1,248 @@
+# Copyright 2023 Lorna. All Rights Reserved.
+# Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""The numpy (HWC) branches of the imgproc augmentations against their Tensor (CHW) branches"""
+import pytest
+
+np = pytest.importorskip("numpy")
+torch = pytest.importorskip("torch")
+pytest.importorskip("cv2")
+pytest.importorskip("torchvision")
+
+import imgproc
+
+_SEEDS = range(8)
+
+
+def _image_pair(height: int, width: int, seed: int):
+    image = np.random.default_rng(seed).integers(0, 256, (height, width, 3), dtype=np.uint8)
+    return image, torch.from_numpy(np.ascontiguousarray(image.transpose(2, 0, 1)))
+
+
+def _assert_same(numpy_images, tensor_images) -> None:
+    for numpy_image, tensor_image in zip(numpy_images, tensor_images):
+        np.testing.assert_array_equal(np.ascontiguousarray(numpy_image.transpose(2, 0, 1)), tensor_image.numpy())
+
+
+@pytest.mark.parametrize("seed", _SEEDS)
+def test_random_crop(seed):
+    src_image, src_tensor = _image_pair(20, 24, 0)
+    dst_image, dst_tensor = _image_pair(20, 24, 1)
+
+    numpy_images = imgproc.random_crop_torch(src_image, dst_image, 8, np.random.default_rng(seed))
+    tensor_images = imgproc.random_crop_torch(src_tensor, dst_tensor, 8, np.random.default_rng(seed))
+    _assert_same(numpy_images, tensor_images)
+
+    # Both images share the offsets drawn from the generator
+    rng = np.random.default_rng(seed)
+    top, left = int(rng.integers(0, 20 - 8 + 1)), int(rng.integers(0, 24 - 8 + 1))
+    np.testing.assert_array_equal(numpy_images[0], src_image[top:top + 8, left:left + 8])
+    np.testing.assert_array_equal(numpy_images[1], dst_image[top:top + 8, left:left + 8])
+
+
+def test_center_crop():
+    src_image, src_tensor = _image_pair(20, 24, 0)
+    dst_image, dst_tensor = _image_pair(20, 24, 1)
+
+    numpy_images = imgproc.center_crop_torch(src_image, dst_image, 8)
+    tensor_images = imgproc.center_crop_torch(src_tensor, dst_tensor, 8)
+    _assert_same(numpy_images, tensor_images)
+    np.testing.assert_array_equal(numpy_images[0], src_image[6:14, 8:16])
+
+
+@pytest.mark.parametrize("seed", _SEEDS)
+def test_random_rotate_right_angles(seed):
+    # Square images take the rot90 path, views on the numpy side
+    src_image, src_tensor = _image_pair(16, 16, 0)
+    dst_image, dst_tensor = _image_pair(16, 16, 1)
+
+    angles = [0, 90, 180, 270]
+    numpy_images = imgproc.random_rotate_torch(src_image, dst_image, angles, generator=np.random.default_rng(seed))
+    tensor_images = imgproc.random_rotate_torch(src_tensor, dst_tensor, angles, generator=np.random.default_rng(seed))
+    _assert_same(numpy_images, tensor_images)
+    assert np.shares_memory(numpy_images[0], src_image)
+
+
+@pytest.mark.parametrize("angle", [90, 270])
+def test_random_rotate_warp_affine(angle):
+    # A right angle on a non-square image keeps the image shape, so it goes through `cv2.warpAffine` and the batched
+    # `affine_grid` path. Width and height of the same parity map pixel centers onto pixel centers, where the bilinear
+    # and the nearest resampling agree exactly
+    src_image, src_tensor = _image_pair(6, 8, 0)
+    dst_image, dst_tensor = _image_pair(6, 8, 1)
+
+    numpy_images = imgproc.random_rotate_torch(src_image, dst_image, [angle], generator=np.random.default_rng(0))
+    tensor_images = imgproc.random_rotate_torch(src_tensor, dst_tensor, [angle], generator=np.random.default_rng(0))
+    _assert_same(numpy_images, tensor_images)
+
+
+@pytest.mark.parametrize("seed", _SEEDS)
+def test_random_horizontally_flip(seed):
+    src_image, src_tensor = _image_pair(12, 16, 0)
+    dst_image, dst_tensor = _image_pair(12, 16, 1)
+
+    numpy_images = imgproc.random_horizontally_flip_torch(src_image, dst_image, 0.5, np.random.default_rng(seed))
+    tensor_images = imgproc.random_horizontally_flip_torch(src_tensor, dst_tensor, 0.5, np.random.default_rng(seed))
+    _assert_same(numpy_images, tensor_images)
+
+
+@pytest.mark.parametrize("seed", _SEEDS)
+def test_random_vertically_flip(seed):
+    src_image, src_tensor = _image_pair(12, 16, 0)
+    dst_image, dst_tensor = _image_pair(12, 16, 1)
+
+    numpy_images = imgproc.random_vertically_flip_torch(src_image, dst_image, 0.5, np.random.default_rng(seed))
+    tensor_images = imgproc.random_vertically_flip_torch(src_tensor, dst_tensor, 0.5, np.random.default_rng(seed))
+    _assert_same(numpy_images, tensor_images)
+
+
+@pytest.mark.parametrize("flip", [imgproc.random_horizontally_flip_torch, imgproc.random_vertically_flip_torch])
+def test_random_flip_always(flip):
+    # p=0 flips every time, the numpy result is a view of the input
+    src_image, src_tensor = _image_pair(12, 16, 0)
+
+    numpy_image, _ = flip(src_image, None, 0.0, np.random.default_rng(0))
+    tensor_image, _ = flip(src_tensor, None, 0.0, np.random.default_rng(0))
+    _assert_same([numpy_image], [tensor_image])
+    assert not np.array_equal(numpy_image, src_image)
+    assert np.shares_memory(numpy_image, src_image)
+
+
+class _Draws(object):
+    # Replays fixed draws through the `generator` argument of the per-call functions, like a `np.random.Generator`
+    def __init__(self, integers, randoms):
+        self._integers = list(integers)
+        self._randoms = list(randoms)
+
+    def integers(self, low, high):
+        return self._integers.pop(0)
+
+    def random(self):
+        return self._randoms.pop(0)
+
+
+def _sample_draws(images, patch_size, generator):
+    # Same draws, in the same order, as `AugmentationPlan.sample`
+    batch_size, image_height, image_width = images.size(0), images.size(2), images.size(3)
+    top = torch.randint(0, image_height - patch_size + 1, (batch_size,), generator=generator)
+    left = torch.randint(0, image_width - patch_size + 1, (batch_size,), generator=generator)
+    turns = torch.randint(0, 4, (batch_size,), generator=generator)
+    vflip = torch.rand(batch_size, generator=generator) < 0.5
+    hflip = torch.rand(batch_size, generator=generator) < 0.5
+
+    return top, left, turns, vflip, hflip
+
+
+def _augment_per_call(images, patch_size, draws):
+    # The per-image chain the fused gather replaces, the flips flip when their draw is above p
+    augmented_images = []
+    for image, top, left, turns, vflip, hflip in zip(images, *draws):
+        image, _ = imgproc.random_crop_torch(image, None, patch_size, _Draws([int(top), int(left)], []))
+        image, _ = imgproc.random_rotate_torch(image, None, [0, 90, 180, 270], generator=_Draws([int(turns)], []))
+        image, _ = imgproc.random_vertically_flip_torch(image, None, 0.5, _Draws([], [float(vflip)]))
+        image, _ = imgproc.random_horizontally_flip_torch(image, None, 0.5, _Draws([], [float(hflip)]))
+        augmented_images.append(image)
+
+    return torch.stack(augmented_images)
+
+
+@pytest.mark.parametrize("seed", _SEEDS)
+@pytest.mark.parametrize("paired", [True, False])
+def test_fused_augment_matches_per_call_functions(seed, paired):
+    src_images = torch.randint(0, 256, (6, 3, 20, 24), generator=torch.Generator().manual_seed(100), dtype=torch.uint8)
+    dst_images = torch.randint(0, 256, (6, 3, 20, 24), generator=torch.Generator().manual_seed(101), dtype=torch.uint8)
+
+    fused_src_images, fused_dst_images = imgproc.fused_augment_batch_torch(src_images, dst_images, 8, paired,
+                                                                          torch.Generator().manual_seed(seed))
+
+    generator = torch.Generator().manual_seed(seed)
+    src_draws = _sample_draws(src_images, 8, generator)
+    dst_draws = src_draws if paired else _sample_draws(dst_images, 8, generator)
+    assert torch.equal(fused_src_images, _augment_per_call(src_images, 8, src_draws))
+    assert torch.equal(fused_dst_images, _augment_per_call(dst_images, 8, dst_draws))
+
+
+def _image_batch(seed: int):
+    return torch.randint(0, 256, (16, 3, 20, 24), generator=torch.Generator().manual_seed(seed), dtype=torch.uint8)
+
+
+@pytest.mark.parametrize("paired", [True, False])
+def test_random_crop_batch_per_sample(paired):
+    src_images, dst_images = _image_batch(100), _image_batch(101)
+    cropped_src_images, cropped_dst_images = imgproc.random_crop_batch_torch(src_images, dst_images, 8, paired,
+                                                                            torch.Generator().manual_seed(0))
+
+    # Same draws as the batch function, one position per image and per batch unless paired
+    generator = torch.Generator().manual_seed(0)
+    src_offsets = [torch.randint(0, 20 - 8 + 1, (16,), generator=generator),
+                   torch.randint(0, 24 - 8 + 1, (16,), generator=generator)]
+    dst_offsets = src_offsets if paired else [torch.randint(0, 20 - 8 + 1, (16,), generator=generator),
+                                              torch.randint(0, 24 - 8 + 1, (16,), generator=generator)]
+    assert len(set(zip(*[offsets.tolist() for offsets in src_offsets]))) > 1
+
+    for images, cropped_images, (top, left) in [(src_images, cropped_src_images, src_offsets),
+                                                (dst_images, cropped_dst_images, dst_offsets)]:
+        for i in range(16):
+            cropped_image, _ = imgproc.random_crop_torch(images[i], None, 8, _Draws([int(top[i]), int(left[i])], []))
+            assert torch.equal(cropped_images[i], cropped_image)
+
+
+@pytest.mark.parametrize("flip_batch, flip", [
+    (imgproc.random_vertically_flip_batch_torch, imgproc.random_vertically_flip_torch),
+    (imgproc.random_horizontally_flip_batch_torch, imgproc.random_horizontally_flip_torch),
+])
+@pytest.mark.parametrize("paired", [True, False])
+def test_random_flip_batch_per_sample(flip_batch, flip, paired):
+    src_images, dst_images = _image_batch(100), _image_batch(101)
+    flipped_src_images, flipped_dst_images = flip_batch(src_images, dst_images, 0.5, paired,
+                                                        torch.Generator().manual_seed(0))
+
+    # Every image flips on its own draw, the per-call functions flip when their draw is above p
+    generator = torch.Generator().manual_seed(0)
+    src_mask = torch.rand(16, generator=generator) < 0.5
+    dst_mask = src_mask if paired else torch.rand(16, generator=generator) < 0.5
+    assert 0 < int(src_mask.sum()) < 16
+
+    for images, flipped_images, mask in [(src_images, flipped_src_images, src_mask),
+                                         (dst_images, flipped_dst_images, dst_mask)]:
+        for i in range(16):
+            flipped_image, _ = flip(images[i], None, 0.5, _Draws([], [float(mask[i])]))
+            assert torch.equal(flipped_images[i], flipped_image)
+
+
+@pytest.mark.parametrize("angle", [90, 180, 270])
+def test_random_rotate_right_angles_match_rot90(angle):
+    _, src_tensor = _image_pair(16, 16, 0)
+    _, dst_tensor = _image_pair(16, 16, 1)
+
+    src_rotated, dst_rotated = imgproc.random_rotate_torch(src_tensor, dst_tensor, [angle], generator=_Draws([0], []))
+    assert torch.equal(src_rotated, torch.rot90(src_tensor, angle // 90, dims=(-2, -1)))
+    assert torch.equal(dst_rotated, torch.rot90(dst_tensor, angle // 90, dims=(-2, -1)))
+
+
+@pytest.mark.parametrize("angle", [30, 45, 135])
+def test_random_rotate_affine_grid_matches_warp_affine(angle):
+    # On a linear ramp the bilinear `cv2.warpAffine` is exact, the nearest `affine_grid` sample is at most half a pixel
+    # off on each axis, so both agree within half the ramp slopes
+    rows, cols = np.mgrid[0:32, 0:32].astype(np.float32)
+    image = np.repeat((3 * rows + 2 * cols)[:, :, None], 3, axis=2)
+    tensor = torch.from_numpy(np.ascontiguousarray(image.transpose(2, 0, 1)))
+
+    numpy_image, _ = imgproc.random_rotate_torch(image, None, [angle], generator=_Draws([0], []))
+    tensor_image, _ = imgproc.random_rotate_torch(tensor, None, [angle], generator=_Draws([0], []))
+
+    # Inner window, its rotated samples all fall inside the image
+    numpy_window = numpy_image[8:24, 8:24].transpose(2, 0, 1)
+    tensor_window = tensor_image[:, 8:24, 8:24].numpy()
+    np.testing.assert_allclose(tensor_window, numpy_window, atol=0.5 * 3 + 0.5 * 2 + 1e-3)
+    assert not np.allclose(numpy_image, image)
@@ -0,0 +1,56 @@
+# Copyright 2023 Lorna. All Rights Reserved.
+# Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Folding the running-stat InstanceNorm2d layers of CycleNet into its convolutions"""
+import copy
+
+import pytest
+
+torch = pytest.importorskip("torch")
+
+import model
+
+
+def _random_cyclenet(**kwargs):
+    torch.manual_seed(0)
+    cyclenet_model = model.cyclenet(in_channels=3, out_channels=3, channels=16, **kwargs)
+    with torch.no_grad():
+        for module in cyclenet_model.modules():
+            if isinstance(module, (torch.nn.Conv2d, torch.nn.ConvTranspose2d)) and module.bias is not None:
+                module.bias.normal_(0.0, 0.1)
+            if isinstance(module, model._InstanceNorm2d):
+                module.running_mean.normal_()
+                module.running_var.uniform_(0.5, 2.0)
+
+    return cyclenet_model.eval()
+
+
+@pytest.mark.parametrize("kwargs", [{}, {"num_residual_blocks": 2, "num_downsampling": 1}], ids=["default", "small"])
+def test_fuse_instance_norm(kwargs):
+    cyclenet_model = _random_cyclenet(**kwargs)
+    x = torch.randn(2, 3, 32, 32)
+
+    fused_model = model.fuse_instance_norm(copy.deepcopy(cyclenet_model))
+    with torch.no_grad():
+        assert torch.allclose(fused_model(x), cyclenet_model(x), atol=1e-5)
+    assert not any(isinstance(module, model._InstanceNorm2d) for module in fused_model.modules())
+
+
+def test_fuse_instance_norm_keeps_model():
+    cyclenet_model = _random_cyclenet(num_residual_blocks=2)
+    state_dict = copy.deepcopy(cyclenet_model.state_dict())
+
+    model.fuse_instance_norm(cyclenet_model)
+    for name, value in cyclenet_model.state_dict().items():
+        assert torch.equal(value, state_dict[name]), name
+    assert any(isinstance(module, model._InstanceNorm2d) for module in cyclenet_model.modules())
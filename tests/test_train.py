@@ -0,0 +1,88 @@
+# Copyright 2023 Lorna. All Rights Reserved.
+# Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Losses and train loop helpers of train.py"""
+import pytest
+
+pytest.importorskip("numpy")
+torch = pytest.importorskip("torch")
+pytest.importorskip("cv2")
+pytest.importorskip("torchvision")
+pytest.importorskip("yaml")
+pytest.importorskip("tensorboard")
+
+from torch import nn
+from torch.utils.data import DataLoader, Dataset
+
+import train
+from dataset import DevicePrefetcher, PairedSampler
+
+
+def _loss_config(adversarial_loss: str):
+    return {"TRAIN": {"LOSSES": {"IDENTITY_LOSS": {"NAME": "l1"},
+                                 "ADVERSARIAL_LOSS": {"NAME": adversarial_loss},
+                                 "CYCLE_LOSS": {"NAME": "l1"}}}}
+
+
+@pytest.mark.parametrize("adversarial_loss, adversarial_type", [("lsgan", nn.MSELoss),
+                                                                ("vanilla", nn.BCEWithLogitsLoss)])
+def test_define_loss(adversarial_loss, adversarial_type):
+    identity_criterion, adversarial_criterion, cycle_criterion = train.define_loss(_loss_config(adversarial_loss),
+                                                                                   torch.device("cpu"))
+
+    assert isinstance(identity_criterion, nn.L1Loss)
+    assert isinstance(adversarial_criterion, adversarial_type)
+    assert isinstance(cycle_criterion, nn.L1Loss)
+
+
+def test_define_loss_not_implemented():
+    with pytest.raises(NotImplementedError):
+        train.define_loss(_loss_config("hinge"), torch.device("cpu"))
+
+
+class _ImagePairs(Dataset):
+    def __init__(self, num_images: int) -> None:
+        self.num_images = num_images
+
+    def __getitem__(self, key):
+        # `(index, sample seed)` keys of the resumable samplers
+        index = key[0]
+        return {"src": torch.full((3, 4, 4), float(index)), "dst": torch.full((3, 4, 4), float(-index))}
+
+    def __len__(self) -> int:
+        return self.num_images
+
+
+def _fail_step(*args):
+    pytest.fail("No train step may run in an epoch without batches")
+
+
+def test_resume_after_last_batch_of_epoch():
+    # A checkpoint written after the last batch of the epoch, the sampler is at the end of the epoch
+    sampler = PairedSampler(4, shuffle=True, seed=0)
+    sampler.load_state_dict({"seed": 0, "epoch": 0, "position": 4})
+    dataloader = DataLoader(_ImagePairs(4), batch_size=2, sampler=sampler, drop_last=True)
+    prefetcher = DevicePrefetcher(dataloader, torch.device("cpu"))
+    assert len(prefetcher) == 0
+
+    g_A_model, g_B_model, d_A_model, d_B_model = [nn.Identity() for _ in range(4)]
+    train.train(g_A_model, g_B_model, None, None, d_A_model, d_B_model,
+                prefetcher, _fail_step, _fail_step, _fail_step,
+                None, None, None, None, None, None,
+                0, 2, torch.Generator(), None, None, "", "", torch.device("cpu"), {})
+
+    # The next epoch starts from its first batch again
+    sampler.set_epoch(1)
+    prefetcher.reset()
+    assert prefetcher.next()["src"].size(0) == 2
+    prefetcher.close()
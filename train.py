@@ -12,29 +12,40 @@
 # limitations under the License.
 # ==============================================================================
 import argparse
+import copy
 import itertools
 import os
 import random
 import time
-from typing import Any, List, Tuple
+from functools import partial
+from typing import Any, Callable, Dict, List, Tuple
 
 import numpy as np
 import torch
+import torch._dynamo
 import yaml
-from torch import nn, optim
+from torch import nn, optim, Tensor
 from torch.backends import cudnn
 from torch.cuda import amp
 from torch.optim import lr_scheduler
 from torch.optim.swa_utils import AveragedModel
-from torch.utils.data import DataLoader
+from torch.utils.data import DataLoader, Dataset, IterableDataset
 from torch.utils.tensorboard import SummaryWriter
 from torchvision.utils import save_image
 
 import model
-from dataset import CUDAPrefetcher, ImageDataset
-from imgproc import random_crop_torch, random_rotate_torch, random_vertically_flip_torch, random_horizontally_flip_torch
-from utils import load_pretrained_state_dict, load_resume_state_dict, make_directory, save_checkpoint, DecayLR, \
-    ReplayBuffer, Summary, AverageMeter, ProgressMeter
+from dataset import DevicePrefetcher, PrefetchDataLoader, PinnedBatchCollator, ImageDataset, UnpairedImageDataset, \
+    PairedSampler, UnpairedSampler, ShardImageDataset, seed_worker
+from imgproc import fused_augment_batch_torch
+from utils import load_pretrained_state_dict, load_resume_state_dict, load_resume_data_state, get_state_dict, \
+    compile_model, get_rng_state, set_rng_state, make_directory, save_checkpoint, DecayLR, ReplayBuffer, Summary, \
+    AverageMeter, ProgressMeter
+
+# Number of steps that include the compilation of the models and number of steps timed after them at startup
+_STARTUP_WARMUP_STEPS = 3
+_STARTUP_STEADY_STEPS = 10
+# Major and minor version of the installed torch, e.g. (2, 0) for `2.0.1+cu118`
+_TORCH_VERSION = tuple(int(v) for v in torch.__version__.split("+")[0].split(".")[:2])
 
 
 def main():
@@ -58,18 +69,34 @@ def main():
     # Because the size of the input image is fixed, the fixed CUDNN convolution method can greatly increase the running speed
     cudnn.benchmark = True
 
-    # Initialize the mixed precision method
-    scaler = amp.GradScaler()
+    # Define the running device number, fall back to the CPU on hosts without CUDA
+    if torch.cuda.is_available():
+        device = torch.device("cuda", config["DEVICE_ID"])
+    else:
+        device = torch.device("cpu")
+
+    # Initialize the mixed precision method, only used on CUDA devices
+    scaler = amp.GradScaler(enabled=device.type == "cuda")
 
     # Default to start training from scratch
     start_epoch = 0
-
-    # Define the running device number
-    device = torch.device("cuda", config["DEVICE_ID"])
+    start_batch_index = 0
 
     train_data_prefetcher = load_datasets(config, device)
+    # Random draws of the device-side augmentation, saved with the checkpoints
+    augment_generator = torch.Generator(device)
+    augment_generator.manual_seed(config["SEED"])
     g_A_model, g_B_model, ema_g_A_model, ema_g_B_model, d_A_model, d_B_model = build_model(config, device)
     identity_criterion, adversarial_criterion, cycle_criterion = define_loss(config, device)
+    generator_step_fn, discriminator_A_step_fn, discriminator_B_step_fn = build_train_step(config,
+                                                                                           g_A_model,
+                                                                                           g_B_model,
+                                                                                           d_A_model,
+                                                                                           d_B_model,
+                                                                                           identity_criterion,
+                                                                                           adversarial_criterion,
+                                                                                           cycle_criterion,
+                                                                                           device)
     g_optimizer, d_optimizer = define_optimizer(g_A_model,
                                                 g_B_model,
                                                 d_A_model,
@@ -133,6 +160,21 @@ def main():
             config["MODEL"]["D"]["COMPILED"],
             config["TRAIN"]["CHECKPOINT"]["RESUME_D_B_MODEL_WEIGHTS_PATH"],
         )
+
+        # Continue from the exact batch the checkpoint was written at
+        data_state = load_resume_data_state(config["TRAIN"]["CHECKPOINT"]["RESUME_G_A_MODEL_WEIGHTS_PATH"])
+        if data_state is not None:
+            start_epoch = data_state["epoch"]
+            start_batch_index = data_state["batch_index"]
+            train_sampler = get_train_sampler(train_data_prefetcher)
+            train_sampler.load_state_dict(data_state["sampler"])
+            # Shard streams can only restart an epoch from its beginning
+            if train_sampler.position == 0:
+                start_batch_index = 0
+            set_rng_state(data_state["rng_state"])
+            if "augment_rng_state" in data_state:
+                augment_generator.set_state(data_state["augment_rng_state"])
+            print(f"Resume data loading at epoch {start_epoch + 1}, batch {start_batch_index}.")
         print(f"Loaded resume model weights successfully.")
     else:
         print("Resume training model not found. Start training from scratch.")
@@ -148,10 +190,13 @@ def main():
     # Create training process log file
     writer = SummaryWriter(os.path.join("samples", "logs", config["EXP_NAME"]))
 
-    fake_A_buffer = ReplayBuffer()
-    fake_B_buffer = ReplayBuffer()
+    fake_A_buffer = ReplayBuffer(memory_format=get_memory_format(config))
+    fake_B_buffer = ReplayBuffer(memory_format=get_memory_format(config))
 
     for epoch in range(start_epoch, config["TRAIN"]["HYP"]["EPOCHS"]):
+        # Redraw the per-epoch permutations of the sampler
+        get_train_sampler(train_data_prefetcher).set_epoch(epoch)
+
         train(g_A_model,
               g_B_model,
               ema_g_A_model,
@@ -159,97 +204,182 @@ def main():
               d_A_model,
               d_B_model,
               train_data_prefetcher,
-              identity_criterion,
-              adversarial_criterion,
-              cycle_criterion,
+              generator_step_fn,
+              discriminator_A_step_fn,
+              discriminator_B_step_fn,
               g_optimizer,
               d_optimizer,
+              g_scheduler,
+              d_scheduler,
               fake_A_buffer,
               fake_B_buffer,
               epoch,
+              start_batch_index if epoch == start_epoch else 0,
+              augment_generator,
               scaler,
               writer,
+              samples_dir,
+              results_dir,
               device,
-              config)
+              config,
+              epoch == start_epoch)
         print("\n")
 
+        # Report how long the training loop waited for data
+        prefetch_stats = train_data_prefetcher.stats()
+        print(f"Data prefetcher: waited {prefetch_stats['wait_time']:.2f}s "
+              f"({prefetch_stats['mean_wait_time'] * 1000:.2f}ms per batch), "
+              f"mean queue depth {prefetch_stats['mean_queue_depth']:.2f}.")
+        writer.add_scalar("Data/Prefetch_Wait_Time", prefetch_stats["wait_time"], epoch + 1)
+        writer.add_scalar("Data/Prefetch_Queue_Depth", prefetch_stats["mean_queue_depth"], epoch + 1)
+        train_data_prefetcher.reset_stats()
+
+        # Report how much of the epoch was served by the shared decoded image cache
+        shared_cache = getattr(train_data_prefetcher.original_dataloader.dataset, "shared_cache", None)
+        if shared_cache is not None:
+            cache_stats = shared_cache.stats()
+            hit_rate = cache_stats["hits"] / max(1, cache_stats["hits"] + cache_stats["misses"])
+            print(f"Shared image cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses "
+                  f"({hit_rate:.1%}), {cache_stats['cached']} images cached.")
+            writer.add_scalar("Data/Shared_Cache_Hit_Rate", hit_rate, epoch + 1)
+            shared_cache.reset_stats()
+
         # Update LR
         g_scheduler.step()
         d_scheduler.step()
 
         is_last = (epoch + 1) == config["TRAIN"]["HYP"]["EPOCHS"]
-        save_checkpoint({"epoch": epoch + 1,
-                         "state_dict": g_A_model.state_dict(),
-                         "ema_state_dict": ema_g_A_model.state_dict(),
-                         "optimizer": g_optimizer.state_dict(),
-                         "scheduler": g_scheduler.state_dict()},
-                        f"g_A_epoch_{epoch + 1}.pth.tar",
-                        samples_dir,
-                        results_dir,
-                        "g_A_best.pth.tar",
-                        "g_A_last.pth.tar",
-                        True,
-                        is_last)
-        save_checkpoint({"epoch": epoch + 1,
-                         "state_dict": g_B_model.state_dict(),
-                         "ema_state_dict": ema_g_B_model.state_dict(),
-                         "optimizer": g_optimizer.state_dict(),
-                         "scheduler": g_scheduler.state_dict()},
-                        f"g_B_epoch_{epoch + 1}.pth.tar",
-                        samples_dir,
-                        results_dir,
-                        "g_B_best.pth.tar",
-                        "g_B_last.pth.tar",
-                        True,
-                        is_last)
-        save_checkpoint({"epoch": epoch + 1,
-                         "state_dict": d_A_model.state_dict(),
-                         "optimizer": d_optimizer.state_dict(),
-                         "scheduler": d_scheduler.state_dict()},
-                        f"d_A_epoch_{epoch + 1}.pth.tar",
-                        samples_dir,
-                        results_dir,
-                        "d_A_best.pth.tar",
-                        "d_A_last.pth.tar",
-                        True,
-                        is_last)
-        save_checkpoint({"epoch": epoch + 1,
-                         "state_dict": d_B_model.state_dict(),
-                         "optimizer": d_optimizer.state_dict(),
-                         "scheduler": d_scheduler.state_dict()},
-                        f"d_B_epoch_{epoch + 1}.pth.tar",
-                        samples_dir,
-                        results_dir,
-                        "d_B_best.pth.tar",
-                        "d_B_last.pth.tar",
-                        True,
-                        is_last)
+        save_train_checkpoints(g_A_model,
+                               g_B_model,
+                               ema_g_A_model,
+                               ema_g_B_model,
+                               d_A_model,
+                               d_B_model,
+                               g_optimizer,
+                               d_optimizer,
+                               g_scheduler,
+                               d_scheduler,
+                               get_data_state(train_data_prefetcher, epoch + 1, 0, 0, augment_generator),
+                               f"epoch_{epoch + 1}",
+                               samples_dir,
+                               results_dir,
+                               True,
+                               is_last)
 
 
 def load_datasets(
         config: Any,
         device: torch.device,
-) -> CUDAPrefetcher:
+) -> DevicePrefetcher:
+    train_datasets, train_sampler = build_train_dataset(config)
+    train_dataloader = build_train_dataloader(config, train_datasets, train_sampler)
+
+    # Batches are pinned and copied to the running device in a background thread, ahead of the training step. Batches
+    # augmented on the device are converted to channels_last after the augmentation, in a single copy
+    if config["TRAIN"]["DATASET"]["AUGMENT"] == "device":
+        memory_format = torch.contiguous_format
+    else:
+        memory_format = get_memory_format(config)
+    train_data_prefetcher = DevicePrefetcher(train_dataloader,
+                                             device,
+                                             config["TRAIN"]["HYP"]["PREFETCH_BATCHES"],
+                                             memory_format)
+
+    return train_data_prefetcher
+
+
+def build_train_dataset(config: Any) -> Tuple[Dataset, Any]:
     # Load dataset
-    train_datasets = ImageDataset(
-        config["TRAIN"]["DATASET"]["SRC_IMAGE_PATH"],
-        config["TRAIN"]["DATASET"]["DST_IMAGE_PATH"],
-        config["TRAIN"]["DATASET"]["UNPAIRED"],
-        config["TRAIN"]["DATASET"]["IMAGE_SIZE"],
-    )
-    # Generator all dataloader
-    train_dataloader = DataLoader(train_datasets,
-                                  batch_size=config["TRAIN"]["HYP"]["IMGS_PER_BATCH"],
-                                  shuffle=config["TRAIN"]["HYP"]["SHUFFLE"],
-                                  num_workers=config["TRAIN"]["HYP"]["NUM_WORKERS"],
-                                  pin_memory=config["TRAIN"]["HYP"]["PIN_MEMORY"],
-                                  drop_last=True,
-                                  persistent_workers=config["TRAIN"]["HYP"]["PERSISTENT_WORKERS"])
+    dataset_kwargs = {
+        "cache_dir": config["TRAIN"]["DATASET"]["CACHE_DIR"],
+        "uint8": config["TRAIN"]["DATASET"]["UINT8"],
+        "reduced_decode": config["TRAIN"]["DATASET"]["REDUCED_DECODE"],
+        "meta_dir": config["TRAIN"]["DATASET"]["META_DIR"],
+        "decode_threads": config["TRAIN"]["DATASET"]["DECODE_THREADS"],
+        "shared_cache_bytes": int(config["TRAIN"]["DATASET"]["SHARED_CACHE_GB"] * 1024 ** 3),
+        "validate": config["TRAIN"]["DATASET"]["VALIDATE"],
+        "validate_workers": config["TRAIN"]["DATASET"]["VALIDATE_WORKERS"],
+        "crop_image_size": config["TRAIN"]["DATASET"]["CROP_SIZE"],
+        "augment": config["TRAIN"]["DATASET"]["AUGMENT"] == "worker",
+    }
+    if config["TRAIN"]["DATASET"]["AUGMENT"] not in ["worker", "device", "none"]:
+        raise NotImplementedError(f"Augment {config['TRAIN']['DATASET']['AUGMENT']} is not implemented.")
+
+    if config["TRAIN"]["DATASET"]["SHARDS"]["ENABLE"]:
+        # Samples are streamed out of archives, the dataset shuffles them itself
+        train_datasets = ShardImageDataset(config["TRAIN"]["DATASET"]["SHARDS"]["DIR"],
+                                           config["TRAIN"]["DATASET"]["UNPAIRED"],
+                                           config["TRAIN"]["DATASET"]["LOAD_SIZE"],
+                                           config["TRAIN"]["DATASET"]["SHARDS"]["SHUFFLE_BUFFER_SIZE"],
+                                           config["SEED"],
+                                           config["TRAIN"]["DATASET"]["UINT8"],
+                                           config["TRAIN"]["DATASET"]["CROP_SIZE"],
+                                           dataset_kwargs["augment"])
+        train_sampler = None
+    elif config["TRAIN"]["DATASET"]["UNPAIRED"]:
+        train_datasets = UnpairedImageDataset(config["TRAIN"]["DATASET"]["SRC_IMAGE_PATH"],
+                                              config["TRAIN"]["DATASET"]["DST_IMAGE_PATH"],
+                                              config["TRAIN"]["DATASET"]["LOAD_SIZE"],
+                                              **dataset_kwargs)
+        # Both domains are shuffled by the sampler, independently of each other
+        train_sampler = UnpairedSampler(len(train_datasets.src_image_file_names),
+                                        len(train_datasets.dst_image_file_names),
+                                        config["TRAIN"]["DATASET"]["SAMPLER"]["EPOCH_LENGTH"],
+                                        config["TRAIN"]["DATASET"]["SAMPLER"]["BLOCK_SIZE"],
+                                        config["SEED"])
+    else:
+        train_datasets = ImageDataset(config["TRAIN"]["DATASET"]["SRC_IMAGE_PATH"],
+                                      config["TRAIN"]["DATASET"]["DST_IMAGE_PATH"],
+                                      False,
+                                      config["TRAIN"]["DATASET"]["LOAD_SIZE"],
+                                      **dataset_kwargs)
+        train_sampler = PairedSampler(len(train_datasets),
+                                      config["TRAIN"]["HYP"]["SHUFFLE"],
+                                      config["SEED"])
+
+    return train_datasets, train_sampler
+
+
+def build_train_dataloader(config: Any, train_datasets: Dataset, train_sampler: Any) -> DataLoader:
+    # Samples are collated straight into pinned batch buffers when the collate runs in the main process
+    collate_fn = None
+    pin_memory = config["TRAIN"]["HYP"]["PIN_MEMORY"]
+    if config["TRAIN"]["HYP"]["PINNED_COLLATE"] and torch.cuda.is_available():
+        if config["TRAIN"]["HYP"]["LOADER"] == "thread" or config["TRAIN"]["HYP"]["NUM_WORKERS"] == 0:
+            # Batches in flight: both prefetch queues, one per producer and the batch being copied
+            num_buffers = 2 * config["TRAIN"]["HYP"]["PREFETCH_BATCHES"] + config["TRAIN"]["HYP"]["NUM_WORKERS"] + 2
+            collate_fn = PinnedBatchCollator(num_buffers)
+            pin_memory = False
+        else:
+            print("`PINNED_COLLATE` needs the `thread` loader or `NUM_WORKERS: 0`, using the default collate.")
 
-    # Place all data on the preprocessing data loader
-    train_data_prefetcher = CUDAPrefetcher(train_dataloader, device)
+    # Generator all dataloader
+    if config["TRAIN"]["HYP"]["LOADER"] == "process":
+        train_dataloader = DataLoader(train_datasets,
+                                      batch_size=config["TRAIN"]["HYP"]["IMGS_PER_BATCH"],
+                                      sampler=train_sampler,
+                                      num_workers=config["TRAIN"]["HYP"]["NUM_WORKERS"],
+                                      collate_fn=collate_fn,
+                                      worker_init_fn=seed_worker,
+                                      pin_memory=pin_memory,
+                                      drop_last=True,
+                                      persistent_workers=(config["TRAIN"]["HYP"]["PERSISTENT_WORKERS"] and
+                                                          config["TRAIN"]["HYP"]["NUM_WORKERS"] > 0))
+    elif config["TRAIN"]["HYP"]["LOADER"] == "thread":
+        # Producer threads in the main process, no worker processes are forked
+        train_dataloader = PrefetchDataLoader(config["TRAIN"]["HYP"]["PREFETCH_BATCHES"],
+                                              config["TRAIN"]["HYP"]["NUM_WORKERS"],
+                                              int(config["TRAIN"]["HYP"]["LOADER_MAX_PREFETCH_MB"] * 1024 ** 2),
+                                              dataset=train_datasets,
+                                              batch_size=config["TRAIN"]["HYP"]["IMGS_PER_BATCH"],
+                                              sampler=train_sampler,
+                                              collate_fn=collate_fn,
+                                              pin_memory=pin_memory,
+                                              drop_last=True)
+    else:
+        raise NotImplementedError(f"Loader {config['TRAIN']['HYP']['LOADER']} is not implemented.")
 
-    return train_data_prefetcher
+    return train_dataloader
 
 
 def build_model(
@@ -281,16 +411,120 @@ def build_model(
         ema_g_A_model = None
         ema_g_B_model = None
 
-    g_A_model = g_A_model.to(device)
-    g_B_model = g_B_model.to(device)
-    ema_g_A_model = ema_g_A_model.to(device)
-    ema_g_B_model = ema_g_B_model.to(device)
-    d_A_model = d_A_model.to(device)
-    d_B_model = d_B_model.to(device)
+    memory_format = get_memory_format(config)
+    g_A_model = g_A_model.to(device, memory_format=memory_format)
+    g_B_model = g_B_model.to(device, memory_format=memory_format)
+    if ema_g_A_model is not None:
+        ema_g_A_model = ema_g_A_model.to(device, memory_format=memory_format)
+        ema_g_B_model = ema_g_B_model.to(device, memory_format=memory_format)
+    d_A_model = d_A_model.to(device, memory_format=memory_format)
+    d_B_model = d_B_model.to(device, memory_format=memory_format)
+
+    # Compile after the EMA models copied the eager generators, the compiled models share their parameters
+    compile_mode = config["MODEL"]["COMPILE_MODE"]
+    if config["MODEL"]["G"]["COMPILED"]:
+        g_A_model = compile_model(g_A_model, compile_mode)
+        g_B_model = compile_model(g_B_model, compile_mode)
+    if config["MODEL"]["EMA"]["COMPILED"] and ema_g_A_model is not None:
+        ema_g_A_model = compile_model(ema_g_A_model, compile_mode)
+        ema_g_B_model = compile_model(ema_g_B_model, compile_mode)
+    if config["MODEL"]["D"]["COMPILED"]:
+        d_A_model = compile_model(d_A_model, compile_mode)
+        d_B_model = compile_model(d_B_model, compile_mode)
 
     return g_A_model, g_B_model, ema_g_A_model, ema_g_B_model, d_A_model, d_B_model
 
 
+def get_memory_format(config: Any) -> torch.memory_format:
+    # Models, image batches and replay buffers share one memory format
+    if config["MODEL"]["CHANNELS_LAST"]:
+        return torch.channels_last
+
+    return torch.contiguous_format
+
+
+def get_train_sampler(train_data_prefetcher: DevicePrefetcher) -> Any:
+    # Iterable datasets order their samples themselves and carry the sampler interface
+    train_dataloader = train_data_prefetcher.original_dataloader
+    if isinstance(train_dataloader.dataset, IterableDataset):
+        return train_dataloader.dataset
+
+    return train_dataloader.sampler
+
+
+def get_data_state(
+        train_data_prefetcher: DevicePrefetcher,
+        epoch: int,
+        batch_index: int,
+        batch_size: int,
+        augment_generator: torch.Generator,
+) -> dict:
+    # Position of the next batch to load, the batches already queued by the loader are loaded again after resuming.
+    # The sampler state (seed, epoch, position) also fixes the random draws of the worker-side crop and augmentation.
+    sampler_state = get_train_sampler(train_data_prefetcher).state_dict()
+    sampler_state["epoch"] = epoch
+    sampler_state["position"] = batch_index * batch_size
+
+    return {"epoch": epoch,
+            "batch_index": batch_index,
+            "sampler": sampler_state,
+            "rng_state": get_rng_state(),
+            "augment_rng_state": augment_generator.get_state()}
+
+
+def report_startup_step_time(step_times: List[float], writer: SummaryWriter, total_batch_index: int) -> None:
+    # Compilation happens in the first calls, `reduce-overhead` also records its CUDA graphs in the calls after them
+    warmup_time = sum(step_times[:_STARTUP_WARMUP_STEPS])
+    steady_step_time = sum(step_times[_STARTUP_WARMUP_STEPS:]) / _STARTUP_STEADY_STEPS
+    compile_time = max(0.0, warmup_time - _STARTUP_WARMUP_STEPS * steady_step_time)
+    print(f"Startup: compile time {compile_time:.2f}s "
+          f"(first {_STARTUP_WARMUP_STEPS} steps took {warmup_time:.2f}s), "
+          f"steady-state step time {steady_step_time * 1000:.2f}ms.")
+    writer.add_scalar("Train/Compile_Time", compile_time, total_batch_index)
+    writer.add_scalar("Train/Steady_Step_Time", steady_step_time, total_batch_index)
+
+
+def save_train_checkpoints(
+        g_A_model: nn.Module,
+        g_B_model: nn.Module,
+        ema_g_A_model: nn.Module,
+        ema_g_B_model: nn.Module,
+        d_A_model: nn.Module,
+        d_B_model: nn.Module,
+        g_optimizer: optim.Adam,
+        d_optimizer: optim.Adam,
+        g_scheduler: lr_scheduler.LambdaLR,
+        d_scheduler: lr_scheduler.LambdaLR,
+        data_state: dict,
+        file_name_suffix: str,
+        samples_dir: str,
+        results_dir: str,
+        is_best: bool,
+        is_last: bool,
+) -> None:
+    for model_name, current_model, ema_model, optimizer, scheduler in [
+        ("g_A", g_A_model, ema_g_A_model, g_optimizer, g_scheduler),
+        ("g_B", g_B_model, ema_g_B_model, g_optimizer, g_scheduler),
+        ("d_A", d_A_model, None, d_optimizer, d_scheduler),
+        ("d_B", d_B_model, None, d_optimizer, d_scheduler),
+    ]:
+        state_dict = {"epoch": data_state["epoch"],
+                      "state_dict": get_state_dict(current_model),
+                      "optimizer": optimizer.state_dict(),
+                      "scheduler": scheduler.state_dict(),
+                      "data_state": data_state}
+        if ema_model is not None:
+            state_dict["ema_state_dict"] = get_state_dict(ema_model)
+        save_checkpoint(state_dict,
+                        f"{model_name}_{file_name_suffix}.pth.tar",
+                        samples_dir,
+                        results_dir,
+                        f"{model_name}_best.pth.tar",
+                        f"{model_name}_last.pth.tar",
+                        is_best,
+                        is_last)
+
+
 def define_loss(config: Any, device: torch.device) -> Tuple[nn.Module, nn.Module, nn.Module]:
     # [nn.L1Loss, nn.MSELoss, nn.L1Loss]:
     if config["TRAIN"]["LOSSES"]["IDENTITY_LOSS"]["NAME"] == "l1":
@@ -314,7 +548,164 @@ def define_loss(config: Any, device: torch.device) -> Tuple[nn.Module, nn.Module
     adversarial_criterion = adversarial_criterion.to(device)
     cycle_criterion = cycle_criterion.to(device)
 
-    return identity_criterion, cycle_criterion, adversarial_criterion
+    return identity_criterion, adversarial_criterion, cycle_criterion
+
+
+def define_loss_weights(config: Any, device: torch.device) -> Tuple[Tensor, Tensor, Tensor]:
+    identity_weight = torch.Tensor(config["TRAIN"]["LOSSES"]["IDENTITY_LOSS"]["WEIGHT"]).to(device)
+    adversarial_weight = torch.Tensor(config["TRAIN"]["LOSSES"]["ADVERSARIAL_LOSS"]["WEIGHT"]).to(device)
+    cycle_weight = torch.Tensor(config["TRAIN"]["LOSSES"]["CYCLE_LOSS"]["WEIGHT"]).to(device)
+
+    return identity_weight, adversarial_weight, cycle_weight
+
+
+def generator_step(
+        g_A_model: nn.Module,
+        g_B_model: nn.Module,
+        d_A_model: nn.Module,
+        d_B_model: nn.Module,
+        identity_criterion: nn.Module,
+        adversarial_criterion: nn.Module,
+        cycle_criterion: nn.Module,
+        identity_weight: Tensor,
+        adversarial_weight: Tensor,
+        cycle_weight: Tensor,
+        real_image_A: Tensor,
+        real_image_B: Tensor,
+) -> Tuple[Tensor, Tensor, Dict[str, Tensor]]:
+    # Generator fake and cycle image
+    fake_image_B = g_A_model(real_image_A)
+    recovered_image_A = g_B_model(fake_image_B)
+    fake_image_A = g_B_model(real_image_B)
+    recovered_image_B = g_A_model(fake_image_A)
+
+    # Identity loss
+    identity_image_A = g_A_model(real_image_B)
+    loss_identity_A = torch.sum(torch.mul(identity_weight, identity_criterion(identity_image_A, real_image_B)))
+    identity_image_B = g_B_model(real_image_A)
+    loss_identity_B = torch.sum(torch.mul(identity_weight, identity_criterion(identity_image_B, real_image_A)))
+
+    # GAN loss
+    fake_output_A = d_A_model(fake_image_B)
+    loss_adversarial_A = torch.sum(torch.mul(adversarial_weight,
+                                             adversarial_criterion(fake_output_A, torch.ones_like(fake_output_A))))
+    fake_output_B = d_B_model(fake_image_A)
+    loss_adversarial_B = torch.sum(torch.mul(adversarial_weight,
+                                             adversarial_criterion(fake_output_B, torch.ones_like(fake_output_B))))
+
+    # Cycle loss
+    loss_cycle_A = torch.sum(torch.mul(cycle_weight, cycle_criterion(recovered_image_A, real_image_A)))
+    loss_cycle_B = torch.sum(torch.mul(cycle_weight, cycle_criterion(recovered_image_B, real_image_B)))
+
+    # Combined loss
+    losses = {"identity": loss_identity_A + loss_identity_B,
+              "adversarial": loss_adversarial_A + loss_adversarial_B,
+              "cycle": loss_cycle_A + loss_cycle_B}
+    losses["g"] = losses["identity"] + losses["adversarial"] + losses["cycle"]
+
+    return fake_image_A, fake_image_B, losses
+
+
+def discriminator_step(
+        d_model: nn.Module,
+        adversarial_criterion: nn.Module,
+        real_image: Tensor,
+        fake_image: Tensor,
+) -> Tensor:
+    # Real image loss
+    real_output = d_model(real_image)
+    loss_real = adversarial_criterion(real_output, torch.ones_like(real_output))
+
+    # Fake image loss
+    fake_output = d_model(fake_image.detach())
+    loss_fake = adversarial_criterion(fake_output, torch.zeros_like(fake_output))
+
+    return torch.div(torch.add(loss_real, loss_fake), 2)
+
+
+def explain_graph_breaks(fn: Callable, *args) -> Tuple[int, List[str]]:
+    # `torch._dynamo.explain(fn)(*args)` returns an `ExplainOutput` from torch 2.1 on. torch 2.0 traces with
+    # `explain(fn, *args)` and returns (explanation, out_guards, graphs, ops_per_graph, break_reasons, verbose)
+    if _TORCH_VERSION >= (2, 1):
+        explanation = torch._dynamo.explain(fn)(*args)
+        return explanation.graph_break_count, [break_reason.reason for break_reason in explanation.break_reasons]
+
+    _, _, graphs, _, break_reasons, _ = torch._dynamo.explain(fn, *args)
+    return max(len(graphs) - 1, 0), [break_reason.reason for break_reason in break_reasons]
+
+
+def build_train_step(
+        config: Any,
+        g_A_model: nn.Module,
+        g_B_model: nn.Module,
+        d_A_model: nn.Module,
+        d_B_model: nn.Module,
+        identity_criterion: nn.Module,
+        adversarial_criterion: nn.Module,
+        cycle_criterion: nn.Module,
+        device: torch.device,
+) -> Tuple[Callable, Callable, Callable]:
+    identity_weight, adversarial_weight, cycle_weight = define_loss_weights(config, device)
+    generator_step_fn = generator_step
+    discriminator_step_fn = discriminator_step
+
+    step_models = [g_A_model, g_B_model, d_A_model, d_B_model]
+
+    if config["TRAIN"]["COMPILE_STEP"]["ENABLE"]:
+        # The whole step is traced, so the modules go in without their own `torch.compile` wrapper. The wrappers are
+        # kept for the step that falls back to eager, the modules flagged `COMPILED` stay compiled there
+        eager_models = [getattr(m, "_orig_mod", m) for m in step_models]
+
+        # Trace both steps once on a batch of the training shape, graph breaks split the step into eager pieces
+        image_shape = (config["TRAIN"]["HYP"]["IMGS_PER_BATCH"],
+                       config["MODEL"]["G"]["IN_CHANNELS"],
+                       config["TRAIN"]["DATASET"]["CROP_SIZE"],
+                       config["TRAIN"]["DATASET"]["CROP_SIZE"])
+        real_image = torch.randn(image_shape, device=device).contiguous(memory_format=get_memory_format(config))
+        fake_image = torch.randn(image_shape, device=device).contiguous(memory_format=get_memory_format(config))
+        max_graph_breaks = config["TRAIN"]["COMPILE_STEP"]["MAX_GRAPH_BREAKS"]
+        # The trace runs the models in train mode, on copies so that the random batches do not end up in the running
+        # statistics of the norms
+        traced_models = copy.deepcopy(eager_models)
+        with amp.autocast(enabled=device.type == "cuda"):
+            g_graph_breaks, g_break_reasons = explain_graph_breaks(generator_step,
+                                                                   *traced_models,
+                                                                   identity_criterion,
+                                                                   adversarial_criterion,
+                                                                   cycle_criterion,
+                                                                   identity_weight,
+                                                                   adversarial_weight,
+                                                                   cycle_weight,
+                                                                   real_image,
+                                                                   fake_image)
+            d_graph_breaks, d_break_reasons = explain_graph_breaks(discriminator_step,
+                                                                   traced_models[2],
+                                                                   adversarial_criterion,
+                                                                   real_image,
+                                                                   fake_image)
+        del traced_models
+        torch._dynamo.reset()
+
+        graph_break_count = g_graph_breaks + d_graph_breaks
+        if graph_break_count > max_graph_breaks:
+            print(f"Train step compilation disabled, {graph_break_count} graph breaks "
+                  f"(`MAX_GRAPH_BREAKS: {max_graph_breaks}`), running the step eagerly:")
+            for break_reason in g_break_reasons + d_break_reasons:
+                print(f"  {break_reason}")
+        else:
+            generator_step_fn = compile_model(generator_step, config["MODEL"]["COMPILE_MODE"])
+            discriminator_step_fn = compile_model(discriminator_step, config["MODEL"]["COMPILE_MODE"])
+            print(f"Compiled the generator and discriminator train steps ({graph_break_count} graph breaks).")
+            step_models = eager_models
+
+    g_A_model, g_B_model, d_A_model, d_B_model = step_models
+
+    return (partial(generator_step_fn,
+                    g_A_model, g_B_model, d_A_model, d_B_model,
+                    identity_criterion, adversarial_criterion, cycle_criterion,
+                    identity_weight, adversarial_weight, cycle_weight),
+            partial(discriminator_step_fn, d_A_model, adversarial_criterion),
+            partial(discriminator_step_fn, d_B_model, adversarial_criterion))
 
 
 def define_optimizer(
@@ -364,22 +755,29 @@ def train(
         ema_g_B_model: nn.Module,
         d_A_model: nn.Module,
         d_B_model: nn.Module,
-        train_data_prefetcher: CUDAPrefetcher,
-        identity_criterion: nn.L1Loss,
-        adversarial_criterion: nn.MSELoss,
-        cycle_criterion: nn.L1Loss,
+        train_data_prefetcher: DevicePrefetcher,
+        generator_step_fn: Callable,
+        discriminator_A_step_fn: Callable,
+        discriminator_B_step_fn: Callable,
         g_optimizer: optim.Adam,
         d_optimizer: optim.Adam,
+        g_scheduler: lr_scheduler.LambdaLR,
+        d_scheduler: lr_scheduler.LambdaLR,
         fake_A_buffer: ReplayBuffer,
         fake_B_buffer: ReplayBuffer,
         epoch: int,
+        start_batch_index: int,
+        augment_generator: torch.Generator,
         scaler: amp.GradScaler,
         writer: SummaryWriter,
+        samples_dir: str,
+        results_dir: str,
         device: torch.device,
         config: Any,
+        report_step_time: bool = False,
 ) -> None:
-    # Calculate how many batches of data are in each Epoch
-    batches = len(train_data_prefetcher)
+    # Calculate how many batches of data are in each Epoch, a resumed epoch only loads the remaining batches
+    batches = len(train_data_prefetcher) + start_batch_index
     # Print information of progress bar during training
     batch_time = AverageMeter("Time", ":6.3f", Summary.NONE)
     data_time = AverageMeter("Data", ":6.3f", Summary.NONE)
@@ -396,19 +794,23 @@ def train(
     g_A_model.train()
     g_B_model.train()
 
-    identity_weight = torch.Tensor(config["TRAIN"]["LOSSES"]["IDENTITY_LOSS"]["WEIGHT"]).to(device)
-    adversarial_weight = torch.Tensor(config["TRAIN"]["LOSSES"]["ADVERSARIAL_LOSS"]["WEIGHT"]).to(device)
-    cycle_weight = torch.Tensor(config["TRAIN"]["LOSSES"]["CYCLE_LOSS"]["WEIGHT"]).to(device)
-
     # Initialize the number of data batches to print logs on the terminal
-    batch_index = 0
+    batch_index = start_batch_index
 
     # Initialize the data loader and load the first batch of data
     train_data_prefetcher.reset()
     batch_data = train_data_prefetcher.next()
 
+    # A checkpoint written after the last batch of an epoch resumes into an epoch with nothing left to load
+    if batch_data is None:
+        print(f"Epoch: [{epoch + 1}] has no batches left to load after batch {start_batch_index}.")
+        return
+
     batch_size = batch_data["src"].size(0)
 
+    # Step times of the first batches, they include the compilation of the models
+    startup_step_times = []
+
     # Get the initialization training time
     end = time.time()
 
@@ -416,17 +818,22 @@ def train(
         # Calculate the time it takes to load a batch of data
         data_time.update(time.time() - end)
 
-        # Transfer in-memory data to CUDA devices to speed up training
-        real_image_A = batch_data["src"].to(device, non_blocking=True)
-        real_image_B = batch_data["dst"].to(device, non_blocking=True)
-
-        # image data augmentation
-        real_image_A, real_image_B = random_crop_torch(real_image_A,
-                                                       real_image_B,
-                                                       config["TRAIN"]["DATASET"]["IMAGE_SIZE"])
-        real_image_A, real_image_B = random_rotate_torch(real_image_A, real_image_B, [0, 90, 180, 270])
-        real_image_A, real_image_B = random_vertically_flip_torch(real_image_A, real_image_B)
-        real_image_A, real_image_B = random_horizontally_flip_torch(real_image_A, real_image_B)
+        # The prefetcher already placed the batch on the running device
+        real_image_A = batch_data["src"]
+        real_image_B = batch_data["dst"]
+
+        # image data augmentation, the random crop is already taken in the data loader workers
+        if config["TRAIN"]["DATASET"]["AUGMENT"] == "device":
+            # Every sample draws its own rotation and flips, unpaired domains independently of each other, and all of
+            # them are applied in a single gather per domain
+            real_image_A, real_image_B = fused_augment_batch_torch(real_image_A,
+                                                                   real_image_B,
+                                                                   None,
+                                                                   not config["TRAIN"]["DATASET"]["UNPAIRED"],
+                                                                   augment_generator)
+            # The gather writes contiguous batches, the prefetcher left the conversion to this point
+            real_image_A = real_image_A.contiguous(memory_format=get_memory_format(config))
+            real_image_B = real_image_B.contiguous(memory_format=get_memory_format(config))
 
         ##############################################
         # (1) Update G network: Generators A2B and B2A
@@ -442,33 +849,9 @@ def train(
             d_parameters.requires_grad = False
 
         # Mixed precision training
-        with amp.autocast():
-            # Generator fake and cycle image
-            fake_image_B = g_A_model(real_image_A)
-            recovered_image_A = g_B_model(fake_image_B)
-            fake_image_A = g_B_model(real_image_B)
-            recovered_image_B = g_A_model(fake_image_A)
-
-            # Identity loss
-            identity_image_A = g_A_model(real_image_B)
-            loss_identity_A = torch.sum(torch.mul(identity_weight, identity_criterion(identity_image_A, real_image_B)))
-            identity_image_B = g_B_model(real_image_A)
-            loss_identity_B = torch.sum(torch.mul(identity_weight, identity_criterion(identity_image_B, real_image_A)))
-
-            # GAN loss
-            fake_output_A = d_A_model(fake_image_B)
-            real_label = torch.tensor(1).expand_as(fake_output_A).to(device, non_blocking=True)
-            loss_adversarial_A = torch.sum(torch.mul(adversarial_weight, adversarial_criterion(fake_output_A, real_label)))
-            fake_output_B = d_B_model(fake_image_A)
-            real_label = torch.tensor(1).expand_as(fake_output_B).to(device, non_blocking=True)
-            loss_adversarial_B = torch.sum(torch.mul(adversarial_weight, adversarial_criterion(fake_output_B, real_label)))
-
-            # Cycle loss
-            loss_cycle_A = torch.sum(torch.mul(cycle_weight, cycle_criterion(recovered_image_A, real_image_A)))
-            loss_cycle_B = torch.sum(torch.mul(cycle_weight, cycle_criterion(recovered_image_B, real_image_B)))
-
-            # Combined loss and calculate gradients
-            g_loss = loss_identity_A + loss_identity_B + loss_adversarial_A + loss_adversarial_B + loss_cycle_A + loss_cycle_B
+        with amp.autocast(enabled=device.type == "cuda"):
+            fake_image_A, fake_image_B, g_step_losses = generator_step_fn(real_image_A, real_image_B)
+            g_loss = g_step_losses["g"]
 
         # Backpropagation
         scaler.scale(g_loss).backward()
@@ -477,8 +860,9 @@ def train(
         scaler.update()
 
         # Update EMA
-        ema_g_A_model.update_parameters(g_A_model)
-        ema_g_B_model.update_parameters(g_B_model)
+        if ema_g_A_model is not None:
+            ema_g_A_model.update_parameters(g_A_model)
+            ema_g_B_model.update_parameters(g_B_model)
 
         fake_image_A = fake_A_buffer.push_and_pop(fake_image_A)
         fake_image_B = fake_B_buffer.push_and_pop(fake_image_B)
@@ -495,19 +879,8 @@ def train(
             d_parameters.requires_grad = True
 
         # Mixed precision training
-        with amp.autocast():
-            # Real A image loss
-            real_output_A = d_A_model(real_image_B)
-            real_label = torch.tensor(1).expand_as(real_output_A).to(device, non_blocking=True)
-            loss_real_A = adversarial_criterion(real_output_A, real_label)
-
-            # Fake A image loss
-            fake_output_A = d_A_model(fake_image_B.detach())
-            fake_label = torch.tensor(0).expand_as(fake_output_A).to(device, non_blocking=True)
-            loss_fake_A = adversarial_criterion(fake_output_A, fake_label)
-
-            # Combined loss and calculate gradients
-            loss_d_A = torch.div(torch.add(loss_real_A, loss_fake_A), 2)
+        with amp.autocast(enabled=device.type == "cuda"):
+            loss_d_A = discriminator_A_step_fn(real_image_B, fake_image_B)
 
         # Backpropagation
         scaler.scale(loss_d_A).backward()
@@ -524,19 +897,8 @@ def train(
             d_parameters.requires_grad = True
 
         # Mixed precision training
-        with amp.autocast():
-            # Real B image loss
-            real_output_B = d_B_model(real_image_A)
-            real_label = torch.tensor(1).expand_as(real_output_B).to(device, non_blocking=True)
-            loss_real_B = adversarial_criterion(real_output_B, real_label)
-
-            # Fake B image loss
-            fake_output_B = d_B_model(fake_image_A.detach())
-            fake_label = torch.tensor(0).expand_as(fake_output_B).to(device, non_blocking=True)
-            loss_fake_B = adversarial_criterion(fake_output_B, fake_label)
-
-            # Combined loss and calculate gradients
-            loss_d_B = torch.div(torch.add(loss_real_B, loss_fake_B), 2)
+        with amp.autocast(enabled=device.type == "cuda"):
+            loss_d_B = discriminator_B_step_fn(real_image_A, fake_image_A)
 
         # Backpropagation
         scaler.scale(loss_d_B).backward()
@@ -552,6 +914,12 @@ def train(
         batch_time.update(time.time() - end)
         end = time.time()
 
+        # Report the compile time next to the steady-state step time once, right after startup
+        if report_step_time and len(startup_step_times) < _STARTUP_WARMUP_STEPS + _STARTUP_STEADY_STEPS:
+            startup_step_times.append(batch_time.val)
+            if len(startup_step_times) == _STARTUP_WARMUP_STEPS + _STARTUP_STEADY_STEPS:
+                report_startup_step_time(startup_step_times, writer, epoch * batches + batch_index)
+
         # Write the data during training to the training log file
         if batch_index % config["TRAIN"]["PRINT_FREQ"] == 0:
             total_batch_index = batch_index + epoch * batches
@@ -560,9 +928,9 @@ def train(
             writer.add_scalar("Train/D(A)_Loss", loss_d_A.item(), total_batch_index)
             writer.add_scalar("Train/D(B)_Loss", loss_d_B.item(), total_batch_index)
             writer.add_scalar("Train/D_Loss", (loss_d_A + loss_d_B).item(), total_batch_index)
-            writer.add_scalar("Train/Identity_Loss", (loss_identity_A + loss_identity_B).item(), total_batch_index)
-            writer.add_scalar("Train/Adversarial_Loss", (loss_adversarial_B + loss_adversarial_A).item(), total_batch_index)
-            writer.add_scalar("Train/Cycle_Loss", (loss_cycle_A + loss_cycle_B).item(), total_batch_index)
+            writer.add_scalar("Train/Identity_Loss", g_step_losses["identity"].item(), total_batch_index)
+            writer.add_scalar("Train/Adversarial_Loss", g_step_losses["adversarial"].item(), total_batch_index)
+            writer.add_scalar("Train/Cycle_Loss", g_step_losses["cycle"].item(), total_batch_index)
             writer.add_scalar("Train/G_Loss", g_loss.item(), total_batch_index)
             progress.display(batch_index + 1)
 
@@ -572,6 +940,26 @@ def train(
         # Add 1 to the number of data batches to ensure that the terminal prints data normally
         batch_index += 1
 
+        # Step-level checkpoint, resuming from it fast-forwards the sampler to the next batch
+        save_steps = config["TRAIN"]["CHECKPOINT"]["SAVE_STEPS"]
+        if save_steps > 0 and batch_index % save_steps == 0 and batch_index != batches:
+            save_train_checkpoints(g_A_model,
+                                   g_B_model,
+                                   ema_g_A_model,
+                                   ema_g_B_model,
+                                   d_A_model,
+                                   d_B_model,
+                                   g_optimizer,
+                                   d_optimizer,
+                                   g_scheduler,
+                                   d_scheduler,
+                                   get_data_state(train_data_prefetcher, epoch, batch_index, batch_size, augment_generator),
+                                   "step",
+                                   samples_dir,
+                                   results_dir,
+                                   False,
+                                   False)
+
         # Save training image
         if batch_index == batches:
             save_image(real_image_A,
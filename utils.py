@@ -16,8 +16,9 @@ import random
 import shutil
 from collections import OrderedDict
 from enum import Enum
-from typing import Any, Union, Tuple, Type
+from typing import Any, Callable, Union, Tuple, Type
 
+import numpy as np
 import torch
 import torch.backends.mps
 from torch import nn, Tensor
@@ -25,10 +26,15 @@ from torch.nn import Module
 from torch.optim import Optimizer
 
 __all__ = [
-    "load_state_dict", "load_pretrained_state_dict", "load_resume_state_dict", "make_directory", "save_checkpoint",
+    "load_state_dict", "get_state_dict", "compile_model", "load_pretrained_state_dict", "load_resume_state_dict",
+    "load_resume_data_state",
+    "get_rng_state", "set_rng_state", "make_directory", "save_checkpoint",
     "ReplayBuffer", "DecayLR", "Summary", "AverageMeter", "ProgressMeter",
 ]
 
+# Name of the attribute `torch.compile` stores the original module under, it prefixes every parameter name
+_COMPILE_PREFIX = "_orig_mod."
+
 
 def load_state_dict(
         model: nn.Module,
@@ -37,41 +43,30 @@ def load_state_dict(
 ):
     """Load model weights and parameters
 
+    Weights saved from a compiled model load into an eager model and the other way around, the ``_orig_mod`` prefix
+    that `torch.compile` puts in front of the parameter names is matched against the keys of ``model``.
+
     Args:
         model (nn.Module): model
-        compile_mode (bool): Enable model compilation mode, `False` means not compiled, `True` means compiled
+        compile_mode (bool): Enable model compilation mode, `False` means not compiled, `True` means compiled.
+            Only kept for compatibility, the compilation state is read from the parameter names of ``model``
         state_dict (dict): model weights and parameters waiting to be loaded
 
     Returns:
         model (nn.Module): model after loading weights and parameters
     """
 
-    # Define compilation status keywords
-    compile_state = "_orig_mod"
-
     # Process parameter dictionary
     model_state_dict = model.state_dict()
-    new_state_dict = OrderedDict()
 
-    # Check if the model has been compiled
+    # Map the compile-independent names to the names used by the current model, an EMA model carries the prefix
+    # after its own `module.` prefix
+    model_keys = {_strip_compile_prefix(k): k for k in model_state_dict.keys()}
+    new_state_dict = OrderedDict()
     for k, v in state_dict.items():
-        current_compile_state = k.split(".")[0]
-        if compile_mode and current_compile_state != compile_state:
-            raise RuntimeError("The model is not compiled. Please use `model = torch.compile(model)`.")
-
-        # load the model
-        if compile_mode and current_compile_state != compile_state:
-            name = compile_state + "." + k
-        elif not compile_mode and current_compile_state == compile_state:
-            name = k[10:]
-        else:
-            name = k
-        new_state_dict[name] = v
-    state_dict = new_state_dict
-
-    # Traverse the model parameters, load the parameters in the pre-trained model into the current model
-    new_state_dict = {k: v for k, v in state_dict.items() if
-                      k in model_state_dict.keys() and v.size() == model_state_dict[k].size()}
+        name = model_keys.get(_strip_compile_prefix(k))
+        if name is not None and v.size() == model_state_dict[name].size():
+            new_state_dict[name] = v
 
     # update model parameters
     model_state_dict.update(new_state_dict)
@@ -80,6 +75,39 @@ def load_state_dict(
     return model
 
 
+def get_state_dict(model: nn.Module) -> OrderedDict:
+    """Model weights and parameters without the `torch.compile` prefix, loadable by compiled and eager models alike
+
+    Args:
+        model (nn.Module): model, compiled or not
+
+    Returns:
+        state_dict (OrderedDict): model weights and parameters
+    """
+    return OrderedDict((_strip_compile_prefix(k), v) for k, v in model.state_dict().items())
+
+
+def compile_model(model: Union[nn.Module, Callable], compile_mode: str = "default") -> Union[nn.Module, Callable]:
+    """Compile a model, or a function running models, with `torch.compile`
+
+    Args:
+        model (nn.Module | Callable): model or function
+        compile_mode (str, optional): `torch.compile` mode, one of `default`, `reduce-overhead` and `max-autotune`.
+            Default: ``default``
+
+    Returns:
+        model (nn.Module | Callable): compiled model or function, a compiled model shares its parameters with ``model``
+    """
+    if compile_mode not in ["default", "reduce-overhead", "max-autotune"]:
+        raise NotImplementedError(f"Compile mode {compile_mode} is not implemented.")
+
+    return torch.compile(model, mode=compile_mode)
+
+
+def _strip_compile_prefix(key: str) -> str:
+    return key.replace(_COMPILE_PREFIX, "")
+
+
 def load_pretrained_state_dict(
         model: nn.Module,
         compile_state: bool,
@@ -151,6 +179,42 @@ def load_resume_state_dict(
         return model, ema_model, start_epoch, optimizer
 
 
+def load_resume_data_state(model_weights_path: str) -> Union[dict, None]:
+    """Load the data loading position stored with a training checkpoint
+
+    Args:
+        model_weights_path (str): model weights path
+
+    Returns:
+        data_state (dict | None): epoch, batch index, sampler state and RNG states, ``None`` for checkpoints without it
+    """
+    checkpoint = torch.load(model_weights_path, map_location=lambda storage, loc: storage)
+
+    return checkpoint.get("data_state")
+
+
+def get_rng_state() -> dict:
+    """Collect the states of all random number generators used during training"""
+    rng_state = {
+        "python": random.getstate(),
+        "numpy": np.random.get_state(),
+        "torch": torch.get_rng_state(),
+    }
+    if torch.cuda.is_available():
+        rng_state["cuda"] = torch.cuda.get_rng_state_all()
+
+    return rng_state
+
+
+def set_rng_state(rng_state: dict) -> None:
+    """Restore the random number generator states collected by :func:`get_rng_state`"""
+    random.setstate(rng_state["python"])
+    np.random.set_state(rng_state["numpy"])
+    torch.set_rng_state(rng_state["torch"])
+    if "cuda" in rng_state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(rng_state["cuda"])
+
+
 def make_directory(dir_path: str) -> None:
     if not os.path.exists(dir_path):
         os.makedirs(dir_path)
@@ -188,9 +252,10 @@ class DecayLR:
 
 
 class ReplayBuffer:
-    def __init__(self, max_size: int = 50) -> None:
+    def __init__(self, max_size: int = 50, memory_format: torch.memory_format = torch.contiguous_format) -> None:
         assert (max_size > 0), "Empty buffer or trying to create a black hole. Be careful."
         self.max_size = max_size
+        self.memory_format = memory_format
         self.data = []
 
     def push_and_pop(self, data: Tensor) -> Tensor:
@@ -207,7 +272,8 @@ class ReplayBuffer:
                     self.data[i] = element
                 else:
                     to_return.append(element)
-        return torch.cat(to_return)
+        # No copy when the images already came in with the memory format of the buffer
+        return torch.cat(to_return).contiguous(memory_format=self.memory_format)
 
 
 class Summary(Enum):